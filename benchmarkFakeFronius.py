@@ -0,0 +1,96 @@
+import datetime
+import pytest
+import pytz
+
+from fronius import FroniusInverter
+from fronius import FroniusArchiveJson
+from fronius import FroniusRealTimeJson
+from fakeFronius import FakeFroniusServer
+
+#
+# throughput benchmarks of the public methods against a local fake inverter. requires pytest-benchmark:
+#   python -m pytest benchmarkFakeFronius.py
+#
+
+pytest.importorskip("pytest_benchmark")
+
+from_date = pytz.utc.localize(datetime.datetime(2017, 11, 1), is_dst=None)
+all_channels = FroniusInverter.get_all_channels()
+
+
+@pytest.fixture(scope="module", params=[0.0, 0.05], ids=["no-latency", "50ms-latency"])
+def server(request):
+    with FakeFroniusServer(latency=request.param, utc_offset=datetime.timedelta(hours=1), inverters=2) as server:
+        yield server
+
+
+@pytest.fixture
+def inverter(server):
+    with FroniusInverter(server.host) as fi:
+        yield fi
+
+
+@pytest.fixture(scope="module")
+def archive_json():
+    with FakeFroniusServer(utc_offset=datetime.timedelta(hours=1), inverters=2) as server:
+        with FroniusInverter(server.host) as fi:
+            return fi.get_historical_data_json(from_date, from_date + FroniusInverter.max_query_time
+                                               - datetime.timedelta(seconds=1), all_channels)
+
+
+def rows(data):
+    return sum(len(df) for df in data.values())
+
+
+def test_fetch_realtime_data(benchmark, inverter):
+    json = benchmark(inverter.get_inverter_realtime_data)
+    assert FroniusRealTimeJson(json).error_code() == 0
+
+
+def test_fetch_archive_json(benchmark, inverter):
+    to_date = from_date + datetime.timedelta(days=1)
+    json = benchmark(inverter.get_historical_data_json, from_date, to_date, all_channels)
+    assert FroniusArchiveJson(json).error_code() == 0
+
+
+def test_parse_archive_data(benchmark, archive_json):
+    data = benchmark(FroniusArchiveJson(archive_json).data)
+    benchmark.extra_info["rows"] = rows(data)
+
+
+def test_parse_realtime_data(benchmark):
+    with FakeFroniusServer() as server:
+        with FroniusInverter(server.host) as fi:
+            json = fi.get_inverter_realtime_data()
+    benchmark(FroniusRealTimeJson(json).data)
+
+
+@pytest.mark.parametrize("max_workers", [None, 4])
+def test_get_historical_data(benchmark, inverter, max_workers):
+    to_date = from_date + datetime.timedelta(days=60)
+    data = benchmark.pedantic(inverter.get_historical_data, args=(from_date, to_date, all_channels),
+                              kwargs={"max_workers": max_workers}, rounds=3)
+    benchmark.extra_info["rows"] = rows(data)
+    benchmark.extra_info["requests"] = len(inverter._query_windows(from_date, to_date))
+
+
+def test_find_earliest_data(benchmark):
+    # the search expects a single inverter
+    with FakeFroniusServer(first_data=from_date) as server:
+        with FroniusInverter(server.host) as fi:
+            found = benchmark.pedantic(fi.find_earliest_data, rounds=3)
+    assert found == from_date
+
+
+@pytest.mark.parametrize("metrics", [None, ["energy"], ["realtime"]], ids=["all-channels", "energy", "realtime"])
+def test_get_planned_historical_data(benchmark, inverter, metrics):
+    to_date = from_date + datetime.timedelta(days=30)
+
+    def fetch():
+        plan = FroniusInverter.plan_historical_data(metrics=metrics)
+        inverter.get_planned_historical_data(plan, from_date, to_date)
+        return plan
+
+    plan = benchmark.pedantic(fetch, rounds=3)
+    benchmark.extra_info["requests"] = plan.requests
+    benchmark.extra_info["received_bytes"] = plan.received_bytes
@@ -0,0 +1,263 @@
+import os
+import json
+import timeit
+import concurrent.futures
+import datetime
+import dateutil.parser
+
+import numpy as np
+import pandas as pd
+
+from fronius import FroniusInverter
+from fronius import FroniusArchiveJson
+from fronius import FroniusArchiveBatch
+from fronius import FroniusJsonDecoder
+from fronius import FroniusEventLog
+from fronius import FroniusEnergyRollup
+from fronius import FroniusBackfill
+from fronius import _decode_archive_window
+from fronius import FroniusRealTimeBuffer
+
+from sampleData import make_archive_json
+from sampleData import legacy_archive_data
+from sampleData import legacy_merge_windows
+from sampleData import realtime_samples
+
+#
+# micro-benchmarks that don't need to connect to the network
+#
+
+
+def report(name, seconds, number):
+    print("{:<45} {:10.3f} ms".format(name, 1000 * seconds / number))
+
+
+def bench_archive_data(number=5):
+    json = make_archive_json()
+    faj = FroniusArchiveJson(json)
+
+    for key, value in legacy_archive_data(faj).items():
+        pd.testing.assert_frame_equal(value, faj.data()[key])
+
+    report("FroniusArchiveJson.data (merge)", timeit.timeit(lambda: legacy_archive_data(faj), number=number), number)
+    report("FroniusArchiveJson.data (columnar)", timeit.timeit(lambda: faj.data(), number=number), number)
+
+
+def bench_realtime_append(sizes=(100, 1000, 4000), window=100):
+    """cost per append, measured over the last window appends after size samples were accumulated"""
+    for size in sizes:
+        samples = list(realtime_samples(size + window))
+
+        df = None
+        for frt in samples[:size]:
+            df = frt.data(append=df)
+        start = timeit.default_timer()
+        for frt in samples[size:]:
+            df = frt.data(append=df)
+        report("data(append=DataFrame) at " + str(size), timeit.default_timer() - start, window)
+
+        store = FroniusRealTimeBuffer(size + window)
+        for frt in samples[:size]:
+            store.append(frt)
+        start = timeit.default_timer()
+        for frt in samples[size:]:
+            store.append(frt)
+        report("FroniusRealTimeBuffer.append at " + str(size), timeit.default_timer() - start, window)
+
+
+def bench_merge_windows(counts=(1, 10, 100), channels=("TimeSpanInSec", "PowerReal_PAC_Sum")):
+    """cost per window of merging count consecutive one day windows, as get_historical_data does"""
+    fi = FroniusInverter("localhost")
+    start = datetime.datetime(2017, 10, 1, tzinfo=datetime.timezone.utc)
+    for count in counts:
+        responses = [make_archive_json(days=1, channels=list(channels), start=start + datetime.timedelta(days=i))
+                     for i in range(count)]
+        from_date = start + datetime.timedelta(hours=1)
+        to_date = start + datetime.timedelta(days=count)
+
+        seconds = timeit.timeit(lambda: legacy_merge_windows(fi, responses, from_date, to_date), number=1)
+        report("merge per window, re-sort (" + str(count) + " windows)", seconds, count)
+
+        def merge():
+            frames = fi._iter_archive_frames(responses, from_date, to_date, False)
+            return fi._concat_frames(frames, from_date, to_date, True)
+        report("merge per window, concat once (" + str(count) + " windows)", timeit.timeit(merge, number=1), count)
+
+
+def bench_header_dates(count=2000):
+    """parse start, end and timestamp of count stored archive responses, each read three times"""
+    responses = [make_archive_json(days=1, channels=["TimeSpanInSec"],
+                                   start=datetime.datetime(2017, 10, 1, tzinfo=datetime.timezone.utc)
+                                   + datetime.timedelta(days=i)) for i in range(count)]
+
+    def legacy():
+        for json in responses:
+            for i in range(3):
+                dateutil.parser.parse(json["Head"]["RequestArguments"]["StartDate"])
+                dateutil.parser.parse(json["Head"]["RequestArguments"]["EndDate"])
+                dateutil.parser.parse(json["Head"]["Timestamp"])
+
+    def memoized():
+        for json in responses:
+            faj = FroniusArchiveJson(json)
+            for i in range(3):
+                faj.start_date()
+                faj.end_date()
+                faj.timestamp()
+
+    report("header dates, dateutil (per response)", timeit.timeit(legacy, number=1), count)
+    report("header dates, memoized (per response)", timeit.timeit(memoized, number=1), count)
+
+
+def bench_compact_dtypes(days=(1, 15)):
+    """memory of the default and the compact archive frames, and the cost of the conversion"""
+    for count in days:
+        faj = FroniusArchiveJson(make_archive_json(days=count))
+        default = faj.data()["inverter/1"].memory_usage(deep=True).sum()
+        compact = faj.data(dtypes=True)["inverter/1"].memory_usage(deep=True).sum()
+        print("%-45s %10d bytes default, %10d bytes compact (%.0f%%)"
+              % ("archive frame, %d days" % count, default, compact, 100.0 * compact / default))
+        report("data(), %d days, default dtypes" % count, timeit.timeit(faj.data, number=5), 5)
+        report("data(), %d days, compact dtypes" % count, timeit.timeit(lambda: faj.data(dtypes=True), number=5), 5)
+
+
+def bench_archive_batch(count=30, days=1):
+    """decode count stored responses into one frame per device: a frame per response and concat, or one batch"""
+    start = datetime.datetime(2017, 10, 1, tzinfo=datetime.timezone.utc)
+    responses = [make_archive_json(days=days, start=start + datetime.timedelta(days=i)) for i in range(count)]
+    fi = FroniusInverter("localhost")
+
+    def concat():
+        fi._concat_frames(fi._iter_archive_frames(responses, None, None, False))
+
+    def batch():
+        FroniusArchiveBatch(responses).data()
+
+    report("%d responses, data() and concat" % count, timeit.timeit(concat, number=3), 3)
+    report("%d responses, FroniusArchiveBatch" % count, timeit.timeit(batch, number=3), 3)
+
+
+def bench_json_decoder(days=15, number=10):
+    """decode a recorded 24-channel archive body: requests' r.json() path, stdlib, the default decoder, skip_keys"""
+    content = json.dumps(make_archive_json(days=days)).encode()
+    decoders = [("json.loads(text)", lambda: json.loads(content.decode("utf-8"))),
+                ("json.loads(bytes)", lambda: FroniusJsonDecoder(loads=json.loads)(content)),
+                ("default decoder", lambda: FroniusJsonDecoder()(content)),
+                ("default decoder, skip_keys", lambda: FroniusJsonDecoder(skip_keys=("_comment", "Unit"))(content))]
+    for name, decode in decoders:
+        report("%s, %d bytes" % (name, len(content)), timeit.timeit(decode, number=number), number)
+
+
+def bench_event_query(hosts=200, days=365, per_day=24, codes=50):
+    """one code over a year of events of hosts inverters: indexed FroniusEventLog.query or a full DataFrame scan"""
+    start = datetime.datetime(2017, 1, 1, tzinfo=datetime.timezone.utc)
+    count = days * per_day
+    ts = pd.Timestamp(start) + pd.to_timedelta(np.arange(count) * (86400 // per_day), unit="s")
+    log = FroniusEventLog()
+    frames = []
+    for i in range(hosts):
+        events = pd.DataFrame({"ts": ts, "device": pd.Categorical(["inverter/1"] * count),
+                               "code": ((np.arange(count) * 7 + i) % codes).astype(np.int32),
+                               "category": pd.Categorical(["error"] * count, categories=["error", "event"])})
+        log._append("inverter-%d" % i, events, start, start + datetime.timedelta(days=days))
+        frames.append(events.assign(host="inverter-%d" % i))
+    table = pd.concat(frames, ignore_index=True)
+    log.query(code=0)
+
+    from_date = start + datetime.timedelta(days=days // 2)
+    report("%d events, scan for one code" % len(table),
+           timeit.timeit(lambda: table[(table["code"] == 7) & (table["ts"] >= from_date)], number=10), 10)
+    report("%d events, indexed query" % len(table),
+           timeit.timeit(lambda: log.query(code=7, from_date=from_date), number=10), 10)
+
+
+def bench_energy_rollup(years=3, step=300):
+    """
+        daily energy after a new day of samples: recomputed with a pandas group-by over all raw samples,
+        or updated incrementally by FroniusEnergyRollup. then a year-over-year query of the monthly totals
+    """
+    ts = pd.date_range("2017-01-01", periods=years * 365 * 86400 // step, freq=str(step) + "s", tz="UTC")
+    df = pd.DataFrame({"ts": ts, "EnergyReal_WAC_Sum_Produced": np.arange(len(ts)) % 97 * 1.0, "TimeSpanInSec": step})
+    day = 86400 // step
+    rollup = FroniusEnergyRollup("Europe/Vienna")
+    rollup.add("inverter", {"inverter/1": df.iloc[:-day]})
+
+    def group_by():
+        local = df["ts"].dt.tz_convert("Europe/Vienna").dt.floor("D", ambiguous=False, nonexistent="shift_forward")
+        return df.groupby(local)["EnergyReal_WAC_Sum_Produced"].sum()
+
+    report("%d samples, daily group-by" % len(df), timeit.timeit(group_by, number=3), 3)
+    report("%d samples, incremental rollup of a day" % len(df),
+           timeit.timeit(lambda: rollup.add("inverter", {"inverter/1": df.iloc[-day:]}), number=10), 10)
+
+    def year_over_year():
+        months = rollup.rollup("month")
+        return months.pivot_table("kWh", months["start"].dt.month, months["start"].dt.year)
+
+    report("year over year from monthly rollup", timeit.timeit(year_over_year, number=100), 100)
+
+
+def bench_range_selection(days=365, step=300, number=100):
+    """one day out of a year of samples: a boolean mask on the timestamp column, or a slice of the sorted time index"""
+    fi = FroniusInverter("localhost")
+    ts = pd.date_range("2017-01-01", periods=days * 86400 // step, freq=str(step) + "s", tz="UTC")
+    df = pd.DataFrame({"ts": ts, "PowerReal_PAC_Sum": np.arange(len(ts)) % 1000 * 1.0})
+    indexed = df.set_index("ts")
+    from_date = datetime.datetime(2017, 7, 1, tzinfo=datetime.timezone.utc)
+    to_date = from_date + datetime.timedelta(days=1)
+    report("%d samples, strict range of the column" % len(df),
+           timeit.timeit(lambda: fi._strict_range(df, from_date, to_date), number=number), number)
+    report("%d samples, strict range of the index" % len(df),
+           timeit.timeit(lambda: fi._strict_range(indexed, from_date, to_date), number=number), number)
+
+
+def bench_backfill_decode(count=32, days=15, workers=(1, 2, 4, 8)):
+    """
+        decode count response bodies into frames, as FroniusBackfill does: in this process, or in a pool
+        of worker processes, by number of workers. the pool is started before timing
+    """
+    start = datetime.datetime(2017, 10, 1, tzinfo=datetime.timezone.utc)
+    windows = [(start + i * datetime.timedelta(days=days), start + (i + 1) * datetime.timedelta(days=days))
+               for i in range(count)]
+    contents = [json.dumps(make_archive_json(days=days, start=fdate)).encode() for fdate, tdate in windows]
+    backfill = FroniusBackfill(dtypes=True)
+
+    def decode(submit):
+        futures = [submit(_decode_archive_window, content, fdate, tdate, True)
+                   for content, (fdate, tdate) in zip(contents, windows)]
+        return backfill._frames(future.result() for future in futures)
+
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        report("%d responses, decoded in this process" % count,
+               timeit.timeit(lambda: decode(executor.submit), number=1), 1)
+    for max_workers in workers:
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            list(executor.map(abs, range(max_workers)))
+            report("%d responses, %d processes (%d cores)" % (count, max_workers, os.cpu_count()),
+                   timeit.timeit(lambda: decode(executor.submit), number=1), 1)
+
+
+def bench_channel_values(days=15, number=5):
+    """one channel of a response with all channels: FroniusArchiveJson.values, or data() of every channel"""
+    json = make_archive_json(days=days)
+    report("%d days, data() of every channel" % days,
+           timeit.timeit(lambda: FroniusArchiveJson(json).data()["inverter/1"]["PowerReal_PAC_Sum"], number=number),
+           number)
+    report("%d days, values() of one channel" % days,
+           timeit.timeit(lambda: FroniusArchiveJson(json).values("inverter/1", "PowerReal_PAC_Sum"), number=number),
+           number)
+
+
+if __name__ == '__main__':
+    bench_archive_data()
+    bench_realtime_append()
+    bench_merge_windows()
+    bench_header_dates()
+    bench_compact_dtypes()
+    bench_archive_batch()
+    bench_json_decoder()
+    bench_event_query()
+    bench_energy_rollup()
+    bench_range_selection()
+    bench_backfill_decode()
+    bench_channel_values()
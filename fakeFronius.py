@@ -0,0 +1,236 @@
+import json
+import time
+import datetime
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from fronius import FroniusInverter
+
+#
+# local stand-in for a Fronius datalogger implementing the parts of Solar API v1 used by this module.
+# serves generated data, so tests and benchmarks can run without the physical inverter
+#
+
+datamanager_id = "datamanager:/dc/f0056cc6/"
+datamanager_channels = ["Digital_PowerManagementRelay_Out_1"]
+event_channels = {"InverterErrors": (6 * 3600, 100, 5), "InverterEvents": (8 * 3600, 500, 3)}
+""" every (step seconds, first code, number of codes) an event with the next code is logged """
+
+
+def _parse_date(value):
+    # requests serializes datetimes with str(), i.e. '2017-11-01 00:00:00+00:00'
+    date = datetime.datetime.fromisoformat(value.replace(" ", "T"))
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date
+
+
+def _status(code=0, reason=""):
+    return {"Code": code, "ErrorDetail": {"Nodes": []}, "Reason": reason, "UserMessage": ""}
+
+
+class FakeFroniusServer:
+    """
+        threaded http server answering GetAPIVersion.cgi, GetInverterRealtimeData.cgi and GetArchiveData.cgi
+
+        like the real inverter, archive requests are widened to whole local days and answered
+        with dates in local time, utc_offset ahead of UTC.  requests spanning more than max_days days,
+        or with dates behind UTC (the real inverter fails on UTC-8), are refused with status 255.
+        archive data is generated every step seconds from first_data onwards, for the datamanager
+        and inverters inverters.
+        with daylight=(first hour, last hour), archive data is only logged in these local hours, like
+        the real inverter, which logs nothing at night.
+        archive windows starting at or after fail_from are answered with status 255.
+        every request is delayed by latency seconds.
+        realtime data is refreshed every refresh seconds, aligned to the clock.
+        the first unavailable_requests requests are answered with 503 Service Unavailable.
+    """
+
+    max_days = 16
+
+    def __init__(self, latency=0.0, step=300, first_data=None, fail_from=None, unavailable_requests=0,
+                 utc_offset=datetime.timedelta(0), inverters=1, refresh=1, daylight=None):
+        self.latency = latency
+        self.refresh = refresh
+        self.step = step
+        self.daylight = daylight
+        self.tz = datetime.timezone(utc_offset)
+        self.inverters = inverters
+        if first_data is None:
+            first_data = FroniusInverter.epoch
+        self.first_data = first_data
+        self.fail_from = fail_from
+        self.unavailable_requests = unavailable_requests
+        self.request_count = 0
+        self.connection_count = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def host(self):
+        address, port = self._server.server_address[:2]
+        return address + ":" + str(port)
+
+    def start(self):
+        handler = type("FakeFroniusHandler", (_FakeFroniusHandler,), {"fake": self})
+        self._server = _FakeFroniusHTTPServer(("127.0.0.1", 0), handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _count_connection(self):
+        with self._lock:
+            self.connection_count += 1
+
+    def _count(self):
+        """count the request. returns False if it has to be refused as unavailable"""
+        with self._lock:
+            self.request_count += 1
+            return self.unavailable_requests < self.request_count
+
+    def api_version(self, query):
+        return {"APIVersion": FroniusInverter.api_version, "BaseURL": "/solar_api/v1/",
+                "CompatibilityRange": FroniusInverter.tested_server_versions[0]}
+
+    def realtime_data(self, query):
+        now = datetime.datetime.fromtimestamp(time.time() // self.refresh * self.refresh, self.tz)
+        seconds = now.hour * 3600 + now.minute * 60 + now.second
+        data = {"DAY_ENERGY": {"Unit": "Wh", "Values": {"1": seconds // 10}},
+                "PAC": {"Unit": "W", "Values": {"1": seconds % 1000}},
+                "TOTAL_ENERGY": {"Unit": "Wh", "Values": {"1": 192963 + seconds // 10}},
+                "YEAR_ENERGY": {"Unit": "Wh", "Values": {"1": 92963 + seconds // 10}}}
+        return {"Body": {"Data": data},
+                "Head": {"RequestArguments": {"DeviceClass": "Inverter", "Scope": "System"},
+                         "Status": _status(),
+                         "Timestamp": now.isoformat()}}
+
+    def archive_data(self, query):
+        from_date = _parse_date(query["StartDate"][0])
+        to_date = _parse_date(query["EndDate"][0])
+        channels = query.get("Channel", [])
+        behind_utc = from_date.utcoffset() < datetime.timedelta(0) or to_date.utcoffset() < datetime.timedelta(0)
+
+        from_date = from_date.astimezone(self.tz)
+        to_date = to_date.astimezone(self.tz)
+        start = from_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        end = to_date.replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
+
+        arguments = {"Channel": channels[0] if len(channels) == 1 else channels,
+                     "EndDate": (end - datetime.timedelta(seconds=1)).isoformat(), "HumanReadable": "True",
+                     "Scope": "System", "SeriesType": "Detail", "StartDate": start.isoformat()}
+        head = {"RequestArguments": arguments, "Status": _status(),
+                "Timestamp": datetime.datetime.now(self.tz).replace(microsecond=0).isoformat()}
+
+        if behind_utc:
+            head["Status"] = _status(255, "invalid date format (too much segments) '" + query["StartDate"][0] + "'")
+            return {"Body": {"Data": {}}, "Head": head}
+        if self.max_days < (end - start).days:
+            head["Status"] = _status(255, "Query interval is restricted to " + str(self.max_days) + " days")
+            return {"Body": {"Data": {}}, "Head": head}
+        if self.fail_from is not None and self.fail_from <= from_date:
+            head["Status"] = _status(255, "undefined")
+            return {"Body": {"Data": {}}, "Head": head}
+
+        first = max(0, int((self.first_data - start).total_seconds()))
+        first = -(-first // self.step) * self.step
+        offsets = range(first, int((end - start).total_seconds()), self.step)
+        if self.daylight is not None:
+            offsets = [o for o in offsets if self.daylight[0] * 3600 <= o % 86400 < self.daylight[1] * 3600]
+
+        body = {}
+        for channel in channels:
+            if channel in datamanager_channels:
+                devices = [datamanager_id]
+            else:
+                devices = ["inverter/" + str(i + 1) for i in range(self.inverters)]
+            if len(offsets) == 0:
+                continue
+            if channel in event_channels:
+                values = {str(o): self.event(channel, start + datetime.timedelta(seconds=o)) for o in offsets}
+                values = {o: event for o, event in values.items() if event is not None}
+            else:
+                values = {str(o): self.value(channel, start + datetime.timedelta(seconds=o)) for o in offsets}
+            unit = FroniusInverter.channel_dict.get(channel, "1")
+            for device in devices:
+                device_data = body.setdefault(device, {"Data": {}, "Start": start.isoformat(),
+                                                       "End": arguments["EndDate"]})
+                device_data["Data"][channel] = {"Unit": unit, "Values": values, "_comment": "channelId=0"}
+
+        return {"Body": {"Data": body}, "Head": head}
+
+    def event(self, channel, date):
+        """an event every event_step seconds of the channel, or None"""
+        seconds = int(date.timestamp())
+        step, first_code, codes = event_channels[channel]
+        if seconds % step != 0:
+            return None
+        return {"#": first_code + seconds // step % codes, "attr": {"Severity": "1"}}
+
+    def value(self, channel, date):
+        if channel == "TimeSpanInSec":
+            return self.step
+        if channel.startswith("Digital_"):
+            return 0
+        return int(date.timestamp()) // self.step % 1000
+
+
+class _FakeFroniusHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients hanging up early (timeouts, cancelled windows) are expected
+        pass
+
+
+class _FakeFroniusHandler(BaseHTTPRequestHandler):
+    fake = None
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately: don't let them wait for a delayed ack
+    disable_nagle_algorithm = True
+
+    # method names, so subclasses of FakeFroniusServer can answer differently
+    routes = {"/solar_api/GetAPIVersion.cgi": "api_version",
+              "/solar_api/v1/GetInverterRealtimeData.cgi": "realtime_data",
+              "/solar_api/v1/GetArchiveData.cgi": "archive_data"}
+
+    def setup(self):
+        super().setup()
+        self.fake._count_connection()
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        route = self.routes.get(url.path)
+        available = self.fake._count()
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+
+        if not available:
+            self.send_error(503)
+            return
+        if route is None:
+            self.send_error(404)
+            return
+
+        body = json.dumps(getattr(self.fake, route)(urllib.parse.parse_qs(url.query))).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -1,14 +1,48 @@
+import asyncio
+import collections
+import concurrent.futures
+import json
+import math
+import os
+import threading
+import re
+import socket
+import time
+import urllib.parse
 import requests
+import urllib3
+from urllib3.util.retry import Retry
 import warnings
 import datetime
-import dateutil
+import dateutil.parser
 import pytz
+import numpy as np
 import pandas as pd
 
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
 
 # noinspection SpellCheckingInspection
-class FroniusInverter:
-    """class implementing Fronius Solar API v1"""
+class _FroniusInverterBase:
+    """
+        requests and parsing of Fronius Solar API v1, shared by FroniusInverter and AsyncFroniusInverter.
+        subclasses send the requests
+    """
 
     tested_server_versions = ["1.5-4"]
     api_version = 1
@@ -28,6 +62,42 @@ class FroniusInverter:
                     "Temperature_Channel_2": "1", "Digital_Channel_1": "1", "Digital_Channel_2": "1", "Radiation": "1",
                     "Hybrid_Operating_State": "1"}
 
+    unit_dtypes = {"sec": "Int32", "Wh": "float32", "1Wh": "float64", "1V": "float32", "1A": "float32",
+                   "1W": "float32", "1C": "float32", "1": "float32"}
+    """
+        compact dtypes of the archive channels by unit, see get_channel_dtypes.
+        energy stays float: the inverter reports the energy of an interval with decimals (e.g. 42.044444 Wh),
+        an integer column would truncate it. float32 keeps about 7 digits, enough for an interval.
+        the absolute energy counters keep float64, float32 would round them above 16.7 MWh.
+        integer channels are nullable, so samples missing in a channel stay <NA>
+    """
+
+    channel_devices = {"inverter": ["TimeSpanInSec", "EnergyReal_WAC_Sum_Produced", "Current_DC_String_1",
+                                    "Current_DC_String_2", "Voltage_DC_String_1", "Voltage_DC_String_2",
+                                    "Temperature_Powerstage", "Voltage_AC_Phase_1", "Voltage_AC_Phase_2",
+                                    "Voltage_AC_Phase_3", "Current_AC_Phase_1", "Current_AC_Phase_2",
+                                    "Current_AC_Phase_3", "PowerReal_PAC_Sum", "Hybrid_Operating_State"],
+                       "meter": ["EnergyReal_WAC_Minus_Absolute", "EnergyReal_WAC_Plus_Absolute",
+                                 "Meter_Location_Current"],
+                       "sensorcard": ["Temperature_Channel_1", "Temperature_Channel_2", "Digital_Channel_1",
+                                      "Digital_Channel_2", "Radiation"],
+                       "datamanager": ["Digital_PowerManagementRelay_Out_1"]}
+    """ the device type reporting each archive channel. unknown channels are planned as inverter channels """
+
+    metric_channels = {"energy": ["EnergyReal_WAC_Sum_Produced"],
+                       "power": ["PowerReal_PAC_Sum"],
+                       "realtime": ["PowerReal_PAC_Sum", "EnergyReal_WAC_Sum_Produced"],
+                       "dc": ["Current_DC_String_1", "Current_DC_String_2", "Voltage_DC_String_1",
+                              "Voltage_DC_String_2"],
+                       "ac": ["Voltage_AC_Phase_1", "Voltage_AC_Phase_2", "Voltage_AC_Phase_3",
+                              "Current_AC_Phase_1", "Current_AC_Phase_2", "Current_AC_Phase_3"],
+                       "grid": ["EnergyReal_WAC_Minus_Absolute", "EnergyReal_WAC_Plus_Absolute"],
+                       "temperature": ["Temperature_Powerstage"]}
+    """
+        archive channels needed by derived metrics, see plan_historical_data.
+        "realtime" covers the view of get_inverter_realtime_data: PAC and the produced energy
+    """
+
     max_query_time = datetime.timedelta(days=15)
     """ 
         the inverter will return an error when asking for more than 16 days of data
@@ -36,14 +106,80 @@ class FroniusInverter:
         set value to suboptimal value that works
     """
 
-    def __init__(self, host):
+    interval_reason = "Query interval is restricted"
+    """ start of the Reason of a status 255 refusing a query for its length """
+
+    timeout = (3.05, 30)
+    """ (connect, read) timeout in seconds for every request to the inverter """
+
+    retries = 3
+    backoff_factor = 0.5
+    """
+        transient failures (connection errors, 502/503/504) are retried with exponential backoff.
+        read timeouts are not retried, they are raised as requests.exceptions.ReadTimeout
+    """
+
+    decoder = None
+    """ callable decoding response bodies (bytes), a FroniusJsonDecoder by default """
+
+    metrics = None
+    """ optional FroniusMetrics observing every request and parse step """
+
+    def __init__(self, host, timeout=None, retries=None, backoff_factor=None, decoder=None, metrics=None):
         self.host = host
         self.base_url = "http://" + host + "/solar_api/v" + str(self.api_version) + "/"
-
-    def check_server_compatibility(self):
-        url = "http://" + self.host + "/solar_api/GetAPIVersion.cgi"
-        r = requests.get(url)
-        api_vers = r.json()
+        if timeout is not None:
+            self.timeout = timeout
+        if retries is not None:
+            self.retries = retries
+        if backoff_factor is not None:
+            self.backoff_factor = backoff_factor
+        if metrics is not None:
+            self.metrics = metrics
+        self.decoder = decoder if decoder is not None else self.decoder or FroniusJsonDecoder()
+        self.received_bytes = 0
+        self.received_responses = 0
+        self._received_lock = threading.Lock()
+        self.probes = {}
+
+    def _observe(self, url, status, content, seconds):
+        """report the request timings and size of a response to self.metrics. returns the labels"""
+        labels = {"host": self.host, "endpoint": url.rsplit("/", 1)[-1]}
+        for name, value in seconds.items():
+            if value is not None:
+                self.metrics.observe(name + "_seconds", value, **labels)
+        self.metrics.observe("response_bytes", len(content), **labels)
+        return labels
+
+    def _undecoded(self, url, status, content, seconds):
+        """a response body left undecoded, reported to self.metrics with the error code 'undecoded'"""
+        if self.metrics is not None:
+            labels = self._observe(url, status, content, seconds)
+            self.metrics.observe("responses", 1, status=status, code="undecoded", **labels)
+        return content
+
+    def _decode(self, url, status, content, seconds):
+        """decode a response body, reporting the request timings, size, decode time and error code to self.metrics"""
+        labels = self._observe(url, status, content, seconds)
+
+        start = time.perf_counter()
+        try:
+            json = self.decoder(content)
+        except ValueError:
+            self.metrics.observe("responses", 1, status=status, code="undecodable", **labels)
+            raise
+        self.metrics.observe("decode_seconds", time.perf_counter() - start, **labels)
+        code = json.get("Head", {}).get("Status", {}).get("Code", "none") if isinstance(json, dict) else "none"
+        self.metrics.observe("responses", 1, status=status, code=code, **labels)
+        return json
+
+    def _received(self, size):
+        """count a response in self.received_responses, and its body size in self.received_bytes"""
+        with self._received_lock:
+            self.received_responses += 1
+            self.received_bytes += size
+
+    def _check_api_version(self, api_vers):
         compatible = True
         assert isinstance(api_vers, dict)
         if api_vers['APIVersion'] != self.api_version:
@@ -55,7 +191,7 @@ class FroniusInverter:
                 "using api compatibility range newer than last tested ("
                 + str(FroniusInverter.tested_server_versions) + "): " + api_vers['CompatibilityRange'])
             compatible = False
-        return compatible, api_vers
+        return compatible
 
     @classmethod
     def get_all_channels(cls):
@@ -65,19 +201,68 @@ class FroniusInverter:
     def get_all_channel_dict(cls):
         return cls.channel_dict
 
-    def get_inverter_realtime_data(self):
+    @classmethod
+    def plan_historical_data(cls, channels=None, metrics=None, split=False):
+        """
+            the channels a query needs: the given channels plus those of the given metrics, see metric_channels,
+            or all channels when neither is given. by default they are merged into one request per window,
+            with split=True into one request per device type. see get_planned_historical_data
+        """
+        if channels is None and metrics is None:
+            channels = cls.get_all_channels()
+        needed = dict.fromkeys(channels or [])
+        for metric in metrics or []:
+            if metric not in cls.metric_channels:
+                raise ValueError("unknown metric: " + str(metric))
+            needed.update(dict.fromkeys(cls.metric_channels[metric]))
+
+        device_types = {channel: device for device, names in cls.channel_devices.items() for channel in names}
+        groups = {}
+        for channel in needed:
+            groups.setdefault(device_types.get(channel, "inverter"), []).append(channel)
+        if not split:
+            groups = {"+".join(groups): list(needed)}
+        return FroniusFetchPlan(groups)
+
+    @classmethod
+    def get_channel_dtypes(cls):
+        """compact dtype of every channel, derived from its unit. Digital_* channels (0 or 1) are nullable int8"""
+        dtypes = {}
+        for channel, unit in cls.get_all_channel_dict().items():
+            dtypes[channel] = "Int8" if channel.startswith("Digital_") else cls.unit_dtypes.get(unit, "float32")
+        return dtypes
+
+    @staticmethod
+    def local_time(df, tz=None):
+        """
+            a time indexed frame (index=True) with its index in tz, the local timezone by default.
+            the columns are not copied
+        """
+        if tz is None:
+            tz = datetime.datetime.now(datetime.timezone.utc).astimezone().tzinfo
+        # set_axis copies the columns before pandas 3, a shallow copy shares them
+        out = df.copy(deep=False)
+        out.index = df.index.tz_convert(tz)
+        return out
+
+    def _realtime_poll(self, deduplicator, json, interval):
+        """(whether the sample is new, time to poll next) of iter_realtime_data"""
+        now = time.time()
+        accepted = deduplicator.accept(self.host, json, now)
+        wake = deduplicator.next_refresh(self.host, now)
+        if wake is None or not accepted:
+            wake = now + interval if wake is None else min(wake, now + interval)
+        return accepted, wake
+
+    def _realtime_request(self):
         payload = {"Scope": "System"}
         url = self.base_url + "GetInverterRealtimeData.cgi"
         if FroniusInverter.debug:
             print(url)
-        r = requests.get(url, params=payload)
-        return r.json()
-
-    def get_historical_data(self, from_date, to_date, channels=None, strict=True):
-
-        returndf = None
-        error = 0
+        return url, payload
 
+    @staticmethod
+    def _utc_range(from_date, to_date):
         if from_date.tzinfo is None:
             warnings.warn("from_date is not timezone aware. assuming local timezone")
             tz = datetime.datetime.now(datetime.timezone.utc).astimezone().tzinfo
@@ -92,40 +277,102 @@ class FroniusInverter:
         # convert to UTC
         from_date = from_date.astimezone(pytz.utc)
         to_date = to_date.astimezone(pytz.utc)
+        return from_date, to_date
+
+    def _concat_frames(self, device_frames, from_date=None, to_date=None, strict=False):
+        """
+            concatenate (device_id, DataFrame) pairs into one frame per device, or None without data.
+            frames are only sorted when they overlap, or are not in order. time indexed frames are
+            sorted before the strict range is sliced off.
+        """
+        frames = {}
+        for key, df in device_frames:
+            frames.setdefault(key, []).append(df)
+
+        if len(frames) == 0:
+            return None
 
-        fdate = from_date
-        while (fdate < to_date) and (error == 0):
-            tdate = min(to_date, fdate + self.max_query_time - datetime.timedelta(seconds=1))
-            jsondata = self.get_historical_data_json(fdate, tdate, channels)
-            fdate = tdate
+        returndf = {}
+        for key, value in frames.items():
+            df = value[0] if len(value) == 1 else pd.concat(value)
+            unsorted = 1 < len(value) and self._overlapping(value)
+            if unsorted and _is_time_indexed(df):
+                df = df.sort_index(kind="stable")
+                unsorted = False
+            if strict:
+                df = self._strict_range(df, from_date, to_date)
+            if unsorted:
+                df = df.sort_values(self.timestamp_colname)
+            returndf[key] = df
+        return returndf
+
+    def _merge_planned(self, result, data, index=False):
+        """
+            join the frames of data to those of result, on the timestamps. a timestamp repeated in both,
+            like those of the day consecutive windows share, is joined in order: the first to the first,
+            the second to the second, so the rows are not multiplied
+        """
+        if data is None:
+            return result
+        if result is None:
+            result = {}
+        for key, df in data.items():
+            if key in result and index:
+                left, right = result[key], df
+                left = left.set_index(left.groupby(level=0).cumcount(), append=True)
+                right = right.set_index(right.groupby(level=0).cumcount(), append=True)
+                df = left.join(right, how="outer").droplevel(1)
+            elif key in result:
+                ts = self.timestamp_colname
+                left, right = result[key], df
+                left = left.assign(_occurrence=left.groupby(ts).cumcount())
+                right = right.assign(_occurrence=right.groupby(ts).cumcount())
+                df = left.merge(right, on=[ts, "_occurrence"], how="outer").drop(columns="_occurrence")
+            result[key] = df
+        return result
 
-            faj = FroniusArchiveJson(jsondata)
-            error = faj.error_code()
+    def _strict_range(self, df, from_date, to_date):
+        if _is_time_indexed(df):
+            # a binary search on the sorted index
+            first, last = df.index.searchsorted([pd.Timestamp(from_date), pd.Timestamp(to_date)])
+            return df.iloc[first:last]
+        ts = df[self.timestamp_colname]
+        return df.loc[(from_date <= ts) & (ts < to_date)]
+
+    def _overlapping(self, frames):
+        """true if the timestamps of consecutive frames overlap, or any frame is not sorted"""
+        last = None
+        for df in frames:
+            ts = df.index if _is_time_indexed(df) else pd.Index(df[self.timestamp_colname])
+            if len(ts) == 0:
+                continue
+            if not ts.is_monotonic_increasing or (last is not None and ts[0] < last):
+                return True
+            last = ts[-1]
+        return False
+
+    def _iter_archive_frames(self, responses, from_date, to_date, strict=True, dtypes=None, index=False):
+        """yield (device_id, DataFrame) for every window. stops at the first response with an error"""
+        for jsondata in responses:
+            faj = FroniusArchiveJson(jsondata, self.metrics, self.host)
             if faj.error_code() != 0:
                 warnings.warn(str(faj.error_status()))
-            else:
-                if not faj.is_empty():
-                    df = faj.data()
-                    if returndf is None:
-                        returndf = df
-                    else:
-                        # merge the dictionaries for different device_ids
-                        for key, value in df.items():
-                            if key in returndf:
-                                returndf[key] = pd.concat([returndf[key], value])
-                                returndf[key] = returndf[key].sort_values(self.timestamp_colname)
-                            else:
-                                returndf[key] = value
-
-                    if strict:
-                        for key, value in returndf.items():
-                            returndf[key] = returndf[key].loc[from_date <= returndf[key][self.timestamp_colname]]
-                            returndf[key] = returndf[key].loc[returndf[key][self.timestamp_colname] < to_date]
-
-        return returndf
-
-    def get_historical_data_json(self, from_date, to_date, channels=None):
+                return
+            for key, df in faj.data(self.timestamp_colname, dtypes, index).items():
+                if strict:
+                    df = self._strict_range(df, from_date, to_date)
+                yield key, df
+
+    def _query_windows(self, from_date, to_date):
+        windows = []
+        fdate = from_date
+        while fdate < to_date:
+            tdate = min(to_date, fdate + self.max_query_time - datetime.timedelta(seconds=1))
+            windows.append((fdate, tdate))
+            fdate = tdate
+        return windows
 
+    def _archive_request(self, from_date, to_date, channels=None):
         if self.max_query_time < to_date - from_date:
             warnings.warn("time period exceeds maximal query time")
 
@@ -136,33 +383,451 @@ class FroniusInverter:
         url = self.base_url + "GetArchiveData.cgi"
         if FroniusInverter.debug:
             print(url, str(from_date), "->", str(to_date))
-        r = requests.get(url, params=payload)
-        return r.json()
+        return url, payload
 
-    def get_historical_events_json(self, from_date, to_date):
+    def _events_request(self, from_date, to_date):
         payload = {"Scope": "System", "StartDate": from_date, "EndDate": to_date,
                    "Channel": ["InverterEvents", "InverterErrors"]}
         url = self.base_url + "GetArchiveData.cgi"
         if FroniusInverter.debug:
             print(url, str(from_date), "->", str(to_date))
-        r = requests.get(url, params=payload)
-        return r.json()
+        return url, payload
 
     @staticmethod
     def _get_start_of_events(eventjson):
-        data = eventjson["Body"]["Data"]
-        assert (len(data) == 1)
-        inverter_id = (list(data.keys())[0])
+        faj = FroniusArchiveJson(eventjson)
+        device_ids = faj.device_ids()
+        assert (len(device_ids) == 1)
+
+        offsets, values = faj.values(device_ids[0], "TimeSpanInSec")
+        return faj.start_date() + datetime.timedelta(seconds=int(offsets.min()))
+
+    def _store_probe(self, window, json, probes):
+        """the earliest sample of a probe response. memoized in probes unless it may still change"""
+        earliest = None
+        if len(json["Body"]["Data"]) != 0:
+            earliest = self._get_start_of_events(json)
+        ok = FroniusJson(json).error_code() == 0
+        # an empty window can still fill up until it is over
+        if ok and (earliest is not None or window[1] < datetime.datetime.now(pytz.utc)):
+            probes[window] = earliest
+        return earliest
+
+    def _binary_data_search(self, from_date=None, to_date=None):
+        """
+            generator implementing the binary search, like _earliest_data_search.
+            probes a window of max_query_time in the middle of the range: without data the search goes
+            on after the window, with data before the earliest sample found
+        """
+        if from_date is None:
+            from_date = self.epoch
+        if to_date is None:
+            to_date = datetime.datetime.now(pytz.utc)
+
+        sampleScope = self.max_query_time
+
+        while True:
+            assert (from_date < to_date)
+
+            testTimeStart = max(from_date, from_date + (to_date - from_date) / 2 - sampleScope / 2)
+            testTimeEnd = min(to_date, testTimeStart + sampleScope)
+            earliestFound = yield testTimeStart, testTimeEnd
+
+            if earliestFound is None:
+                # no data was found in this interval
+                if testTimeEnd == to_date:
+                    # No data found at all!
+                    return None
+                # search the data later than the test time + scope
+                from_date = testTimeEnd
+            else:
+                # data was found.
+                if testTimeStart == from_date:
+                    # we found the earliest point
+                    return earliestFound
+                # look for earlier data
+                to_date = earliestFound + datetime.timedelta(seconds=1)
+
+    def _earliest_data_search(self, from_date=None, to_date=None):
+        """
+            generator implementing the search.  yields (start, end) windows to probe,
+            is sent the earliest sample in each window (or None) and returns the earliest data.
+
+            windows lie on a fixed grid of max_query_time from epoch, so searches with
+            different bounds probe the same windows.  assumes no window is empty once data starts:
+            gallop back in growing steps from the window of to_date until an empty window, then
+            bisect between the empty and the non-empty window.  a window starting late proves
+            nothing, inverters log nothing at night: only a window right after an empty one holds
+            the earliest data.
+        """
+        if from_date is None:
+            from_date = self.epoch
+        if to_date is None:
+            to_date = datetime.datetime.now(pytz.utc)
+        assert (from_date < to_date)
+
+        size = self.max_query_time
+
+        def window(k):
+            start = self.epoch + k * size
+            return start, start + size - datetime.timedelta(seconds=1)
+
+        first = (from_date - self.epoch) // size
+        k = (to_date - self.epoch) // size
+
+        empty = None
+        found = None
+        step = 1
+        while True:
+            earliest = yield window(k)
+            if earliest is not None:
+                found, found_earliest = k, earliest
+            elif found is not None:
+                empty = k
+                break
+            if k <= first:
+                break
+            k = max(first, k - step)
+            step *= 2
+
+        if found is None:
+            return None
+
+        if empty is not None:
+            while 1 < found - empty:
+                k = (empty + found) // 2
+                earliest = yield window(k)
+                if earliest is None:
+                    empty = k
+                else:
+                    found, found_earliest = k, earliest
+
+        if found_earliest < from_date:
+            # the data started before from_date: look for the first sample after it
+            found_earliest = yield (from_date, from_date + size - datetime.timedelta(seconds=1))
+        return found_earliest
+
+
+class FroniusInverter(_FroniusInverterBase):
+    """class implementing Fronius Solar API v1"""
+
+    pool_maxsize = 10
+    """ number of keep-alive connections kept open to the inverter. should be at least max_workers """
+
+    cache = None
+    """ optional FroniusArchiveCache serving get_historical_data from disk """
+
+    window_sizer = None
+    """ optional FroniusWindowSizer adapting the archive query windows, instead of max_query_time """
+
+    def __init__(self, host, timeout=None, retries=None, backoff_factor=None, pool_maxsize=None, cache=None,
+                 decoder=None, window_sizer=None, metrics=None):
+        super().__init__(host, timeout=timeout, retries=retries, backoff_factor=backoff_factor, decoder=decoder,
+                         metrics=metrics)
+        if pool_maxsize is not None:
+            self.pool_maxsize = pool_maxsize
+        if cache is not None:
+            self.cache = cache
+        if window_sizer is not None:
+            self.window_sizer = window_sizer
+        self.session = self._create_session()
+
+    def _create_session(self):
+        retry = Retry(total=self.retries, read=False, backoff_factor=self.backoff_factor,
+                      status_forcelist=[502, 503, 504], allowed_methods=["GET"], raise_on_status=False)
+        # with metrics, new connections time the name lookup and the connect
+        adapter_class = requests.adapters.HTTPAdapter if self.metrics is None else _TimedHTTPAdapter
+        adapter = adapter_class(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        return session
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _request(self, url, params=None):
+        """GET url: (status, body, request timings). the timings are None without metrics"""
+        if self.metrics is None:
+            r = self.session.get(url, params=params, timeout=self.timeout)
+            self._received(len(r.content))
+            return r.status_code, r.content, None
+
+        _connection_timings.__dict__.clear()
+        start = time.perf_counter()
+        r = self.session.get(url, params=params, timeout=self.timeout)
+        seconds = {"dns": getattr(_connection_timings, "dns", None),
+                   "connect": getattr(_connection_timings, "connect", None),
+                   "response": r.elapsed.total_seconds(), "request": time.perf_counter() - start}
+        self._received(len(r.content))
+        return r.status_code, r.content, seconds
+
+    def _get(self, url, params=None):
+        status, content, seconds = self._request(url, params)
+        if self.metrics is None:
+            return self.decoder(content)
+        return self._decode(url, status, content, seconds)
+
+    def check_server_compatibility(self):
+        url = "http://" + self.host + "/solar_api/GetAPIVersion.cgi"
+        api_vers = self._get(url)
+        return self._check_api_version(api_vers), api_vers
+
+    def get_inverter_realtime_data(self):
+        url, payload = self._realtime_request()
+        return self._get(url, params=payload)
+
+    def iter_realtime_data(self, interval=1.0, deduplicator=None, samples=None):
+        """
+            poll the realtime data, yielding a FroniusRealTimeJson for every sample with a new timestamp.
+            polls every interval seconds until the deduplicator learned how often the inverter refreshes,
+            then just after every expected refresh. stops after samples samples, if given.
+        """
+        if deduplicator is None:
+            deduplicator = FroniusRealTimeDeduplicator()
+        served = 0
+        while samples is None or served < samples:
+            json = self.get_inverter_realtime_data()
+            accepted, wake = self._realtime_poll(deduplicator, json, interval)
+            if accepted:
+                yield FroniusRealTimeJson(json)
+                served += 1
+            time.sleep(max(0.0, wake - time.time()))
+
+    def get_historical_data(self, from_date, to_date, channels=None, strict=True, max_workers=None, dtypes=None,
+                            index=False):
+        """
+            fetch archive data in windows of max_query_time, see iter_historical_data,
+            and concatenate the windows into one DataFrame per device.
+            pass max_workers to fetch up to that many windows concurrently.
+            pass dtypes=True for compact column dtypes, see FroniusArchiveJson.data.
+            pass index=True for frames indexed by time in UTC, see FroniusArchiveJson.data.
+            with a cache, see _get_cached_historical_data.
+        """
+
+        from_date, to_date = self._utc_range(from_date, to_date)
+
+        if self.cache is not None:
+            return self._get_cached_historical_data(from_date, to_date, channels, strict, max_workers, dtypes, index)
+
+        # filter the strict bounds once, on the concatenated frames
+        frames = self.iter_historical_data(from_date, to_date, channels, False, max_workers, dtypes, index)
+        try:
+            return self._concat_frames(frames, from_date, to_date, strict)
+        finally:
+            frames.close()
+
+    def get_planned_historical_data(self, plan, from_date, to_date, strict=True, max_workers=None, dtypes=None,
+                                    index=False):
+        """
+            get_historical_data for every group of a FroniusFetchPlan. frames of a device reported by
+            several groups are joined on the timestamps. the plan counts the requests and bytes received
+        """
+        result = None
+        for name, channels in plan.groups.items():
+            responses, received = self.received_responses, self.received_bytes
+            data = self.get_historical_data(from_date, to_date, channels, strict, max_workers, dtypes, index)
+            plan.requests += self.received_responses - responses
+            plan.received_bytes += self.received_bytes - received
+            result = self._merge_planned(result, data, index)
+        return result
+
+    def iter_historical_data(self, from_date, to_date, channels=None, strict=True, max_workers=None, dtypes=None,
+                             index=False):
+        """
+            generator yielding (device_id, DataFrame) for every window of max_query_time, as soon as it is
+            fetched and parsed.  windows come in time order, and at most max_workers windows are fetched
+            ahead of the one yielded, so memory stays bounded by max_workers + 1 windows, see _fetch_windows.
+            stops, with a warning, at the first window with an error.
+            with a window_sizer, windows are sized adaptively and fetched one at a time, see _fetch_adaptive_windows.
+        """
+        from_date, to_date = self._utc_range(from_date, to_date)
+
+        if self.window_sizer is not None:
+            responses = self._fetch_adaptive_windows(from_date, to_date, channels)
+        else:
+            responses = self._fetch_windows(self._query_windows(from_date, to_date), channels, max_workers)
+        try:
+            yield from self._iter_archive_frames(responses, from_date, to_date, strict, dtypes, index)
+        finally:
+            responses.close()
+
+    def _get_cached_historical_data(self, from_date, to_date, channels=None, strict=True, max_workers=None,
+                                    dtypes=None, index=False):
+        """
+            get_historical_data served by self.cache, a day (UTC) at a time.
+            days missing from the cache are fetched in windows of whole days. closed days are stored,
+            the current day is always fetched again.
+            timestamps are returned in UTC.  without strict, whole days are returned.
+        """
+        if channels is None:
+            channels = self.get_all_channels()
+        now = datetime.datetime.now(pytz.utc)
+        one_day = datetime.timedelta(days=1)
+
+        first_day = from_date.date()
+        last_day = (to_date - datetime.timedelta(microseconds=1)).date()
+        days = [first_day + i * one_day for i in range((last_day - first_day).days + 1)]
+
+        columns = {}
+        missing = []
+        for day in days:
+            cached = self.cache.get(self.host, day, channels)
+            if cached is None:
+                missing.append(day)
+            else:
+                columns[day] = cached
+
+        stop_day = None
+        for windows in self._day_windows(missing):
+            responses = self._fetch_windows(windows, channels, max_workers)
+            try:
+                for (fdate, tdate), jsondata in zip(windows, responses):
+                    faj = FroniusArchiveJson(jsondata, self.metrics, self.host)
+                    if faj.error_code() != 0:
+                        warnings.warn(str(faj.error_status()))
+                        stop_day = fdate.date()
+                        break
+                    started = time.perf_counter()
+                    split = FroniusArchiveCache.split_days(faj)
+                    if self.metrics is not None:
+                        faj._observe_data(started, FroniusArchiveCache.split_rows(split))
+                    day = fdate.date()
+                    while day <= tdate.date():
+                        columns[day] = split.get(day, {})
+                        if FroniusArchiveCache.day_start(day) + one_day <= now:
+                            self.cache.put(self.host, day, channels, columns[day])
+                        day += one_day
+            finally:
+                responses.close()
+            if stop_day is not None:
+                break
+
+        devices = {}
+        for day in days:
+            if stop_day is not None and stop_day <= day:
+                break
+            for device, device_columns in columns.get(day, {}).items():
+                devices.setdefault(device, []).append(device_columns)
+
+        returndf = {}
+        for device, day_columns in devices.items():
+            merged = {}
+            for channel in channels:
+                parts = [c[channel] for c in day_columns if channel in c]
+                if parts:
+                    merged[channel] = (np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts]))
+            df = _apply_dtypes(_frame_from_columns(FroniusArchiveCache.epoch, merged, self.timestamp_colname), dtypes)
+            if index:
+                df = _time_indexed(df, self.timestamp_colname)
+                if strict:
+                    df = self._strict_range(df, from_date, to_date)
+            elif strict:
+                ts = df[self.timestamp_colname]
+                df = df.loc[(from_date <= ts) & (ts < to_date)].reset_index(drop=True)
+            returndf[device] = df
+
+        if len(returndf) == 0:
+            return None
+        return returndf
+
+    def _day_windows(self, days):
+        """group sorted days into runs of consecutive days. each run is a list of windows of whole days"""
+        one_day = datetime.timedelta(days=1)
+        window_days = max(1, self.max_query_time // one_day)
+
+        runs = []
+        for day in days:
+            if runs and runs[-1][-1] + one_day == day:
+                runs[-1].append(day)
+            else:
+                runs.append([day])
+
+        return [[(FroniusArchiveCache.day_start(run[i]),
+                  FroniusArchiveCache.day_start(run[min(i + window_days, len(run)) - 1])
+                  + one_day - datetime.timedelta(seconds=1))
+                 for i in range(0, len(run), window_days)]
+                for run in runs]
+
+    def _fetch_windows(self, windows, channels=None, max_workers=None):
+        """
+            yield the archive json of every window, in order. with max_workers, up to max_workers windows
+            are fetched ahead: the next window is requested as one is yielded
+        """
+        if max_workers is None or max_workers <= 1 or len(windows) <= 1:
+            for fdate, tdate in windows:
+                yield self.get_historical_data_json(fdate, tdate, channels)
+        else:
+            pending = iter(windows)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = collections.deque()
+                try:
+                    for fdate, tdate in pending:
+                        futures.append(executor.submit(self.get_historical_data_json, fdate, tdate, channels))
+                        if max_workers <= len(futures):
+                            break
+                    while futures:
+                        jsondata = futures.popleft().result()
+                        for fdate, tdate in pending:
+                            futures.append(executor.submit(self.get_historical_data_json, fdate, tdate, channels))
+                            break
+                        yield jsondata
+                finally:
+                    # stop fetching windows nobody is waiting for anymore
+                    for future in futures:
+                        future.cancel()
+
+    def _fetch_adaptive_windows(self, from_date, to_date, channels=None):
+        """
+            yield the archive json of consecutive windows sized by self.window_sizer, in order.
+            a window rejected for its length is split and fetched again, until it is a min_size window.
+            any other error is recorded with window_sizer.error() and ends the windows.
+        """
+        if channels is None:
+            channels = self.get_all_channels()
+        key = (self.host, tuple(channels))
+        sizer = self.window_sizer
+
+        fdate = from_date
+        while fdate < to_date:
+            size = sizer.size(key, self.max_query_time)
+            tdate = min(to_date, fdate + size - datetime.timedelta(seconds=1))
+            with warnings.catch_warnings():
+                # windows may exceed max_query_time on purpose
+                warnings.simplefilter("ignore")
+                jsondata = self.get_historical_data_json(fdate, tdate, channels)
+            fj = FroniusJson(jsondata)
+            error_code = fj.error_code()
+            # the inverter answers 255 for other errors too
+            too_long = error_code == 255 and fj.error_status().get("Reason", "").startswith(self.interval_reason)
+            if too_long and sizer.min_size < size:
+                sizer.failure(key, size)
+                continue
+            if error_code != 0:
+                sizer.error(key)
+                yield jsondata
+                return
+            sizer.success(key, size)
+            yield jsondata
+            fdate = tdate
 
-        offset_list_strings = list((eventjson["Body"]["Data"])[inverter_id]["Data"]["TimeSpanInSec"]["Values"].keys())
-        offset_list_ints = map(int, offset_list_strings)
-        offset = min(offset_list_ints)
-        seconds = datetime.timedelta(seconds=offset)
+    def get_historical_data_json(self, from_date, to_date, channels=None):
+        url, payload = self._archive_request(from_date, to_date, channels)
+        return self._get(url, params=payload)
 
-        datestring = eventjson["Head"]["RequestArguments"]["StartDate"]
-        date = dateutil.parser.parse(datestring)
+    def get_historical_data_bytes(self, from_date, to_date, channels=None):
+        """the undecoded body of get_historical_data_json, to be decoded elsewhere"""
+        url, payload = self._archive_request(from_date, to_date, channels)
+        return self._undecoded(url, *self._request(url, params=payload))
 
-        return date + seconds
+    def get_historical_events_json(self, from_date, to_date):
+        url, payload = self._events_request(from_date, to_date)
+        return self._get(url, params=payload)
 
     def find_earliest_data(self, from_date=None):
         return self.find_earliest_data_binary(from_date)
@@ -190,62 +855,1117 @@ class FroniusInverter:
         else:
             return None
 
-    def find_earliest_data_binary(self, from_date=None, to_date=None):
+    def find_earliest_data_binary(self, from_date=None, to_date=None, probes=None):
+        """
+            find the earliest data between from_date and to_date (default: now) by binary search,
+            see _binary_data_search.  probes are memoized like find_earliest_data_exponential does
+        """
+        return self._search(self._binary_data_search(from_date, to_date), probes)
+
+    def find_earliest_data_exponential(self, from_date=None, to_date=None, probes=None):
+        """
+            find the earliest data after from_date by galloping backwards from to_date (default: now)
+            and bisecting, see _earliest_data_search.  probe results are memoized in probes,
+            {(start, end): earliest sample or None} of this host, by default in self.probes.
+            the number of requests made is left in self.search_requests.
+        """
+        return self._search(self._earliest_data_search(from_date, to_date), probes)
+
+    def _search(self, search, probes=None):
+        """run a search generator, requesting the windows it probes that are not memoized in probes"""
+        if probes is None:
+            probes = self.probes
+        self.search_requests = 0
+        try:
+            window = next(search)
+            while True:
+                if window in probes:
+                    earliest = probes[window]
+                else:
+                    json = self.get_historical_data_json(window[0], window[1], ["TimeSpanInSec"])
+                    self.search_requests += 1
+                    earliest = self._store_probe(window, json, probes)
+                window = search.send(earliest)
+        except StopIteration as stop:
+            return stop.value
+
+
+class AsyncFroniusInverter(_FroniusInverterBase):
+    """
+        asyncio client implementing Fronius Solar API v1. requires aiohttp.
+
+        mirrors FroniusInverter: every method talking to the inverter is a coroutine returning
+        the same result as its blocking counterpart, or an async generator for the iter_ methods.
+        the cache and window_sizer of the blocking client are not supported, neither are the classes
+        built on its blocking requests, like FroniusEnergyRollup.
+        pass a shared aiohttp.ClientSession to poll many inverters over one connection pool.
+        at most max_concurrency requests are in flight to one inverter at any time.
+    """
+
+    max_concurrency = 4
+
+    def __init__(self, host, session=None, max_concurrency=None, timeout=None, retries=None,
+                 backoff_factor=None, decoder=None, metrics=None):
+        if aiohttp is None:
+            raise ImportError("AsyncFroniusInverter requires aiohttp")
+        super().__init__(host, timeout=timeout, retries=retries, backoff_factor=backoff_factor, decoder=decoder,
+                         metrics=metrics)
+        if max_concurrency is not None:
+            self.max_concurrency = max_concurrency
+        # without a session, one is created on first use, inside the running event loop
+        self.session = session
+        self._owns_session = session is None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def __enter__(self):
+        raise TypeError("use 'async with' with AsyncFroniusInverter")
 
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    @staticmethod
+    def _query_params(payload):
+        # aiohttp only accepts strings: serialize like requests does, repeating keys for lists
+        params = []
+        for key, value in (payload or {}).items():
+            for v in (value if isinstance(value, list) else [value]):
+                params.append((key, str(v)))
+        return params
+
+    async def _get(self, url, params=None):
+        status, content, seconds = await self._request(url, params)
+        if self.metrics is None:
+            return self.decoder(content)
+        return self._decode(url, status, content, seconds)
+
+    async def _request(self, url, params=None):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(trace_configs=_aiohttp_trace_configs(self.metrics))
+        connect, read = self.timeout if isinstance(self.timeout, tuple) else (self.timeout, self.timeout)
+        timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+
+        async with self._semaphore:
+            attempt = 0
+            while True:
+                try:
+                    # dns and connect timings are filled in by the trace config of the session
+                    seconds = {"dns": None, "connect": None}
+                    start = time.perf_counter()
+                    async with self.session.get(url, params=self._query_params(params), timeout=timeout,
+                                                trace_request_ctx=seconds) as r:
+                        if r.status not in (502, 503, 504) or self.retries <= attempt:
+                            seconds["response"] = time.perf_counter() - start
+                            content = await r.read()
+                            seconds["request"] = time.perf_counter() - start
+                            self._received(len(content))
+                            return r.status, content, seconds
+                except (aiohttp.ClientConnectorError, aiohttp.ServerDisconnectedError,
+                        aiohttp.ConnectionTimeoutError):
+                    if self.retries <= attempt:
+                        raise
+                await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+                attempt += 1
+
+    async def check_server_compatibility(self):
+        url = "http://" + self.host + "/solar_api/GetAPIVersion.cgi"
+        api_vers = await self._get(url)
+        return self._check_api_version(api_vers), api_vers
+
+    async def get_inverter_realtime_data(self):
+        url, payload = self._realtime_request()
+        return await self._get(url, params=payload)
+
+    async def get_historical_data_json(self, from_date, to_date, channels=None):
+        url, payload = self._archive_request(from_date, to_date, channels)
+        return await self._get(url, params=payload)
+
+    async def get_historical_data_bytes(self, from_date, to_date, channels=None):
+        url, payload = self._archive_request(from_date, to_date, channels)
+        return self._undecoded(url, *await self._request(url, params=payload))
+
+    async def iter_realtime_data(self, interval=1.0, deduplicator=None, samples=None):
+        """async generator, see FroniusInverter.iter_realtime_data"""
+        if deduplicator is None:
+            deduplicator = FroniusRealTimeDeduplicator()
+        served = 0
+        while samples is None or served < samples:
+            json = await self.get_inverter_realtime_data()
+            accepted, wake = self._realtime_poll(deduplicator, json, interval)
+            if accepted:
+                yield FroniusRealTimeJson(json)
+                served += 1
+            await asyncio.sleep(max(0.0, wake - time.time()))
+
+    async def get_historical_events_json(self, from_date, to_date):
+        url, payload = self._events_request(from_date, to_date)
+        return await self._get(url, params=payload)
+
+    async def get_historical_data(self, from_date, to_date, channels=None, strict=True, max_workers=None,
+                                  dtypes=None, index=False):
+        """
+            fetch archive data in windows of max_query_time, up to max_workers windows at a time, see _fetch_windows.
+            windows are merged in time order and the first window with an error stops the query.
+        """
+        from_date, to_date = self._utc_range(from_date, to_date)
+
+        responses = []
+        windows = self._fetch_windows(self._query_windows(from_date, to_date), channels, max_workers)
+        try:
+            async for jsondata in windows:
+                responses.append(jsondata)
+                if FroniusJson(jsondata).error_code() != 0:
+                    break
+        finally:
+            await windows.aclose()
+
+        frames = self._iter_archive_frames(responses, from_date, to_date, False, dtypes, index)
+        return self._concat_frames(frames, from_date, to_date, strict)
+
+    async def iter_historical_data(self, from_date, to_date, channels=None, strict=True, max_workers=None,
+                                   dtypes=None, index=False):
+        """
+            async generator yielding (device_id, DataFrame) for every window, in time order, see
+            FroniusInverter.iter_historical_data and _fetch_windows.
+        """
+        from_date, to_date = self._utc_range(from_date, to_date)
+
+        windows = self._fetch_windows(self._query_windows(from_date, to_date), channels, max_workers)
+        try:
+            async for jsondata in windows:
+                for key, df in self._iter_archive_frames([jsondata], from_date, to_date, strict, dtypes, index):
+                    yield key, df
+                if FroniusJson(jsondata).error_code() != 0:
+                    break
+        finally:
+            await windows.aclose()
+
+    async def _fetch_windows(self, windows, channels=None, max_workers=None):
+        """
+            async generator of the archive json of every window, in order. up to max_workers windows
+            (default: max_concurrency) are fetched ahead: the next window is requested as one is yielded
+        """
+        max_workers = max(1, self.max_concurrency if max_workers is None else max_workers)
+        pending = iter(windows)
+        tasks = collections.deque()
+        try:
+            for fdate, tdate in pending:
+                tasks.append(asyncio.ensure_future(self.get_historical_data_json(fdate, tdate, channels)))
+                if max_workers <= len(tasks):
+                    break
+            while tasks:
+                jsondata = await tasks.popleft()
+                for fdate, tdate in pending:
+                    tasks.append(asyncio.ensure_future(self.get_historical_data_json(fdate, tdate, channels)))
+                    break
+                yield jsondata
+        finally:
+            # stop fetching windows nobody is waiting for anymore
+            for task in tasks:
+                task.cancel()
+
+    async def get_planned_historical_data(self, plan, from_date, to_date, strict=True, max_workers=None,
+                                          dtypes=None, index=False):
+        """see FroniusInverter.get_planned_historical_data"""
+        result = None
+        for name, channels in plan.groups.items():
+            responses, received = self.received_responses, self.received_bytes
+            data = await self.get_historical_data(from_date, to_date, channels, strict, max_workers, dtypes, index)
+            plan.requests += self.received_responses - responses
+            plan.received_bytes += self.received_bytes - received
+            result = self._merge_planned(result, data, index)
+        return result
+
+    async def find_earliest_data(self, from_date=None):
+        return await self.find_earliest_data_binary(from_date)
+
+    async def find_earliest_data_exponential(self, from_date=None, to_date=None, probes=None):
+        return await self._search(self._earliest_data_search(from_date, to_date), probes)
+
+    async def _search(self, search, probes=None):
+        if probes is None:
+            probes = self.probes
+        self.search_requests = 0
+        try:
+            window = next(search)
+            while True:
+                if window in probes:
+                    earliest = probes[window]
+                else:
+                    json = await self.get_historical_data_json(window[0], window[1], ["TimeSpanInSec"])
+                    self.search_requests += 1
+                    earliest = self._store_probe(window, json, probes)
+                window = search.send(earliest)
+        except StopIteration as stop:
+            return stop.value
+
+    async def find_earliest_data_linear(self, from_date=None):
         channel = "TimeSpanInSec"
 
         if from_date is None:
             from_date = self.epoch
-        if to_date is None:
-            to_date = datetime.datetime.now(pytz.utc)
-
-        sampleScope = self.max_query_time
+        to_date = datetime.datetime.now(pytz.utc)
 
-        # print("find_earliest_data:", str(from_date), " - ", str(to_date), "[ ", str(to_date - from_date), " ]")
         assert (from_date < to_date)
 
-        testTimeStart = max(from_date, from_date + (to_date - from_date) / 2 - sampleScope / 2)
-        testTimeEnd = min(to_date, testTimeStart + sampleScope)
-        result = self.get_historical_data_json(testTimeStart, testTimeEnd, [channel])
+        step = self.max_query_time
+        while from_date < to_date:
+            result = await self.get_historical_data_json(from_date, from_date + step, [channel])
+            if 1 == len(result["Body"]["Data"]):
+                return self._get_start_of_events(result)
+            from_date += step
+
+        return None
+
+    async def find_earliest_data_binary(self, from_date=None, to_date=None, probes=None):
+        return await self._search(self._binary_data_search(from_date, to_date), probes)
+
+
+class FroniusFleetPoller:
+    """
+        sample the realtime data of many inverters on fixed wall clock ticks. requires aiohttp.
+
+        every interval seconds, aligned to the wall clock, all hosts are queried concurrently.
+        a request not answered within deadline seconds is abandoned, so a slow or dead inverter
+        only loses its own sample.  each tick emits one batch {host: FroniusRealTimeJson}
+        to callback(tick, batch) and/or queue.put_nowait((tick, batch)).
+        ticks that could not be served because the previous tick overran are counted as missed.
+        with a FroniusRealTimeDeduplicator, samples with an unchanged timestamp are left out of the batch,
+        and hosts are not polled before their next expected refresh (counted as skipped).
+    """
+
+    interval = 5
+
+    def __init__(self, hosts, interval=None, deadline=None, callback=None, queue=None, session=None,
+                 deduplicator=None, request_metrics=None):
+        if aiohttp is None:
+            raise ImportError("FroniusFleetPoller requires aiohttp")
+        self.hosts = list(hosts)
+        self.deduplicator = deduplicator
+        self.request_metrics = request_metrics
+        if interval is not None:
+            self.interval = interval
+        self.deadline = self.interval if deadline is None else deadline
+        self.callback = callback
+        self.queue = queue
+        self.session = session
+        self.ticks = 0
+        self.missed_ticks = 0
+        self.host_metrics = {host: {"samples": 0, "errors": 0, "timeouts": 0, "skipped": 0, "latency_sum": 0.0,
+                                    "latency_max": 0.0, "latency_last": np.nan} for host in self.hosts}
+        self._running = False
+
+    def stop(self):
+        self._running = False
+
+    def metrics(self):
+        """per host counters and request latency in seconds, as a DataFrame indexed by host"""
+        df = pd.DataFrame.from_dict(self.host_metrics, orient="index")
+        df["latency_mean"] = df["latency_sum"] / df["samples"].where(df["samples"] > 0)
+        return df.drop(columns="latency_sum")
+
+    async def run(self, ticks=None):
+        """poll until stop() is called, or until ticks ticks have been served"""
+        session = self.session
+        if session is None:
+            session = aiohttp.ClientSession(trace_configs=_aiohttp_trace_configs(self.request_metrics))
+        inverters = {host: AsyncFroniusInverter(host, session=session, retries=0, timeout=self.deadline,
+                                                metrics=self.request_metrics)
+                     for host in self.hosts}
+
+        self._running = True
+        tick = math.floor(time.time() / self.interval) + 1
+        served = 0
+        try:
+            while self._running and (ticks is None or served < ticks):
+                await asyncio.sleep(max(0.0, tick * self.interval - time.time()))
+                tick_date = datetime.datetime.fromtimestamp(tick * self.interval, pytz.utc)
+
+                due = [host for host in inverters if self._due(host, tick * self.interval)]
+                samples = await asyncio.gather(*[self._sample(host, inverters[host]) for host in due],
+                                               return_exceptions=True)
+                batch = {}
+                for host, sample in zip(due, samples):
+                    if isinstance(sample, Exception):
+                        self.host_metrics[host]["errors"] += 1
+                    elif sample is not None:
+                        batch[host] = sample
+                self._emit(tick_date, batch)
+                self.ticks += 1
+                served += 1
+
+                next_tick = math.floor(time.time() / self.interval) + 1
+                self.missed_ticks += max(0, next_tick - tick - 1)
+                tick = next_tick
+        finally:
+            self._running = False
+            if self.session is None:
+                await session.close()
+
+    def _due(self, host, tick_time):
+        """false if the host is not expected to have refreshed its data by tick_time"""
+        if self.deduplicator is None:
+            return True
+        refresh = self.deduplicator.next_refresh(host, tick_time)
+        if refresh is None or refresh <= tick_time:
+            return True
+        self.host_metrics[host]["skipped"] += 1
+        return False
+
+    async def _sample(self, host, inverter):
+        metrics = self.host_metrics[host]
+        start = time.perf_counter()
+        try:
+            json = await asyncio.wait_for(inverter.get_inverter_realtime_data(), self.deadline)
+            latency = time.perf_counter() - start
+            # a malformed response fails here, and only loses the sample of its host
+            sample = FroniusRealTimeJson(json)
+            accepted = self.deduplicator is None or self.deduplicator.accept(host, json)
+        except asyncio.TimeoutError:
+            metrics["timeouts"] += 1
+            return None
+        except (aiohttp.ClientError, ValueError, KeyError, TypeError, AssertionError):
+            metrics["errors"] += 1
+            return None
+
+        metrics["samples"] += 1
+        metrics["latency_sum"] += latency
+        metrics["latency_max"] = max(metrics["latency_max"], latency)
+        metrics["latency_last"] = latency
+        return sample if accepted else None
+
+    def _emit(self, tick, batch):
+        if self.callback is not None:
+            self.callback(tick, batch)
+        if self.queue is not None:
+            self.queue.put_nowait((tick, batch))
+
+
+class FroniusRealTimeDeduplicator:
+    """
+        drop realtime samples whose Head.Timestamp did not change since the previous sample of their host.
+        raw timestamp strings are compared, so dropped samples are never parsed.
+        the timestamps of the accepted samples tell how often a host refreshes its data, see next_refresh.
+        responses with an error are passed and not counted.
+    """
+
+    history = 16
+    """ number of refreshes per host the refresh interval is estimated from """
+
+    margin = 0.1
+    """ seconds to wait after an expected refresh before polling """
+
+    def __init__(self, history=None, margin=None):
+        if history is not None:
+            self.history = history
+        if margin is not None:
+            self.margin = margin
+        self.hosts = {}
+
+    def _state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = {"last": None, "accepted": 0, "dropped": 0,
+                                        "refreshes": collections.deque(maxlen=self.history),
+                                        "delays": collections.deque(maxlen=self.history)}
+        return state
+
+    def accept(self, host, json, now=None):
+        """true if json is a new sample of host, false if it repeats the timestamp of the previous one"""
+        if FroniusJson(json).error_code() != 0:
+            return True
+        state = self._state(host)
+        timestamp = json["Head"]["Timestamp"]
+        if timestamp == state["last"]:
+            state["dropped"] += 1
+            return False
+
+        state["last"] = timestamp
+        state["accepted"] += 1
+        refreshed = _parse_date(timestamp).timestamp()
+        state["refreshes"].append(refreshed)
+        # seen some time after the refresh: the smallest delay bounds network latency and clock offset
+        state["delays"].append((time.time() if now is None else now) - refreshed)
+        return True
+
+    def refresh_interval(self, host):
+        """
+            seconds between refreshes of host, or None while unknown. the smallest step between
+            accepted timestamps: slower polling only yields multiples of it
+        """
+        refreshes = self._state(host)["refreshes"]
+        steps = [b - a for a, b in zip(refreshes, list(refreshes)[1:]) if a < b]
+        return min(steps) if steps else None
+
+    def next_refresh(self, host, now=None):
+        """wall clock time (epoch seconds) the next refresh of host is expected to be visible, or None"""
+        interval = self.refresh_interval(host)
+        if interval is None:
+            return None
+        state = self._state(host)
+        if now is None:
+            now = time.time()
+        delay = min(state["delays"])
+        refresh = state["refreshes"][-1] + interval
+        if refresh + delay < now:
+            refresh += math.ceil((now - refresh - delay) / interval) * interval
+        return refresh + delay + self.margin
+
+    def metrics(self):
+        """per host accepted and dropped samples and refresh interval in seconds, as a DataFrame indexed by host"""
+        return pd.DataFrame.from_dict({host: {"accepted": state["accepted"], "dropped": state["dropped"],
+                                              "refresh_interval": self.refresh_interval(host)}
+                                       for host, state in self.hosts.items()}, orient="index")
+
+
+class FroniusMetrics:
+    """
+        observations of FroniusInverter requests and FroniusJson parse steps, aggregated per name and labels
+        into count, sum and max. callback(name, value, labels), if given, sees every observation.
+
+        requests report dns_seconds and connect_seconds (new connections only), response_seconds (until the
+        headers), request_seconds (with the body), response_bytes, decode_seconds, and responses labelled
+        with the HTTP status and the Fronius error code. FroniusArchiveJson.data() reports data_seconds
+        and data_rows.  export with prometheus() or write().
+    """
+
+    namespace = "fronius"
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {"count": 0, "sum": 0.0, "max": value}
+            series["count"] += 1
+            series["sum"] += value
+            series["max"] = max(series["max"], value)
+        if self.callback is not None:
+            self.callback(name, value, labels)
+
+    def frame(self):
+        """one row per name and labels, with count, sum, mean and max"""
+        with self._lock:
+            rows = [dict(labels, name=name, **series) for (name, labels), series in self.series.items()]
+        df = pd.DataFrame(rows)
+        if len(df) != 0:
+            df["mean"] = df["sum"] / df["count"]
+        return df
+
+    def prometheus(self):
+        """the series in the Prometheus text exposition format: a summary (count, sum) and a max gauge per name"""
+        with self._lock:
+            series = sorted(self.series.items())
+        names = {}
+        for (name, labels), values in series:
+            text = ",".join('%s="%s"' % (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                            for k, v in labels)
+            names.setdefault(name, []).append(("{" + text + "}" if text else "", values))
+
+        lines = []
+        for name, samples in names.items():
+            metric = self.namespace + "_" + name
+            lines.append("# TYPE " + metric + " summary")
+            for text, values in samples:
+                lines.append("%s_count%s %d" % (metric, text, values["count"]))
+                lines.append("%s_sum%s %r" % (metric, text, float(values["sum"])))
+            lines.append("# TYPE " + metric + "_max gauge")
+            for text, values in samples:
+                lines.append("%s_max%s %r" % (metric, text, float(values["max"])))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """write prometheus() to path atomically, e.g. for the textfile collector of the node exporter"""
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self.prometheus())
+        os.replace(tmp, path)
+
+
+_connection_timings = threading.local()
+""" dns and connect seconds of the last connection opened by the current thread """
+
+
+class _TimedHTTPConnection(urllib3.connection.HTTPConnection):
+    def _new_conn(self):
+        """resolve the host once, timed, then connect to its addresses in turn, like urllib3 does"""
+        start = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(self._dns_host, self.port, urllib3.util.connection.allowed_gai_family(),
+                                           socket.SOCK_STREAM)
+        except OSError:
+            # urllib3 raises the lookup error
+            return super()._new_conn()
+        resolved = time.perf_counter()
+
+        dns_host = self._dns_host
+        try:
+            for i, address in enumerate(addresses):
+                # the numeric address is not looked up again
+                self._dns_host = address[4][0]
+                try:
+                    sock = super()._new_conn()
+                    break
+                except (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError):
+                    if i == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = dns_host
+        _connection_timings.dns = resolved - start
+        _connection_timings.connect = time.perf_counter() - resolved
+        return sock
+
+
+class _TimedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPAdapter(requests.adapters.HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = dict(self.poolmanager.pool_classes_by_scheme,
+                                                       http=_TimedHTTPConnectionPool)
+
+
+def _aiohttp_trace_configs(metrics):
+    """aiohttp trace configs filling dns and connect seconds into the trace_request_ctx dict of requests"""
+    if metrics is None:
+        return []
+
+    async def dns_start(session, context, params):
+        context.dns_start = time.perf_counter()
+
+    async def dns_end(session, context, params):
+        context.trace_request_ctx["dns"] = time.perf_counter() - context.dns_start
+
+    async def connect_start(session, context, params):
+        context.connect_start = time.perf_counter()
+
+    async def connect_end(session, context, params):
+        context.trace_request_ctx["connect"] = time.perf_counter() - context.connect_start
+
+    trace = aiohttp.TraceConfig()
+    trace.on_dns_resolvehost_start.append(dns_start)
+    trace.on_dns_resolvehost_end.append(dns_end)
+    trace.on_connection_create_start.append(connect_start)
+    trace.on_connection_create_end.append(connect_end)
+    return [trace]
+
+
+class FroniusWindowSizer:
+    """
+        adaptive archive query window length, remembered per (host, channels) key.
+        windows rejected by the inverter are halved, windows that succeed are doubled, up to max_size.
+        once a size failed, growing bisects between the largest size that succeeded and the smallest
+        that failed, so the length settles just below the inverter limit. share one sizer between
+        FroniusInverter instances to reuse what was learned.
+    """
+
+    min_size = datetime.timedelta(days=1)
+    """ windows are not split further. the inverter widens requests to whole local days anyway """
+
+    max_size = datetime.timedelta(days=16)
+
+    def __init__(self, min_size=None, max_size=None):
+        if min_size is not None:
+            self.min_size = min_size
+        if max_size is not None:
+            self.max_size = max_size
+        self.sizes = {}
+        self.succeeded = {}
+        self.failed = {}
+        self.counters = {}
+
+    def size(self, key, initial):
+        """the window length to query next for key, initial for a new key"""
+        if key not in self.sizes:
+            self.sizes[key] = max(self.min_size, min(self.max_size, initial))
+            self.counters[key] = {"requests": 0, "errors": 0, "splits": 0, "grows": 0}
+        return self.sizes[key]
+
+    def success(self, key, size):
+        counters = self.counters[key]
+        counters["requests"] += 1
+        self.succeeded[key] = max(self.succeeded.get(key, size), size)
+        if size < self.sizes[key]:
+            return
+        grown = min(self.max_size, 2 * size)
+        failed = self.failed.get(key)
+        if failed is not None and failed <= grown:
+            grown = (self.succeeded[key] + failed) / 2
+            if grown - self.succeeded[key] < self.min_size:
+                grown = self.succeeded[key]
+        if size < grown:
+            counters["grows"] += 1
+        self.sizes[key] = grown
+
+    def failure(self, key, size):
+        """
+            record a window of length size rejected for its length (status 255), and split it.
+            a window may succeed or fail depending on how it aligns to the local days, so a size that
+            failed once is never tried again
+        """
+        counters = self.counters[key]
+        counters["requests"] += 1
+        counters["errors"] += 1
+        self.failed[key] = min(self.failed.get(key, size), size)
+        if self.failed[key] <= self.succeeded.get(key, datetime.timedelta(0)):
+            del self.succeeded[key]
+        if self.min_size < size:
+            counters["splits"] += 1
+            self.sizes[key] = max(self.min_size, size / 2)
+
+    def error(self, key):
+        """record a window that failed for another reason than its length"""
+        self.counters[key]["requests"] += 1
+        self.counters[key]["errors"] += 1
+
+    def stats(self):
+        """per key window length and counters, as a DataFrame indexed by host and channels"""
+        rows = {(host, ",".join(channels)): dict(self.counters[(host, channels)], size=size,
+                                                 succeeded=self.succeeded.get((host, channels)),
+                                                 failed=self.failed.get((host, channels)))
+                for (host, channels), size in self.sizes.items()}
+        df = pd.DataFrame.from_dict(rows, orient="index")
+        df.index.names = ["host", "channels"]
+        return df
+
+
+class FroniusFetchPlan:
+    """
+        channel groups of a historical data query, see FroniusInverter.plan_historical_data.
+        every group is fetched with its own requests. requests and received_bytes count what
+        get_planned_historical_data transferred for this plan
+    """
+
+    def __init__(self, groups):
+        self.groups = groups
+        self.requests = 0
+        self.received_bytes = 0
+
+    def channels(self):
+        return [channel for channels in self.groups.values() for channel in channels]
+
+    def __repr__(self):
+        return "FroniusFetchPlan(%r, requests=%d, received_bytes=%d)" % (self.groups, self.requests,
+                                                                         self.received_bytes)
+
 
-        if 0 == len(result["Body"]["Data"]):
-            # no data was found in this interval
+class FroniusBackfill:
+    """
+        archive data of many inverters, fetched with threads and decoded in processes.
+
+        every host is fetched by a thread, one window of max_query_time after the other, and the
+        undecoded response bodies are sent to a ProcessPoolExecutor of max_workers processes. the
+        processes decode the JSON, build the frames and return only NumPy buffers: the UTC timestamps,
+        and values and NA masks of every channel.  every window keeps only its own time range, so the
+        day shared by consecutive windows is not repeated.  like get_historical_data, a host stops at the
+        first window with an error, with a warning. a host fetches at most backlog windows ahead of their
+        decode, so no more than backlog windows are fetched after the error, and their decodes still
+        waiting for a process are cancelled.
+        timestamps are UTC, see FroniusArchiveJson.data for dtypes and index.
+    """
+
+    max_workers = None
+    """ decoding processes, os.cpu_count() by default """
+    fetch_workers = 16
+    """ hosts fetched at the same time """
+    backlog = 4
+    """ windows of a host fetched ahead of their decode """
+
+    def __init__(self, max_workers=None, fetch_workers=None, channels=None, dtypes=None, index=False):
+        if max_workers is not None:
+            self.max_workers = max_workers
+        if fetch_workers is not None:
+            self.fetch_workers = fetch_workers
+        self.channels = channels if channels is not None else FroniusInverter.get_all_channels()
+        self.dtypes = dtypes
+        self.index = index
+
+    def fetch(self, hosts, from_date, to_date, **inverter_args):
+        """archive data of hosts from from_date to to_date: {host: {device_id: DataFrame}}, None without data"""
+        from_date, to_date = FroniusInverter._utc_range(from_date, to_date)
+        with concurrent.futures.ProcessPoolExecutor(self.max_workers) as processes, \
+                concurrent.futures.ThreadPoolExecutor(max(1, min(self.fetch_workers, len(hosts)))) as threads:
+            futures = {host: threads.submit(self._fetch_host, processes, host, from_date, to_date, inverter_args)
+                       for host in hosts}
+            return {host: future.result() for host, future in futures.items()}
+
+    def _fetch_host(self, processes, host, from_date, to_date, inverter_args):
+        with FroniusInverter(host, **inverter_args) as fi:
+            timestamp_colname = fi.timestamp_colname
+            futures = []
+            for fdate, tdate in fi._query_windows(from_date, to_date):
+                if self.backlog <= len(futures):
+                    futures[len(futures) - self.backlog].result()
+                if any(future.done() and future.result()[0] is not None for future in futures):
+                    break
+                content = fi.get_historical_data_bytes(fdate, tdate, self.channels)
+                futures.append(processes.submit(_decode_archive_window, content, fdate, tdate, self.dtypes,
+                                                timestamp_colname))
+
+        windows = []
+        for future in futures:
+            windows.append(future.result())
+            if windows[-1][0] is not None:
+                for waiting in futures:
+                    waiting.cancel()
+                break
+        return self._frames(windows, timestamp_colname)
+
+    def _frames(self, windows, timestamp_colname="ts"):
+        """one frame per device of the decoded windows, up to the first window with an error"""
+        frames = {}
+        for error_status, devices in windows:
+            if error_status is not None:
+                warnings.warn(str(error_status))
+                break
+            for device, (timestamps, columns) in devices.items():
+                frames.setdefault(device, []).append(_frame_from_buffers(timestamps, columns, timestamp_colname,
+                                                                         self.index))
+        if len(frames) == 0:
+            return None
+        return {device: parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=not self.index)
+                for device, parts in frames.items()}
+
+
+class FroniusParquetExport:
+    """
+        export archive data to Parquet files partitioned by host, device and day (UTC). requires pyarrow.
+
+        every window is fetched, parsed into an Arrow record batch per device and day and written to
+        directory/host=<host>/device=<device>/day=<YYYY-MM-DD>/part-<window start>.parquet, one window
+        at a time, so memory stays bounded by one window.  host and device are URL quoted, as pyarrow
+        expects of hive partitions.  every window keeps the rows from its start up to the next window,
+        so the partitions hold no duplicates.  timestamps are UTC, columns have the compact dtypes by default.
+        the end of the exported range of a host is recorded in its _progress.json after every window,
+        and an interrupted or failed export resumes from there.
+        devices have different channels: read a device directory as a dataset, or unify the schemas.
+    """
 
-            if testTimeEnd == to_date:
-                # No data found at all!
-                return None
+    progress_file = "_progress.json"
+
+    def __init__(self, directory, channels=None, dtypes=True):
+        if pa is None:
+            raise ImportError("FroniusParquetExport requires pyarrow")
+        self.directory = directory
+        self.channels = channels
+        self.dtypes = dtypes
+        self.files = 0
+
+    def _host_directory(self, host):
+        return os.path.join(self.directory, "host=" + urllib.parse.quote(host, safe=""))
+
+    def progress(self, host):
+        """the end of the range exported for host, or None"""
+        try:
+            with open(os.path.join(self._host_directory(host), self.progress_file)) as f:
+                return datetime.datetime.fromisoformat(json.load(f)["exported_to"])
+        except FileNotFoundError:
+            return None
+
+    def _save_progress(self, host, date):
+        path = os.path.join(self._host_directory(host), self.progress_file)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"exported_to": date.isoformat()}, f)
+        os.replace(path + ".tmp", path)
+
+    def export(self, hosts, from_date, to_date, **inverter_args):
+        """export every host, one after the other. returns {host: rows written}"""
+        rows = {}
+        for host in hosts:
+            with FroniusInverter(host, **inverter_args) as fi:
+                rows[host] = self.export_inverter(fi, from_date, to_date)
+        return rows
+
+    def export_inverter(self, fi, from_date, to_date):
+        """export the range of one FroniusInverter, resuming after its progress. returns the rows written"""
+        if not isinstance(fi, FroniusInverter):
+            raise TypeError("FroniusParquetExport needs a blocking FroniusInverter")
+        from_date, to_date = fi._utc_range(from_date, to_date)
+        exported = self.progress(fi.host)
+        if exported is not None and from_date < exported:
+            from_date = exported
+
+        windows = fi._query_windows(from_date, to_date)
+        responses = fi._fetch_windows(windows, self.channels)
+        rows = 0
+        try:
+            for (fdate, tdate), jsondata in zip(windows, responses):
+                faj = FroniusArchiveJson(jsondata, fi.metrics, fi.host)
+                if faj.error_code() != 0:
+                    warnings.warn(str(faj.error_status()))
+                    break
+                for device, df in faj.data(fi.timestamp_colname, self.dtypes).items():
+                    rows += self._write(fi.host, device, fdate, tdate, df, fi.timestamp_colname)
+                self._save_progress(fi.host, tdate)
+        finally:
+            responses.close()
+        return rows
+
+    def _write(self, host, device, fdate, tdate, df, timestamp_colname):
+        ts = df[timestamp_colname].dt.tz_convert("UTC")
+        mask = ((fdate <= ts) & (ts < tdate)).to_numpy()
+        df = df.loc[mask].assign(**{timestamp_colname: ts[mask]})
+        device_directory = os.path.join(self._host_directory(host), "device=" + urllib.parse.quote(device, safe=""))
+        days = df[timestamp_colname].dt.floor("D")
+        for day, part in df.groupby(days, sort=True):
+            directory = os.path.join(device_directory, "day=" + day.date().isoformat())
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, "part-%d.parquet" % int(fdate.timestamp()))
+            batch = pa.RecordBatch.from_pandas(part, preserve_index=False)
+            pq.write_table(pa.Table.from_batches([batch]), path + ".tmp")
+            os.replace(path + ".tmp", path)
+            self.files += 1
+        return len(df)
+
+
+class FroniusArchiveCache:
+    """
+        on-disk cache of archive data, keyed by host, device, channel and day (UTC).
+
+        every day of a host is one NumPy .npz file holding, per device and channel, the sample
+        timestamps (seconds since 1970 UTC) and values, and the list of channels that were fetched,
+        so days or channels without data are cached as well.
+        only closed days are stored.  with max_bytes, the least recently used days are evicted.
+        the directory is walked once, on the first eviction: an index of the days in use order and
+        their sizes is then kept up to date by get and put.
+    """
+
+    epoch = pd.Timestamp(0, tz="UTC")
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lru = None
+        self._lru_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def day_start(day):
+        return pytz.utc.localize(datetime.datetime(day.year, day.month, day.day), is_dst=None)
+
+    @staticmethod
+    def split_days(faj):
+        """split the channels of a FroniusArchiveJson by day: {day: {device: {channel: (timestamps, values)}}}"""
+        start = int(faj.start_date().timestamp())
+        result = {}
+        for device in faj.device_ids():
+            for channel in faj.channels(device):
+                offsets, values = faj.values(device, channel)
+                timestamps = offsets + start
+                day_numbers = timestamps // 86400
+                for day_number in np.unique(day_numbers):
+                    day = datetime.date(1970, 1, 1) + datetime.timedelta(days=int(day_number))
+                    mask = day_numbers == day_number
+                    result.setdefault(day, {}).setdefault(device, {})[channel] = (timestamps[mask], values[mask])
+        return result
+
+    @staticmethod
+    def split_rows(split):
+        """the rows of the frames of split_days: the distinct timestamps of every day and device"""
+        rows = 0
+        for devices in split.values():
+            for device_columns in devices.values():
+                timestamps = [timestamps for timestamps, values in device_columns.values()]
+                rows += len(np.unique(np.concatenate(timestamps)))
+        return rows
+
+    def _path(self, host, day):
+        return os.path.join(self.directory, urllib.parse.quote(host, safe=""), day.isoformat() + ".npz")
+
+    def _load(self, path):
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                channels = list(npz["channels"])
+                columns = {}
+                for i, name in enumerate(npz["names"]):
+                    device, channel = name.split("\t")
+                    columns.setdefault(device, {})[channel] = (npz["t" + str(i)], npz["v" + str(i)])
+        except (FileNotFoundError, ValueError, KeyError):
+            return None, {}
+        return channels, columns
+
+    def get(self, host, day, channels):
+        """the cached {device: {channel: (timestamps, values)}} of a day, or None if any channel is missing"""
+        path = self._path(host, day)
+        cached_channels, columns = self._load(path)
+        if cached_channels is None or not set(channels) <= set(cached_channels):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        os.utime(path)
+        if self._lru is not None and path in self._lru:
+            self._lru.move_to_end(path)
+        return {device: {channel: value for channel, value in device_columns.items() if channel in channels}
+                for device, device_columns in columns.items()}
+
+    def put(self, host, day, channels, columns):
+        """store the columns of a closed day, fetched for channels. merges with channels cached before"""
+        path = self._path(host, day)
+        cached_channels, cached = self._load(path)
+        if cached_channels is not None:
+            for device, device_columns in columns.items():
+                cached.setdefault(device, {}).update(device_columns)
+            columns = cached
+            channels = cached_channels + [c for c in channels if c not in cached_channels]
+
+        arrays = {"channels": np.array(channels, dtype=str)}
+        names = []
+        for device, device_columns in columns.items():
+            for channel, (timestamps, values) in device_columns.items():
+                arrays["t" + str(len(names))] = timestamps
+                arrays["v" + str(len(names))] = values.astype(float) if values.dtype == object else values
+                names.append(device + "\t" + channel)
+        arrays["names"] = np.array(names, dtype=str)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+        if self._lru is not None:
+            self._lru_bytes -= self._lru.pop(path, 0)
+            self._lru[path] = os.path.getsize(path)
+            self._lru_bytes += self._lru[path]
+        self.evict()
+
+    def size(self):
+        return sum(os.path.getsize(path) for path in self._files())
+
+    def _files(self):
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".npz"):
+                    yield os.path.join(root, name)
+
+    def evict(self):
+        """remove least recently used days until the cache fits in max_bytes"""
+        if self.max_bytes is None:
+            return
+        if self._lru is None:
+            files = sorted(((os.stat(path), path) for path in self._files()), key=lambda f: f[0].st_mtime)
+            self._lru = collections.OrderedDict((path, stat.st_size) for stat, path in files)
+            self._lru_bytes = sum(self._lru.values())
+        while self.max_bytes < self._lru_bytes:
+            path, size = self._lru.popitem(last=False)
+            self._lru_bytes -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class FroniusJsonDecoder:
+    """
+        decode a response body. loads defaults to orjson.loads when orjson is installed, else json.loads.
+        skip_keys names string-valued keys, like "_comment" and "Unit" of the archive channels, that are
+        cut from the raw bytes before decoding, so their strings are never built. cutting scans the body,
+        which costs more than it saves on archive bodies, where the values dominate (bench_json_decoder).
+    """
+
+    _string_value = re.compile(rb'\s*:\s*"(?:[^"\\]|\\.)*"\s*')
+
+    def __init__(self, loads=None, skip_keys=()):
+        if loads is None:
+            loads = orjson.loads if orjson is not None else json.loads
+        self.loads = loads
+        self.skip_keys = [b'"' + key.encode() + b'"' for key in skip_keys]
+
+    def __call__(self, content):
+        if self.skip_keys:
+            content = self._skip(content)
+        return self.loads(content)
+
+    def _skip(self, content):
+        cuts = []
+        for needle in self.skip_keys:
+            i = content.find(needle)
+            while i != -1:
+                m = self._string_value.match(content, i + len(needle))
+                if m:
+                    cuts.append((i, m.end()))
+                i = content.find(needle, i + len(needle))
+        if not cuts:
+            return content
+
+        # adjacent pairs, only a comma apart, are cut as one
+        merged = []
+        for start, end in sorted(cuts):
+            if merged and content[merged[-1][1]:start].strip() == b",":
+                merged[-1][1] = end
             else:
-                # search the data later than the test time + scope
-                return self.find_earliest_data_binary(testTimeEnd, to_date)
-        else:
-            # data was found.
-            earliestFound = self._get_start_of_events(result)
-            # print("earliest data at : ", earliestFound)
-            if testTimeStart == from_date:
-                # we found the earliest point
-                return earliestFound
+                merged.append([start, end])
+
+        parts = []
+        pos = 0
+        for start, end in merged:
+            # drop the comma after the pairs, or the one before them when they are last in their object
+            if content[end:end + 1] == b",":
+                end += 1
             else:
-                # look for earlier data
-                return self.find_earliest_data_binary(from_date, earliestFound + datetime.timedelta(seconds=1))
+                before = start
+                while pos < before and content[before - 1] in b" \t\r\n":
+                    before -= 1
+                if pos < before and content[before - 1:before] == b",":
+                    start = before - 1
+            parts.append(content[pos:start])
+            pos = end
+        parts.append(content[pos:])
+        return b"".join(parts)
+
+
+def _parse_date(value):
+    """parse an ISO 8601 date of the inverter. falls back to dateutil for other formats"""
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return dateutil.parser.parse(value)
 
 
 class FroniusJson:
-    def __init__(self, json):
+    def __init__(self, json, metrics=None, host=None):
+        """metrics is an optional FroniusMetrics observing the parse steps, labelled with host"""
         assert isinstance(json, dict)
         assert ('Body' in json)
         assert isinstance(json["Body"], dict)
         assert ('Head' in json)
         assert isinstance(json["Head"], dict)
         self.json = json
+        self.metrics = metrics
+        self.host = host
+        self._dates = {}
+
+    def _date(self, key, value):
+        # header dates are parsed once per response
+        date = self._dates.get(key)
+        if date is None:
+            date = self._dates[key] = _parse_date(value)
+        return date
 
     def start_date(self):
-        return dateutil.parser.parse(self.json["Head"]["RequestArguments"]["StartDate"])
+        return self._date("StartDate", self.json["Head"]["RequestArguments"]["StartDate"])
 
     def end_date(self):
-        return dateutil.parser.parse(self.json["Head"]["RequestArguments"]["EndDate"])
+        return self._date("EndDate", self.json["Head"]["RequestArguments"]["EndDate"])
 
     def timestamp(self):
-        return dateutil.parser.parse(self.json["Head"]["Timestamp"])
+        return self._date("Timestamp", self.json["Head"]["Timestamp"])
 
     def error_code(self):
         return int(self.json["Head"]["Status"]["Code"])
@@ -258,16 +1978,29 @@ class FroniusJson:
 
 
 class FroniusRealTimeJson(FroniusJson):
-    def __init__(self, json):
-        super().__init__(json)
+    def __init__(self, json, metrics=None, host=None):
+        super().__init__(json, metrics, host)
         if self.error_code() == 0:
             data = self.json["Body"]["Data"]
             assert ('YEAR_ENERGY' in (data.keys()))
 
+    def values(self):
+        """the measurements of this sample as a dict, keyed by channel name"""
+        return {key: value['Values']['1'] for key, value in self.json['Body']['Data'].items()}
+
     def data(self, timestamp_colname="ts", append=None):
+        """
+            the sample as a one row DataFrame.
+            append may be a previous DataFrame, which is merged with this sample,
+            or a FroniusRealTimeBuffer, which stores the sample in O(1) and is returned, so
+            d = frt.data("ts", append=d) keeps appending to it. use to_frame() for the samples.
+        """
+        if isinstance(append, FroniusRealTimeBuffer):
+            append.append(self)
+            return append
+
         series = [pd.Series([self.timestamp()], name=timestamp_colname)]
-        for key, value in self.json['Body']['Data'].items():
-            v = value['Values']['1']
+        for key, v in self.values().items():
             s = pd.Series([v], name=key)
             series += [s]
 
@@ -278,7 +2011,84 @@ class FroniusRealTimeJson(FroniusJson):
         return result
 
 
+class FroniusRealTimeBuffer:
+    """
+        fixed capacity store for realtime samples, keeping the latest capacity samples.
+
+        columns are preallocated NumPy arrays, so appending a sample is O(1).
+        every sample is written twice, at i and i + capacity, so the latest samples are always
+        one contiguous slice and to_frame() can return a view without copying.
+        channels default to the channels of the first sample appended.  missing values are NaN.
+    """
+
+    _epoch = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def __init__(self, capacity, channels=None, timestamp_colname="ts"):
+        assert capacity > 0
+        self.capacity = capacity
+        self.timestamp_colname = timestamp_colname
+        self.channels = None
+        self._timestamps = np.zeros(2 * capacity, dtype="datetime64[ns]")
+        self._values = None
+        self._count = 0
+        if channels is not None:
+            self._allocate(channels)
+
+    def _allocate(self, channels):
+        self.channels = list(channels)
+        self._values = np.full((len(self.channels), 2 * self.capacity), np.nan)
+        self._rows = {channel: row for row, channel in enumerate(self.channels)}
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def append(self, sample):
+        """append a FroniusRealTimeJson. error responses are ignored"""
+        if sample.error_code() != 0:
+            return
+        values = sample.values()
+        if self.channels is None:
+            self._allocate(values.keys())
+
+        i = self._count % self.capacity
+        j = i + self.capacity
+        timestamp = np.datetime64((sample.timestamp() - self._epoch) // datetime.timedelta(microseconds=1), "us")
+        self._timestamps[i] = self._timestamps[j] = timestamp
+        self._values[:, i] = self._values[:, j] = np.nan
+        for key, v in values.items():
+            row = self._rows.get(key)
+            if row is not None and v is not None:
+                self._values[row, i] = self._values[row, j] = v
+        self._count += 1
+
+    def _window(self):
+        end = self._count % self.capacity + self.capacity if self.capacity <= self._count else self._count
+        return slice(end - len(self), end)
+
+    def to_frame(self):
+        """
+            the stored samples, oldest first, as a DataFrame with a UTC timestamp column.
+            the columns are views of the buffer and only valid until the next append.
+            use to_frame().copy() for a snapshot that outlives it.
+        """
+        window = self._window()
+        timestamps = pd.DatetimeIndex(self._timestamps[window]).tz_localize(pytz.utc)
+        columns = {self.timestamp_colname: timestamps}
+        for channel in self.channels or []:
+            columns[channel] = self._values[self._rows[channel], window]
+        return pd.DataFrame(columns, copy=False)
+
+
 class FroniusArchiveJson(FroniusJson):
+    """
+        a GetArchiveData.cgi response. channels are decoded lazily: values() decodes one channel of one
+        device on first access and keeps its arrays, data() is built on values()
+    """
+
+    def __init__(self, json, metrics=None, host=None):
+        super().__init__(json, metrics, host)
+        self._values = {}
+
     def device_ids(self):
         return list(self.json["Body"]["Data"].keys())
 
@@ -287,30 +2097,674 @@ class FroniusArchiveJson(FroniusJson):
             deviceID = self.device_ids()[0]
         return list(self.json["Body"]["Data"][deviceID]["Data"].keys())
 
-    def data(self, timestamp_colname="ts"):
+    def values(self, deviceID, channel):
+        """
+            (offsets, values) of one channel as read-only NumPy arrays, decoded on first access.
+            offsets are seconds since start_date()
+        """
+        arrays = self._values.get((deviceID, channel))
+        if arrays is None:
+            my_dict = self.json["Body"]["Data"][deviceID]["Data"][channel]["Values"]
+            offsets = np.fromiter(map(int, my_dict.keys()), dtype=np.int64, count=len(my_dict))
+            values = pd.Series(list(my_dict.values())).to_numpy()
+            offsets.flags.writeable = False
+            values.flags.writeable = False
+            arrays = self._values[(deviceID, channel)] = (offsets, values)
+        return arrays
+
+    def data(self, timestamp_colname="ts", dtypes=None, index=False):
+        """
+            one DataFrame per device, with a row per timestamp and a column per channel.
+            dtypes maps channels to column dtypes. pass True for FroniusInverter.get_channel_dtypes()
+            with index, the timestamps are a sorted DatetimeIndex in UTC named timestamp_colname instead
+            of the first column, see FroniusInverter.local_time for local time
+        """
+        started = time.perf_counter()
         result = {}
+        start = pd.Timestamp(self.start_date())
         for deviceID in self.device_ids():
-            deviceDf = None
             channels = self.channels(deviceID)
-            for channel in channels:
-                my_dict = self.json["Body"]["Data"][deviceID]["Data"][channel]["Values"]
+            columns = {channel: self.values(deviceID, channel) for channel in channels}
+            # an outer join on the timestamps yields rows in timestamp order
+            df = _apply_dtypes(_frame_from_columns(start, columns, timestamp_colname, sort=len(channels) > 1), dtypes)
+            result[deviceID] = _time_indexed(df, timestamp_colname) if index else df
 
-                start = self.start_date()
-                offsets = pd.Series(list(my_dict.keys()))
-                timestamps = offsets.map(lambda x: datetime.timedelta(seconds=int(x)) + start)
+        self._observe_data(started, sum(len(df) for df in result.values()))
+        return result
+
+    def _observe_data(self, started, rows):
+        """report the time since started and the rows parsed to self.metrics"""
+        if self.metrics is not None:
+            labels = {} if self.host is None else {"host": self.host}
+            self.metrics.observe("data_seconds", time.perf_counter() - started, **labels)
+            self.metrics.observe("data_rows", rows, **labels)
+
+    def tidy_data(self, timestamp_colname="ts", dtypes=None, device_colname="device"):
+        """
+            all devices in one DataFrame, with a categorical device column after the timestamp.
+            channels a device does not have are <NA>/NaN for that device.
+        """
+        frames = self.data(timestamp_colname, dtypes)
+        if len(frames) == 0:
+            return pd.DataFrame({timestamp_colname: [], device_colname: pd.Categorical([])})
+
+        df = pd.concat(frames.values(), keys=frames.keys(), names=[device_colname, None])
+        df = df.reset_index(level=0).reset_index(drop=True)
+        df[device_colname] = pd.Categorical(df[device_colname], categories=list(frames.keys()))
+        columns = [timestamp_colname, device_colname] + [c for c in df.columns
+                                                         if c not in (timestamp_colname, device_colname)]
+        return df[columns]
+
+
+class FroniusEventsJson(FroniusArchiveJson):
+    """
+        a GetArchiveData.cgi response of the InverterErrors and InverterEvents channels.
+        a value is an event code, an object with the code in "#", or a list of those.
+    """
 
-                measurements = pd.Series(list(my_dict.values()))
+    categories = {"InverterErrors": "error", "InverterEvents": "event"}
+
+    def _event_arrays(self, deviceID, channel):
+        """(offsets, codes) of the events of one channel, offsets are seconds since start_date()"""
+        offsets = []
+        codes = []
+        for offset, value in self.json["Body"]["Data"][deviceID]["Data"][channel]["Values"].items():
+            for event in (value if isinstance(value, list) else [value]):
+                offsets.append(int(offset))
+                codes.append(int(event["#"] if isinstance(event, dict) else event))
+        return np.array(offsets, dtype=np.int64), np.array(codes, dtype=np.int32)
+
+    def events(self, timestamp_colname="ts"):
+        """all events in one DataFrame: timestamp, device, code and category ("error" or "event"), in time order"""
+        start = pd.Timestamp(self.start_date())
+        offsets, devices, codes, categories = [], [], [], []
+        for deviceID in self.device_ids():
+            for channel in self.channels(deviceID):
+                if channel not in self.categories:
+                    continue
+                o, c = self._event_arrays(deviceID, channel)
+                offsets.append(o)
+                codes.append(c)
+                devices.append(np.full(len(o), deviceID, dtype=object))
+                categories.append(np.full(len(o), self.categories[channel], dtype=object))
+
+        if len(offsets) == 0:
+            offsets, devices, codes, categories = [np.empty(0, dtype=np.int64)], [[]], [np.empty(0, np.int32)], [[]]
+        offsets = np.concatenate(offsets)
+        order = np.argsort(offsets, kind="stable")
+        return pd.DataFrame({timestamp_colname: start + pd.to_timedelta(offsets[order], unit="s"),
+                             "device": pd.Categorical(np.concatenate(devices)[order]),
+                             "code": np.concatenate(codes)[order],
+                             "category": pd.Categorical(np.concatenate(categories)[order],
+                                                        categories=list(self.categories.values()))})
+
+
+class FroniusEventLog:
+    """
+        local log of the events of many inverters, fetched incrementally, queried without the network.
 
-                df = pd.DataFrame({timestamp_colname: timestamps, channel: measurements})
+        update() fetches the events of a host from where the previous update stopped, in windows of
+        max_query_time, keeping every window's events from its start up to the next window so none are
+        stored twice.  per host and device the events are kept as columns (seconds since 1970 UTC, code,
+        category) and indexed by code and time, so query() by code and time range is two binary searches
+        per device.  with a directory, every host is stored in <host>.npz and loaded again on creation.
+    """
 
-                if deviceDf is None:
-                    deviceDf = df
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.fetched_to = {}
+        self.devices = {}
+        self._indexes = {}
+        if directory is not None:
+            for path in _host_paths(directory):
+                self._load(path)
+
+    def _load(self, path):
+        with np.load(path, allow_pickle=False) as npz:
+            host = str(npz["host"])
+            self.fetched_to[host] = datetime.datetime.fromtimestamp(int(npz["fetched_to"]), pytz.utc)
+            for i, device in enumerate(npz["devices"]):
+                self.devices[(host, str(device))] = [npz["t" + str(i)], npz["c" + str(i)], npz["k" + str(i)]]
+
+    def _save(self, host):
+        devices = [device for h, device in self.devices if h == host]
+        arrays = {"host": np.array(host), "devices": np.array(devices, dtype=str),
+                  "fetched_to": np.array(int(self.fetched_to[host].timestamp()))}
+        for i, device in enumerate(devices):
+            arrays["t" + str(i)], arrays["c" + str(i)], arrays["k" + str(i)] = self.devices[(host, device)]
+        _save_host(self.directory, host, arrays)
+
+    def update(self, fi, to_date=None, from_date=None):
+        """
+            fetch the events of FroniusInverter fi up to to_date (now), from where the last update
+            stopped, or from from_date (the epoch). stops at a window with an error. returns the new events
+        """
+        if not isinstance(fi, FroniusInverter):
+            raise TypeError("FroniusEventLog needs a blocking FroniusInverter")
+        if to_date is None:
+            to_date = datetime.datetime.now(pytz.utc)
+        start = self.fetched_to.get(fi.host, from_date if from_date is not None else fi.epoch)
+        start, to_date = fi._utc_range(start, to_date)
+
+        added = 0
+        for fdate, tdate in fi._query_windows(start, to_date):
+            fej = FroniusEventsJson(fi.get_historical_events_json(fdate, tdate), fi.metrics, fi.host)
+            if fej.error_code() != 0:
+                warnings.warn(str(fej.error_status()))
+                break
+            added += self._append(fi.host, fej.events(), fdate, tdate)
+            self.fetched_to[fi.host] = tdate
+        if self.directory is not None and fi.host in self.fetched_to:
+            self._save(fi.host)
+        return added
+
+    def update_fleet(self, hosts, to_date=None, from_date=None, **inverter_args):
+        """update every host, one after the other. returns {host: new events}"""
+        return _update_hosts(self.update, hosts, to_date, from_date, inverter_args)
+
+    def _append(self, host, events, fdate, tdate):
+        seconds = (events["ts"] - FroniusArchiveCache.epoch) // pd.Timedelta(seconds=1)
+        seconds = seconds.to_numpy(dtype=np.int64)
+        mask = (int(fdate.timestamp()) <= seconds) & (seconds < int(tdate.timestamp()))
+        categories = events["category"].cat.codes.to_numpy(dtype=np.int8)
+        for device in events["device"].cat.categories:
+            selected = mask & (events["device"] == device).to_numpy()
+            key = (host, device)
+            columns = self.devices.setdefault(key, [np.empty(0, np.int64), np.empty(0, np.int32), np.empty(0, np.int8)])
+            for i, values in enumerate((seconds, events["code"].to_numpy(), categories)):
+                columns[i] = np.concatenate([columns[i], values[selected]])
+            self._indexes.pop(key, None)
+        return int(mask.sum())
+
+    def _index(self, key):
+        """the events of a device sorted by code, then time: (codes, seconds, categories)"""
+        index = self._indexes.get(key)
+        if index is None:
+            seconds, codes, categories = self.devices[key]
+            order = np.lexsort((seconds, codes))
+            index = self._indexes[key] = (codes[order], seconds[order], categories[order])
+        return index
+
+    def query(self, code=None, from_date=None, to_date=None, hosts=None, category=None):
+        """events of all hosts and devices, optionally of one code, category and time range [from_date, to_date)"""
+        low = -2 ** 62 if from_date is None else int(from_date.timestamp())
+        high = 2 ** 62 if to_date is None else int(to_date.timestamp())
+        category_names = list(FroniusEventsJson.categories.values())
+        parts = []
+        for key in self.devices:
+            if hosts is not None and key[0] not in hosts:
+                continue
+            codes, seconds, categories = self._index(key)
+            if code is None:
+                order = np.argsort(seconds, kind="stable")
+                selected = order[(low <= seconds[order]) & (seconds[order] < high)]
+            else:
+                first, last = np.searchsorted(codes, [code, code + 1])
+                first, last = first + np.searchsorted(seconds[first:last], [low, high])
+                selected = np.arange(first, last)
+            if category is not None:
+                selected = selected[categories[selected] == category_names.index(category)]
+            parts.append((key, seconds[selected], codes[selected], categories[selected]))
+
+        hosts, devices = _host_device_columns([key for key, s, c, k in parts], [len(s) for key, s, c, k in parts])
+        seconds = np.concatenate([s for key, s, c, k in parts] + [np.empty(0, np.int64)])
+        order = np.lexsort((devices.codes, hosts.codes, seconds))
+        return pd.DataFrame({"host": hosts[order], "device": devices[order],
+                             "ts": pd.to_datetime(seconds[order], unit="s", utc=True),
+                             "code": np.concatenate([c for key, s, c, k in parts] + [np.empty(0, np.int32)])[order],
+                             "category": pd.Categorical.from_codes(
+                                 np.concatenate([k for key, s, c, k in parts] + [np.empty(0, np.int8)])[order],
+                                 category_names)})
+
+
+class FroniusEnergyRollup:
+    """
+        hourly, daily and monthly energy totals in local time, updated incrementally.
+
+        add() merges the EnergyReal_WAC_Sum_Produced and TimeSpanInSec samples of get_historical_data
+        frames into the raw samples of every (host, device), a new sample replacing a stored one with the
+        same timestamp, and recomputes only the local days the new samples fall into, and their months.
+        hours, days and months start at local wall time in tz (the local timezone); the hour repeated when
+        daylight saving time ends is one bucket.  with a directory, the raw samples and totals of every
+        host are stored in <host>.npz by update() and save(), and loaded again on creation.
+    """
+
+    channels = ["EnergyReal_WAC_Sum_Produced", "TimeSpanInSec"]
+    periods = ["hour", "day", "month"]
+    overlap = datetime.timedelta(hours=1)
+    """ update() fetches again this long before where the previous update stopped, for samples logged late """
+
+    def __init__(self, tz=None, directory=None):
+        if tz is None:
+            tz = datetime.datetime.now(datetime.timezone.utc).astimezone().tzinfo
+        self.tz = pytz.timezone(tz) if isinstance(tz, str) else tz
+        self.directory = directory
+        self.fetched_to = {}
+        self.samples = {}
+        self.totals = {}
+        if directory is not None:
+            for path in _host_paths(directory):
+                self._load(path)
+
+    def _load(self, path):
+        with np.load(path, allow_pickle=False) as npz:
+            host = str(npz["host"])
+            if 0 <= int(npz["fetched_to"]):
+                self.fetched_to[host] = datetime.datetime.fromtimestamp(int(npz["fetched_to"]), pytz.utc)
+            same_tz = str(npz["tz"]) == str(self.tz)
+            for i, device in enumerate(npz["devices"]):
+                key = (host, str(device))
+                self.samples[key] = [npz["raw%d_%d" % (i, j)] for j in range(3)]
+                if same_tz:
+                    self.totals[key] = {period: [npz["%s%d_%d" % (period, i, j)] for j in range(4)]
+                                        for period in self.periods}
                 else:
-                    deviceDf = pd.merge(deviceDf, df, how='outer')
+                    seconds = self.samples[key][0]
+                    self._roll(key, seconds[0], seconds[-1])
+
+    def save(self):
+        """store every host in the directory"""
+        for host in sorted(set(host for host, device in self.samples) | set(self.fetched_to)):
+            self._save(host)
+
+    def _save(self, host):
+        devices = [device for h, device in self.samples if h == host]
+        fetched_to = self.fetched_to.get(host)
+        arrays = {"host": np.array(host), "tz": np.array(str(self.tz)), "devices": np.array(devices, dtype=str),
+                  "fetched_to": np.array(-1 if fetched_to is None else int(fetched_to.timestamp()))}
+        for i, device in enumerate(devices):
+            key = (host, device)
+            for j, values in enumerate(self.samples[key]):
+                arrays["raw%d_%d" % (i, j)] = values
+            for period in self.periods:
+                for j, values in enumerate(self.totals[key][period]):
+                    arrays["%s%d_%d" % (period, i, j)] = values
+        _save_host(self.directory, host, arrays)
+
+    def update(self, fi, to_date=None, from_date=None):
+        """
+            fetch the energy of FroniusInverter fi up to to_date (now), from overlap before where the last
+            update stopped, or from from_date (the epoch). stops at a window with an error. returns the new samples
+        """
+        if not isinstance(fi, FroniusInverter):
+            raise TypeError("FroniusEnergyRollup needs a blocking FroniusInverter")
+        if to_date is None:
+            to_date = datetime.datetime.now(pytz.utc)
+        start = self.fetched_to.get(fi.host)
+        if start is not None:
+            start = start - self.overlap
+        else:
+            start = from_date if from_date is not None else fi.epoch
+        start, to_date = fi._utc_range(start, to_date)
+
+        windows = fi._query_windows(start, to_date)
+        responses = fi._fetch_windows(windows, self.channels)
+        added = 0
+        try:
+            for (fdate, tdate), jsondata in zip(windows, responses):
+                faj = FroniusArchiveJson(jsondata, fi.metrics, fi.host)
+                if faj.error_code() != 0:
+                    warnings.warn(str(faj.error_status()))
+                    break
+                data = {key: fi._strict_range(df, fdate, tdate) for key, df in faj.data().items()}
+                added += self.add(fi.host, data, fi.timestamp_colname)
+                self.fetched_to[fi.host] = tdate
+        finally:
+            responses.close()
+        if self.directory is not None and fi.host in self.fetched_to:
+            self._save(fi.host)
+        return added
+
+    def update_fleet(self, hosts, to_date=None, from_date=None, **inverter_args):
+        """update every host, one after the other. returns {host: new samples}"""
+        return _update_hosts(self.update, hosts, to_date, from_date, inverter_args)
+
+    def add(self, host, data, timestamp_colname="ts"):
+        """merge the frames {device_id: DataFrame} of get_historical_data of host. returns the new samples"""
+        added = 0
+        for device, df in (data or {}).items():
+            if self.channels[0] not in df:
+                continue
+            df = df.loc[df[self.channels[0]].notna()]
+            if len(df) == 0:
+                continue
+            seconds = (df[timestamp_colname] - FroniusArchiveCache.epoch) // pd.Timedelta(seconds=1)
+            new = [seconds.to_numpy(dtype=np.int64), df[self.channels[0]].to_numpy(dtype=np.float64),
+                   df[self.channels[1]].fillna(0).to_numpy(dtype=np.int64) if self.channels[1] in df
+                   else np.zeros(len(df), np.int64)]
+
+            # only the stored samples within the time range of the new ones are merged
+            key = (host, device)
+            old = self.samples.get(key, [np.empty(0, np.int64), np.empty(0, np.float64), np.empty(0, np.int64)])
+            first, last = new[0].min(), new[0].max()
+            a, b = np.searchsorted(old[0], first, "left"), np.searchsorted(old[0], last, "right")
+            merged = [np.concatenate([n, o[a:b]]) for n, o in zip(new, old)]
+            unique, indexes = np.unique(merged[0], return_index=True)
+            added += len(unique) - (b - a)
+            self.samples[key] = [np.concatenate([o[:a], m[indexes], o[b:]]) for m, o in zip(merged, old)]
+            self._roll(key, first, last)
+        return added
+
+    def _wall(self, seconds):
+        """local wall time of UTC seconds since 1970, as seconds since 1970"""
+        local = pd.to_datetime(seconds, unit="s", utc=True).tz_convert(self.tz).tz_localize(None)
+        return local.as_unit("s").asi8
 
-            # Arrange the rows to start with the timestamp.  match the order of the json file.
-            columnOrder = [timestamp_colname] + channels
-            deviceDf = deviceDf[columnOrder]
-            result[deviceID] = deviceDf
+    @staticmethod
+    def _month(wall, months=0):
+        return (wall.astype("datetime64[s]").astype("datetime64[M]") + months).astype("datetime64[s]").astype(np.int64)
+
+    def _roll(self, key, first, last):
+        """recompute the hours and days of the local days of UTC seconds [first, last], and their months"""
+        seconds, energy, spans = self.samples[key]
+        first_day, last_day = self._wall(np.array([first, last])) // 86400 * 86400
+        # local days are within a day of UTC days
+        a, b = np.searchsorted(seconds, [first - 2 * 86400, last + 2 * 86400])
+        wall = self._wall(seconds[a:b])
+        inside = (first_day <= wall) & (wall < last_day + 86400)
+        wall, energy, spans = wall[inside], energy[a:b][inside], spans[a:b][inside]
+        counts = np.ones(len(wall), np.int64)
+
+        totals = self.totals.setdefault(key, {period: [np.empty(0, np.int64), np.empty(0, np.float64),
+                                                       np.empty(0, np.int64), np.empty(0, np.int64)]
+                                              for period in self.periods})
+        self._replace(totals, "hour", first_day, last_day + 86400, wall // 3600 * 3600, energy, spans, counts)
+        self._replace(totals, "day", first_day, last_day + 86400, wall // 86400 * 86400, energy, spans, counts)
+
+        first_month, last_month = self._month(np.array([first_day])), self._month(np.array([last_day]), 1)
+        days = totals["day"]
+        a, b = np.searchsorted(days[0], [first_month[0], last_month[0]])
+        self._replace(totals, "month", first_month[0], last_month[0], self._month(days[0][a:b]),
+                      *(values[a:b] for values in days[1:]))
 
-        return result
+    @staticmethod
+    def _replace(totals, period, low, high, starts, energy, spans, counts):
+        """replace the totals of period starting in [low, high) with the sums per start"""
+        keys, inverse = np.unique(starts, return_inverse=True)
+        new = [keys, np.bincount(inverse, energy, len(keys)),
+               np.bincount(inverse, spans, len(keys)).astype(np.int64),
+               np.bincount(inverse, counts, len(keys)).astype(np.int64)]
+        old = totals[period]
+        a, b = np.searchsorted(old[0], [low, high])
+        totals[period] = [np.concatenate([o[:a], n, o[b:]]) for o, n in zip(old, new)]
+
+    def rollup(self, period="day", from_date=None, to_date=None, hosts=None):
+        """
+            energy of every host and device per period, 'hour', 'day' or 'month', starting in [from_date, to_date).
+            columns host, device, start (local wall time), kWh, seconds (sum of TimeSpanInSec), samples
+        """
+        if period not in self.periods:
+            raise ValueError("period must be one of " + ", ".join(self.periods))
+        low = -2 ** 62 if from_date is None else self._wall_date(from_date)
+        high = 2 ** 62 if to_date is None else self._wall_date(to_date)
+        keys = [key for key in sorted(self.totals) if hosts is None or key[0] in hosts]
+        parts = []
+        for key in keys:
+            totals = self.totals[key][period]
+            a, b = np.searchsorted(totals[0], [low, high])
+            parts.append([values[a:b] for values in totals])
+
+        hosts, devices = _host_device_columns(keys, [len(part[0]) for part in parts])
+        columns = [np.concatenate([part[j] for part in parts] + [empty])
+                   for j, empty in enumerate([np.empty(0, np.int64), np.empty(0, np.float64),
+                                              np.empty(0, np.int64), np.empty(0, np.int64)])]
+        return pd.DataFrame({"host": hosts, "device": devices,
+                             "start": columns[0].astype("datetime64[s]").astype("datetime64[ns]"),
+                             "kWh": columns[1] / 1000, "seconds": columns[2], "samples": columns[3]})
+
+    def _wall_date(self, date):
+        """local wall time of a datetime as seconds since 1970. naive datetimes are local already"""
+        date = pd.Timestamp(date)
+        if date.tzinfo is not None:
+            date = date.tz_convert(self.tz).tz_localize(None)
+        # pandas treats naive timestamps as UTC
+        return int(date.timestamp())
+
+
+class FroniusArchiveBatch:
+    """
+        decode many archive responses into one frame per device, without a frame per response.
+        offsets and values accumulate in growing NumPy arrays. responses may be dicts or paths
+        to stored JSON files. like get_historical_data, the rows of overlapping responses are
+        all kept, and sorted by time. responses with different UTC offsets yield UTC timestamps.
+    """
+
+    def __init__(self, responses=None, decoder=None):
+        self.decoder = decoder if decoder is not None else FroniusJsonDecoder()
+        self.devices = {}
+        self.responses = 0
+        self.errors = 0
+        if responses is not None:
+            self.extend(responses)
+
+    def extend(self, responses):
+        for response in responses:
+            self.add(response)
+        return self
+
+    def add(self, response):
+        """add one response. responses with an error are skipped with a warning"""
+        if isinstance(response, (str, os.PathLike)):
+            with open(response, "rb") as f:
+                response = self.decoder(f.read())
+
+        faj = FroniusArchiveJson(response)
+        if faj.error_code() != 0:
+            warnings.warn(str(faj.error_status()))
+            self.errors += 1
+            return
+        self.responses += 1
+
+        start = pd.Timestamp(faj.start_date())
+        for deviceID in faj.device_ids():
+            device = self.devices.get(deviceID)
+            if device is None:
+                device = self.devices[deviceID] = _BatchDevice(start)
+            device.add(start, {channel: faj.values(deviceID, channel)
+                               for channel in faj.channels(deviceID)})
+
+    def data(self, timestamp_colname="ts", dtypes=None, index=False):
+        """one DataFrame per device, see FroniusArchiveJson.data"""
+        frames = {deviceID: _apply_dtypes(device.frame(timestamp_colname), dtypes)
+                  for deviceID, device in self.devices.items()}
+        if index:
+            frames = {deviceID: _time_indexed(df, timestamp_colname) for deviceID, df in frames.items()}
+        return frames
+
+
+class _GrowingArray:
+    """an append-only NumPy array that doubles its capacity when full"""
+
+    def __init__(self, dtype, length=0, fill=0):
+        self.array = np.full(max(16, length), fill, dtype=dtype)
+        self.length = length
+
+    def append(self, values):
+        end = self.length + len(values)
+        if len(self.array) < end:
+            grown = np.empty(max(end, 2 * len(self.array)), dtype=self.array.dtype)
+            grown[:self.length] = self.array[:self.length]
+            self.array = grown
+        self.array[self.length:end] = values
+        self.length = end
+
+    def view(self):
+        return self.array[:self.length]
+
+
+class _BatchDevice:
+    """rows of one device in a FroniusArchiveBatch. offsets are seconds since the first start"""
+
+    def __init__(self, start):
+        self.start = start
+        self.timezones = {str(start.tz)}
+        self.offsets = _GrowingArray(np.int64)
+        self.values = {}
+        self.integer = {}
+        self.unsorted = False
+
+    def add(self, start, columns):
+        self.timezones.add(str(start.tz))
+        shift = int((start - self.start).total_seconds())
+        if len(columns) == 1:
+            (keys, values), = columns.values()
+            index = keys
+        else:
+            # the rows of a response are the sorted union of its channel offsets, as in FroniusArchiveJson.data
+            index = np.unique(np.concatenate([keys for keys, values in columns.values()]))
+        rows = len(index)
+        if rows == 0:
+            return
+
+        offsets = index + shift
+        if self.offsets.length and offsets[0] < self.offsets.array[self.offsets.length - 1]:
+            self.unsorted = True
+        if len(columns) == 1 and 1 < rows and np.any(offsets[1:] < offsets[:-1]):
+            self.unsorted = True
+
+        length = self.offsets.length
+        for channel, (keys, values) in columns.items():
+            column = self.values.get(channel)
+            if column is None:
+                column = self.values[channel] = _GrowingArray(np.float64, length, np.nan)
+                self.integer[channel] = length == 0
+            if len(columns) == 1:
+                filled = values
+            else:
+                filled = np.full(rows, np.nan)
+                filled[np.searchsorted(index, keys)] = values
+            self.integer[channel] &= values.dtype.kind in "iu" and len(keys) == rows
+            column.append(filled)
+
+        for channel, column in self.values.items():
+            if channel not in columns:
+                column.append(np.full(rows, np.nan))
+                self.integer[channel] = False
+        self.offsets.append(offsets)
+
+    def frame(self, timestamp_colname="ts"):
+        offsets = self.offsets.view()
+        order = np.argsort(offsets, kind="stable") if self.unsorted else slice(None)
+        ts = self.start + pd.to_timedelta(offsets[order], unit="s")
+        if 1 < len(self.timezones):
+            ts = ts.tz_convert("UTC")
+
+        df = pd.DataFrame({timestamp_colname: ts})
+        for channel, column in self.values.items():
+            values = column.view()[order]
+            df[channel] = values.astype(np.int64) if self.integer[channel] else values
+        return df
+
+
+def _host_paths(directory):
+    """the <host>.npz files of the hosts stored in directory, see _save_host. creates the directory"""
+    os.makedirs(directory, exist_ok=True)
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(".npz")]
+
+
+def _save_host(directory, host, arrays):
+    """store the arrays of host in directory/<host>.npz, replacing the previous file at once"""
+    path = os.path.join(directory, urllib.parse.quote(host, safe="") + ".npz")
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(path + ".tmp", path)
+
+
+def _update_hosts(update, hosts, to_date, from_date, inverter_args):
+    """update(fi, to_date, from_date) with a FroniusInverter of every host, one after the other: {host: result}"""
+    added = {}
+    for host in hosts:
+        with FroniusInverter(host, **inverter_args) as fi:
+            added[host] = update(fi, to_date, from_date)
+    return added
+
+
+def _host_device_columns(keys, lengths):
+    """
+        categorical host and device columns of parts of rows, lengths[i] rows of the (host, device) keys[i].
+        categories are sorted
+    """
+    part_numbers = np.repeat(np.arange(len(keys)), lengths)
+    host_names = sorted(set(key[0] for key in keys))
+    device_names = sorted(set(key[1] for key in keys))
+    # the extra code keeps the arrays integer without any keys
+    host_codes = np.array([host_names.index(key[0]) for key in keys] + [0], dtype=np.int32)[part_numbers]
+    device_codes = np.array([device_names.index(key[1]) for key in keys] + [0], dtype=np.int32)[part_numbers]
+    return pd.Categorical.from_codes(host_codes, host_names), pd.Categorical.from_codes(device_codes, device_names)
+
+
+def _apply_dtypes(df, dtypes):
+    """convert the columns of df named in dtypes. dtypes=True uses FroniusInverter.get_channel_dtypes()"""
+    if dtypes is None or dtypes is False:
+        return df
+    if dtypes is True:
+        dtypes = FroniusInverter.get_channel_dtypes()
+    return df.astype({column: dtype for column, dtype in dtypes.items() if column in df.columns})
+
+
+def _decode_archive_window(content, from_date, to_date, dtypes=None, timestamp_colname="ts"):
+    """
+        decode an archive response body, in a worker process of FroniusBackfill: (error status or None, devices).
+        devices maps device ids to (timestamps, {channel: (values, mask)}) of [from_date, to_date),
+        timestamps as int64 nanoseconds since 1970 UTC. mask is None for columns without NA
+    """
+    faj = FroniusArchiveJson(FroniusJsonDecoder()(content))
+    if faj.error_code() != 0:
+        return faj.error_status(), {}
+    devices = {}
+    for device, df in faj.data(timestamp_colname, dtypes, index=True).items():
+        first, last = df.index.searchsorted([pd.Timestamp(from_date), pd.Timestamp(to_date)])
+        df = df.iloc[first:last]
+        columns = {}
+        for channel, column in df.items():
+            if isinstance(column.array, pd.arrays.IntegerArray):
+                columns[channel] = (column.to_numpy(column.dtype.numpy_dtype, na_value=0), column.isna().to_numpy())
+            else:
+                columns[channel] = (column.to_numpy(), None)
+        devices[device] = (df.index.asi8, columns)
+    return None, devices
+
+
+def _frame_from_buffers(timestamps, columns, timestamp_colname="ts", index=False):
+    """the frame of the buffers of _decode_archive_window"""
+    ts = pd.to_datetime(timestamps, unit="ns", utc=True)
+    data = {channel: values if mask is None else pd.arrays.IntegerArray(values, mask)
+            for channel, (values, mask) in columns.items()}
+    if index:
+        return pd.DataFrame(data, index=ts.rename(timestamp_colname))
+    return pd.DataFrame({timestamp_colname: ts, **data})
+
+
+def _time_indexed(df, timestamp_colname="ts"):
+    """df indexed by its timestamp column, as a sorted DatetimeIndex in UTC (datetime64[ns, UTC])"""
+    index = pd.DatetimeIndex(df[timestamp_colname]).tz_convert("UTC").as_unit("ns").rename(timestamp_colname)
+    df = df.drop(columns=timestamp_colname).set_axis(index)
+    if not index.is_monotonic_increasing:
+        df = df.sort_index(kind="stable")
+    return df
+
+
+def _is_time_indexed(df):
+    return isinstance(df.index, pd.DatetimeIndex)
+
+
+def _frame_from_columns(start, columns, timestamp_colname="ts", sort=True):
+    """
+        build one frame from {channel: (offsets, values)}, aligning the channels on their offsets.
+        offsets are seconds since start.  rows follow the order of appearance of the offsets, or are sorted.
+        the timestamp column comes first, followed by the channels in the order given.
+    """
+    series = {}
+    offsets = {}
+    for channel, (keys, values) in columns.items():
+        series[channel] = pd.Series(values, index=keys)
+        offsets.update(dict.fromkeys(keys.tolist()))
+
+    index = np.fromiter(offsets.keys(), dtype=np.int64, count=len(offsets))
+    if sort:
+        index.sort()
+
+    df = pd.DataFrame({timestamp_colname: start + pd.to_timedelta(index, unit="s")})
+    for channel, s in series.items():
+        df[channel] = s.reindex(index).to_numpy()
+    return df
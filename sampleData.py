@@ -0,0 +1,107 @@
+import datetime
+
+import pandas as pd
+
+from fronius import FroniusInverter
+from fronius import FroniusArchiveJson
+from fronius import FroniusRealTimeJson
+
+#
+# synthetic responses and reference implementations shared by the tests and the benchmarks
+#
+
+
+def make_archive_json(days=15, step=300, channels=None, device_id="inverter/1", start=None):
+    """build a synthetic GetArchiveData.cgi response with one sample every step seconds"""
+    if channels is None:
+        channels = FroniusInverter.get_all_channels()
+
+    if start is None:
+        start = datetime.datetime(2017, 10, 1, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+
+    # values only depend on the sample time, so overlapping responses agree
+    offsets = [str(s) for s in range(0, days * 24 * 3600, step)]
+    first = int(start.timestamp()) // step
+    data = {}
+    for i, channel in enumerate(channels):
+        # digital channels are 0 or 1
+        modulus = 2 if channel.startswith("Digital_") else 1000
+        data[channel] = {"Unit": FroniusInverter.channel_dict.get(channel, "1"),
+                         "Values": {o: (first + int(o) // step + i) % modulus for o in offsets},
+                         "_comment": "channelId=" + str(i)}
+    end = start + datetime.timedelta(days=days) - datetime.timedelta(seconds=1)
+    return {"Body": {"Data": {device_id: {"Data": data, "DeviceType": 77, "NodeType": 97,
+                                          "Start": start.isoformat(), "End": end.isoformat()}}},
+            "Head": {"RequestArguments": {"Channel": channels, "EndDate": end.isoformat(),
+                                          "HumanReadable": "True", "Scope": "System", "SeriesType": "Detail",
+                                          "StartDate": start.isoformat()},
+                     "Status": {"Code": 0, "ErrorDetail": {"Nodes": []}, "Reason": "", "UserMessage": ""},
+                     "Timestamp": end.isoformat()}}
+
+
+def legacy_archive_data(faj, timestamp_colname="ts"):
+    """the original per-channel merge implementation of FroniusArchiveJson.data(), kept as reference"""
+    result = {}
+    for deviceID in faj.device_ids():
+        deviceDf = None
+        channels = faj.channels(deviceID)
+        for channel in channels:
+            my_dict = faj.json["Body"]["Data"][deviceID]["Data"][channel]["Values"]
+
+            start = faj.start_date()
+            offsets = pd.Series(list(my_dict.keys()))
+            timestamps = offsets.map(lambda x: datetime.timedelta(seconds=int(x)) + start)
+
+            measurements = pd.Series(list(my_dict.values()))
+
+            df = pd.DataFrame({timestamp_colname: timestamps, channel: measurements})
+
+            if deviceDf is None:
+                deviceDf = df
+            else:
+                deviceDf = pd.merge(deviceDf, df, how='outer')
+
+        columnOrder = [timestamp_colname] + channels
+        deviceDf = deviceDf[columnOrder]
+        result[deviceID] = deviceDf
+
+    return result
+
+
+def legacy_merge_windows(fi, responses, from_date, to_date, strict=True):
+    """the original get_historical_data merge, re-sorting and re-filtering everything after every window"""
+    returndf = None
+    for jsondata in responses:
+        faj = FroniusArchiveJson(jsondata)
+        if faj.error_code() != 0:
+            break
+        if not faj.is_empty():
+            df = faj.data()
+            if returndf is None:
+                returndf = df
+            else:
+                for key, value in df.items():
+                    if key in returndf:
+                        returndf[key] = pd.concat([returndf[key], value])
+                        returndf[key] = returndf[key].sort_values(fi.timestamp_colname)
+                    else:
+                        returndf[key] = value
+
+            if strict:
+                for key, value in returndf.items():
+                    returndf[key] = returndf[key].loc[from_date <= returndf[key][fi.timestamp_colname]]
+                    returndf[key] = returndf[key].loc[returndf[key][fi.timestamp_colname] < to_date]
+    return returndf
+
+
+def realtime_samples(count):
+    """yield count realtime responses, one second apart"""
+    start = datetime.datetime(2017, 10, 28, 12, tzinfo=datetime.timezone.utc)
+    for i in range(count):
+        yield FroniusRealTimeJson({"Body": {"Data": {"DAY_ENERGY": {"Unit": "Wh", "Values": {"1": 4510 + i}},
+                                                     "PAC": {"Unit": "W", "Values": {"1": i % 1000}},
+                                                     "TOTAL_ENERGY": {"Unit": "Wh", "Values": {"1": 192963 + i}},
+                                                     "YEAR_ENERGY": {"Unit": "Wh", "Values": {"1": 92963 + i}}}},
+                                   "Head": {"RequestArguments": {"DeviceClass": "Inverter", "Scope": "System"},
+                                            "Status": {"Code": 0, "Reason": "", "UserMessage": ""},
+                                            "Timestamp": (start + datetime.timedelta(seconds=i)).isoformat()}})
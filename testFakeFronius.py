@@ -0,0 +1,984 @@
+import unittest
+import json
+import warnings
+import datetime
+import time
+import tempfile
+import pytz
+import asyncio
+import pandas
+import requests
+import os
+import urllib.parse
+import socket
+import unittest.mock
+
+from fronius import FroniusInverter
+from fronius import FroniusArchiveJson
+from fronius import AsyncFroniusInverter
+from fronius import FroniusRealTimeJson
+from fronius import FroniusFleetPoller
+from fronius import FroniusArchiveCache
+from fronius import FroniusJsonDecoder
+from fronius import FroniusWindowSizer
+from fronius import FroniusRealTimeDeduplicator
+from fronius import FroniusMetrics
+from fronius import FroniusParquetExport
+from fronius import FroniusEventLog
+from fronius import FroniusEnergyRollup
+from fronius import FroniusBackfill
+from fronius import pa
+from fronius import aiohttp
+from fakeFronius import FakeFroniusServer
+
+#
+# tests against a local fake inverter.  no physical inverter needed
+#
+
+from_date = pytz.utc.localize(datetime.datetime(2017, 11, 1), is_dst=None)
+channels = ["Digital_PowerManagementRelay_Out_1", "Current_AC_Phase_1"]
+
+
+class FakeFroniusServer_quirks(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeFroniusServer(utc_offset=datetime.timedelta(hours=1), inverters=2).start()
+        self.fi = FroniusInverter(self.server.host)
+
+    def tearDown(self):
+        self.fi.close()
+        self.server.stop()
+
+    def test_request_is_widened_to_local_days(self):
+        day = pytz.utc.localize(datetime.datetime(2017, 11, 4, 8), is_dst=None)
+        json = self.fi.get_historical_data_json(day, day + datetime.timedelta(seconds=1), ["Current_AC_Phase_1"])
+        self.assertEqual(json['Head']['RequestArguments']['StartDate'], '2017-11-04T00:00:00+01:00')
+        self.assertEqual(json['Head']['RequestArguments']['EndDate'], '2017-11-04T23:59:59+01:00')
+
+    def test_16_day_limit(self):
+        with self.assertWarns(UserWarning):
+            json = self.fi.get_historical_data_json(from_date, from_date + datetime.timedelta(days=17), channels)
+        faj = FroniusArchiveJson(json)
+        self.assertEqual(faj.error_code(), 255)
+        self.assertEqual(faj.error_status()['Reason'], 'Query interval is restricted to 16 days')
+
+    def test_dates_behind_utc_are_refused(self):
+        t1_utc_8 = pytz.timezone('Etc/GMT+8').localize(datetime.datetime(2017, 10, 31, 20), is_dst=None)
+        json = self.fi.get_historical_data_json(t1_utc_8, t1_utc_8 + datetime.timedelta(hours=24), channels)
+        self.assertEqual(FroniusArchiveJson(json).error_code(), 255)
+
+    def test_multi_device_body(self):
+        data = self.fi.get_historical_data(from_date, from_date + datetime.timedelta(days=1), channels)
+        self.assertEqual(sorted(data.keys()), ['datamanager:/dc/f0056cc6/', 'inverter/1', 'inverter/2'])
+        self.assertEqual(len(data['inverter/2']), 288)
+        self.assertEqual(min(data['inverter/2']['ts']), from_date)
+
+
+class FroniusInverter_concurrent_fetch(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeFroniusServer(latency=0.2).start()
+        self.fi = FroniusInverter(self.server.host)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def assert_same_data(self, expected, actual):
+        self.assertEqual(list(expected.keys()), list(actual.keys()))
+        for key in expected:
+            pandas.testing.assert_frame_equal(expected[key], actual[key])
+
+    def test_concurrent_matches_sequential(self):
+        to_date = from_date + datetime.timedelta(days=60)
+        sequential = self.fi.get_historical_data(from_date, to_date, channels)
+        concurrent = self.fi.get_historical_data(from_date, to_date, channels, max_workers=4)
+        self.assertEqual(len(sequential.keys()), 2)
+        self.assert_same_data(sequential, concurrent)
+        self.assertTrue(concurrent['inverter/1']['ts'].is_monotonic_increasing)
+
+    def test_concurrent_is_faster(self):
+        to_date = from_date + datetime.timedelta(days=120)
+        start = time.perf_counter()
+        self.fi.get_historical_data(from_date, to_date, channels)
+        sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self.fi.get_historical_data(from_date, to_date, channels, max_workers=8)
+        concurrent = time.perf_counter() - start
+        self.assertLess(concurrent, sequential / 2)
+
+    def test_error_stops_query(self):
+        self.server.fail_from = from_date + datetime.timedelta(days=30)
+        to_date = from_date + datetime.timedelta(days=90)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            sequential = self.fi.get_historical_data(from_date, to_date, channels)
+            concurrent = self.fi.get_historical_data(from_date, to_date, channels, max_workers=4)
+        self.assertEqual(len(caught), 2)
+        self.assert_same_data(sequential, concurrent)
+        self.assertLess(max(concurrent['inverter/1']['ts']), to_date - datetime.timedelta(days=30))
+
+
+class FroniusInverter_iter_historical_data(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeFroniusServer(latency=0.1).start()
+        self.fi = FroniusInverter(self.server.host)
+
+    def tearDown(self):
+        self.fi.close()
+        self.server.stop()
+
+    def test_yields_every_window(self):
+        to_date = from_date + datetime.timedelta(days=40)
+        frames = list(self.fi.iter_historical_data(from_date, to_date, channels))
+        self.assertEqual(len(frames), 2 * 3)
+        self.assertEqual([key for key, df in frames[:2]], ['datamanager:/dc/f0056cc6/', 'inverter/1'])
+
+        expected = self.fi.get_historical_data(from_date, to_date, channels)
+        inverter = pandas.concat([df for key, df in frames if key == 'inverter/1']).sort_values('ts')
+        pandas.testing.assert_frame_equal(expected['inverter/1'], inverter)
+
+    def test_first_window_is_yielded_before_the_others_are_fetched(self):
+        to_date = from_date + datetime.timedelta(days=150)
+        frames = self.fi.iter_historical_data(from_date, to_date, channels)
+        next(frames)
+        frames.close()
+        self.assertEqual(self.server.request_count, 1)
+
+    def test_at_most_max_workers_windows_are_fetched_ahead(self):
+        to_date = from_date + datetime.timedelta(days=300)
+        frames = self.fi.iter_historical_data(from_date, to_date, channels, max_workers=2)
+        next(frames)
+        time.sleep(5 * self.server.latency)
+        self.assertEqual(self.server.request_count, 1 + 2)
+        next(frames)
+        next(frames)
+        time.sleep(5 * self.server.latency)
+        self.assertEqual(self.server.request_count, 2 + 2)
+        frames.close()
+
+    def test_error_stops_iteration(self):
+        self.server.fail_from = from_date + datetime.timedelta(days=20)
+        to_date = from_date + datetime.timedelta(days=60)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            frames = list(self.fi.iter_historical_data(from_date, to_date, channels, max_workers=4))
+        self.assertEqual(len(caught), 1)
+        self.assertEqual(len(frames), 2 * 2)
+
+    def test_compact_dtypes(self):
+        to_date = from_date + datetime.timedelta(days=20)
+        expected = self.fi.get_historical_data(from_date, to_date, channels)
+        compact = self.fi.get_historical_data(from_date, to_date, channels, dtypes=True)
+        dtypes = FroniusInverter.get_channel_dtypes()
+        for key, df in compact.items():
+            for channel in df.columns[1:]:
+                self.assertEqual(str(df[channel].dtype), dtypes[channel])
+            pandas.testing.assert_frame_equal(expected[key], df, check_dtype=False)
+
+    def test_time_index(self):
+        f = from_date + datetime.timedelta(hours=5)
+        to_date = from_date + datetime.timedelta(days=20)
+        expected = self.fi.get_historical_data(f, to_date, channels)
+        indexed = self.fi.get_historical_data(f, to_date, channels, index=True)
+        for key, df in indexed.items():
+            self.assertEqual(str(df.index.dtype), "datetime64[ns, UTC]")
+            self.assertEqual(df.index[0], f)
+            self.assertEqual(list(df.index), list(expected[key]["ts"]))
+            self.assertEqual(list(df), list(expected[key])[1:])
+
+
+class FroniusInverter_adaptive_windows(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeFroniusServer().start()
+        self.server.max_days = 4
+        self.to_date = from_date + datetime.timedelta(days=40)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_fixed_windows_stop_at_the_interval_error(self):
+        with FroniusInverter(self.server.host) as fi:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always")
+                self.assertIsNone(fi.get_historical_data(from_date, self.to_date, channels))
+        self.assertEqual(len(caught), 1)
+
+    def test_adaptive_windows_split_and_remember(self):
+        sizer = FroniusWindowSizer()
+        with FroniusInverter(self.server.host, window_sizer=sizer) as fi:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always")
+                data = fi.get_historical_data(from_date, self.to_date, channels)
+        self.assertEqual(len(caught), 0)
+        df = data['inverter/1'].drop_duplicates()
+        self.assertEqual(len(df), 40 * 288)
+        self.assertEqual(df['ts'].iloc[0], from_date)
+
+        stats = sizer.stats().loc[(self.server.host, ",".join(channels))]
+        self.assertGreater(stats["splits"], 0)
+        self.assertLess(stats["size"], datetime.timedelta(days=4))
+
+        # a new inverter sharing the sizer starts with the learned window length
+        requests = self.server.request_count
+        with FroniusInverter(self.server.host, window_sizer=sizer) as fi:
+            fi.get_historical_data(from_date, self.to_date, channels)
+        self.assertEqual(sizer.stats().loc[(self.server.host, ",".join(channels))]["errors"], stats["errors"])
+        self.assertLess(self.server.request_count - requests, 40)
+
+    def test_other_errors_do_not_split(self):
+        self.server.max_days = 16
+        self.server.fail_from = from_date + datetime.timedelta(days=30)
+        sizer = FroniusWindowSizer(max_size=FroniusInverter.max_query_time)
+        with FroniusInverter(self.server.host, window_sizer=sizer) as fi:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always")
+                fi.get_historical_data(from_date, from_date + datetime.timedelta(days=60), channels)
+            self.assertEqual(len(caught), 1)
+            stats = sizer.stats().iloc[0]
+            self.assertEqual(stats["splits"], 0)
+            self.assertTrue(pandas.isna(stats["failed"]))
+
+            # the "undefined" error did not shrink the windows
+            self.server.fail_from = None
+            requests = self.server.request_count
+            fi.get_historical_data(from_date, from_date + datetime.timedelta(days=60), channels)
+            self.assertLessEqual(self.server.request_count - requests, 5)
+
+    def test_adaptive_windows_grow_to_the_limit(self):
+        self.server.max_days = 16
+        sizer = FroniusWindowSizer()
+        with FroniusInverter(self.server.host, window_sizer=sizer) as fi:
+            fi.get_historical_data(from_date, from_date + datetime.timedelta(days=60), channels)
+        stats = sizer.stats().iloc[0]
+        self.assertEqual(stats["size"], datetime.timedelta(days=15))
+        self.assertEqual(stats["errors"], 1)
+
+
+class FroniusInverter_fetch_plan(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeFroniusServer(inverters=2).start()
+        self.fi = FroniusInverter(self.server.host)
+        self.to_date = from_date + datetime.timedelta(days=20)
+
+    def tearDown(self):
+        self.fi.close()
+        self.server.stop()
+
+    def test_plan_fetches_only_needed_channels(self):
+        full = FroniusInverter.plan_historical_data()
+        full_data = self.fi.get_planned_historical_data(full, from_date, self.to_date)
+        energy = FroniusInverter.plan_historical_data(metrics=["energy"])
+        data = self.fi.get_planned_historical_data(energy, from_date, self.to_date)
+
+        self.assertEqual(list(data), ['inverter/1', 'inverter/2'])
+        self.assertEqual(list(data['inverter/1']), ['ts', 'EnergyReal_WAC_Sum_Produced'])
+        pandas.testing.assert_frame_equal(data['inverter/1'], full_data['inverter/1'][list(data['inverter/1'])])
+        self.assertEqual(energy.requests, full.requests)
+        self.assertLess(energy.received_bytes * 10, full.received_bytes)
+        self.assertEqual(self.fi.received_bytes, energy.received_bytes + full.received_bytes)
+
+    def test_split_plan_matches_merged_plan(self):
+        wanted = ["Digital_PowerManagementRelay_Out_1", "Current_AC_Phase_1"]
+        merged = FroniusInverter.plan_historical_data(wanted)
+        split = FroniusInverter.plan_historical_data(wanted, split=True)
+        self.assertEqual(list(split.groups), ['datamanager', 'inverter'])
+        expected = self.fi.get_planned_historical_data(merged, from_date, self.to_date)
+        actual = self.fi.get_planned_historical_data(split, from_date, self.to_date)
+        self.assertEqual(split.requests, 2 * merged.requests)
+        for key, value in expected.items():
+            pandas.testing.assert_frame_equal(value, actual[key])
+
+    def test_split_plan_on_one_device_matches_merged_plan(self):
+        # an inverter and a meter channel, both reported by inverter/1, over more than one window
+        wanted = ["Current_AC_Phase_1", "EnergyReal_WAC_Plus_Absolute"]
+        to_date = from_date + datetime.timedelta(days=20)
+        for index in (False, True):
+            merged = FroniusInverter.plan_historical_data(wanted)
+            split = FroniusInverter.plan_historical_data(wanted, split=True)
+            self.assertEqual(list(split.groups), ['inverter', 'meter'])
+            expected = self.fi.get_planned_historical_data(merged, from_date, to_date, index=index)['inverter/1']
+            actual = self.fi.get_planned_historical_data(split, from_date, to_date, index=index)['inverter/1']
+            self.assertEqual(len(actual), len(expected))
+            if not index:
+                expected, actual = expected.reset_index(drop=True), actual.reset_index(drop=True)
+            pandas.testing.assert_frame_equal(actual, expected)
+
+
+class FroniusInverter_find_earliest_data(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime.datetime.now(pytz.utc)
+        self.first_data = (self.now - datetime.timedelta(days=10)).replace(minute=5, second=0, microsecond=0)
+        self.server = FakeFroniusServer(first_data=self.first_data).start()
+        self.fi = FroniusInverter(self.server.host)
+
+    def tearDown(self):
+        self.fi.close()
+        self.server.stop()
+
+    def test_exponential_search(self):
+        found = self.fi.find_earliest_data_exponential()
+        self.assertEqual(found, self.first_data)
+        self.assertEqual(self.fi.search_requests, self.server.request_count)
+
+    def test_exponential_search_matches_binary(self):
+        self.server.first_data = pytz.utc.localize(datetime.datetime(2017, 10, 11, 13, 5), is_dst=None)
+        self.assertEqual(self.fi.find_earliest_data_exponential(), self.fi.find_earliest_data_binary())
+
+    def test_recent_data_needs_fewer_requests_than_binary(self):
+        self.fi.find_earliest_data_binary()
+        binary = self.server.request_count
+        self.fi.find_earliest_data_exponential()
+        self.assertLess(self.fi.search_requests, binary)
+
+    def test_probes_are_memoized(self):
+        self.fi.find_earliest_data_exponential()
+        requests = self.server.request_count
+        self.fi.find_earliest_data_exponential()
+        self.assertEqual(self.fi.search_requests, 0)
+        with FroniusInverter(self.server.host) as fi:
+            # a new instance starts with no probes, unless they are passed in
+            self.assertEqual(fi.find_earliest_data_exponential(probes=self.fi.probes), self.first_data)
+            self.assertEqual(fi.search_requests, 0)
+            self.assertEqual(fi.probes, {})
+        self.assertEqual(self.server.request_count, requests)
+
+    def test_binary_search_probes_are_memoized(self):
+        found = self.fi.find_earliest_data()
+        self.assertEqual(found, self.first_data)
+        self.assertEqual(self.fi.search_requests, self.server.request_count)
+        self.assertEqual(self.fi.find_earliest_data_binary(to_date=self.now), self.first_data)
+        self.assertGreater(self.fi.search_requests, 0)
+        requests = self.server.request_count
+        self.assertEqual(self.fi.find_earliest_data_binary(to_date=self.now), self.first_data)
+        self.assertEqual(self.fi.search_requests, 0)
+        self.assertEqual(self.server.request_count, requests)
+
+    def test_exponential_search_with_nights(self):
+        # the windows of the search start at midnight, before the first sample of the day
+        self.server.stop()
+        self.first_data = pytz.utc.localize(datetime.datetime(2019, 3, 10, 8), is_dst=None)
+        self.server = FakeFroniusServer(first_data=self.first_data, daylight=(7, 19)).start()
+        with FroniusInverter(self.server.host) as fi:
+            self.assertEqual(fi.find_earliest_data_binary(), self.first_data)
+            self.assertEqual(fi.find_earliest_data_exponential(), self.first_data)
+            self.assertEqual(fi.find_earliest_data(), self.first_data)
+
+    def test_no_data(self):
+        self.server.first_data = self.now + datetime.timedelta(days=30)
+        self.assertIsNone(self.fi.find_earliest_data(self.now - datetime.timedelta(days=100)))
+
+
+class FroniusInverter_session(unittest.TestCase):
+    def test_connections_are_reused(self):
+        with FakeFroniusServer() as server:
+            with FroniusInverter(server.host) as fi:
+                for i in range(5):
+                    fi.get_inverter_realtime_data()
+            self.assertEqual(server.request_count, 5)
+            self.assertEqual(server.connection_count, 1)
+
+    def test_read_timeout(self):
+        with FakeFroniusServer(latency=0.5) as server:
+            with FroniusInverter(server.host, timeout=(1, 0.1), retries=0) as fi:
+                with self.assertRaises(requests.exceptions.Timeout):
+                    fi.get_inverter_realtime_data()
+
+    def test_retry_on_unavailable(self):
+        with FakeFroniusServer(unavailable_requests=2) as server:
+            with FroniusInverter(server.host, retries=2, backoff_factor=0) as fi:
+                compatible, response = fi.check_server_compatibility()
+            self.assertTrue(compatible)
+            self.assertEqual(server.request_count, 3)
+
+    def test_no_retry_when_disabled(self):
+        with FakeFroniusServer(unavailable_requests=1) as server:
+            with FroniusInverter(server.host, retries=0) as fi:
+                with self.assertRaises(Exception):
+                    fi.check_server_compatibility()
+            self.assertEqual(server.request_count, 1)
+
+    def test_custom_decoder(self):
+        bodies = []
+
+        def loads(content):
+            bodies.append(content)
+            return json.loads(content)
+
+        with FakeFroniusServer() as server:
+            with FroniusInverter(server.host, decoder=loads) as fi:
+                fi.get_inverter_realtime_data()
+        self.assertEqual(len(bodies), 1)
+        self.assertIsInstance(bodies[0], bytes)
+
+    def test_decoder_skips_keys(self):
+        with FakeFroniusServer() as server:
+            with FroniusInverter(server.host) as fi:
+                expected = fi.get_historical_data(from_date, from_date + datetime.timedelta(days=2), channels)
+                fi.decoder = FroniusJsonDecoder(skip_keys=("_comment", "Unit"))
+                jsondata = fi.get_historical_data_json(from_date, from_date + datetime.timedelta(days=2), channels)
+                actual = fi.get_historical_data(from_date, from_date + datetime.timedelta(days=2), channels)
+        self.assertEqual(set(jsondata["Body"]["Data"]["inverter/1"]["Data"]["Current_AC_Phase_1"]), {"Values"})
+        for key, value in expected.items():
+            pandas.testing.assert_frame_equal(value, actual[key])
+
+
+class FroniusInverter_iter_realtime_data(unittest.TestCase):
+    def test_polls_once_per_refresh(self):
+        with FakeFroniusServer(refresh=1) as server:
+            with FroniusInverter(server.host) as fi:
+                dedup = FroniusRealTimeDeduplicator()
+                samples = list(fi.iter_realtime_data(interval=0.1, deduplicator=dedup, samples=6))
+            timestamps = [sample.timestamp() for sample in samples]
+            self.assertEqual(len(set(timestamps)), 6)
+            self.assertEqual(dedup.refresh_interval(server.host), 1)
+            metrics = dedup.metrics().loc[server.host]
+            self.assertEqual(metrics['accepted'], 6)
+            self.assertEqual(server.request_count, metrics['accepted'] + metrics['dropped'])
+            # polling every 0.1 second for 5 seconds would take 50 requests
+            self.assertLess(server.request_count, 20)
+
+
+class FroniusInverter_metrics(unittest.TestCase):
+    def test_requests_and_parsing_are_observed(self):
+        metrics = FroniusMetrics()
+        with FakeFroniusServer(inverters=2) as server:
+            host = "localhost:" + server.host.split(":")[1]
+            with FroniusInverter(host, metrics=metrics) as fi:
+                fi.get_inverter_realtime_data()
+                data = fi.get_historical_data(from_date, from_date + datetime.timedelta(days=20), channels)
+                server.fail_from = from_date
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    fi.get_historical_data(from_date, from_date + datetime.timedelta(days=2), channels)
+
+        df = metrics.frame()
+
+        def observed(name, column='count', **labels):
+            rows = df[df['name'] == name]
+            for key, value in labels.items():
+                rows = rows[rows[key] == value]
+            return rows[column].sum()
+
+        self.assertEqual(observed('request_seconds', endpoint='GetArchiveData.cgi'), 3)
+        self.assertEqual(observed('response_bytes', 'sum'), fi.received_bytes)
+        self.assertEqual(observed('connect_seconds'), 1)
+        self.assertEqual(observed('dns_seconds'), 1)
+        self.assertEqual(observed('responses', endpoint='GetArchiveData.cgi', code='0'), 2)
+        self.assertEqual(observed('responses', endpoint='GetArchiveData.cgi', code='255'), 1)
+        # whole days are parsed, before the strict bounds are applied
+        self.assertGreaterEqual(observed('data_rows', 'sum'), sum(len(df) for df in data.values()))
+        self.assertEqual(observed('data_rows'), 2)
+        self.assertIn('fronius_request_seconds_count{endpoint="GetArchiveData.cgi",host="' + host + '"} 3',
+                      metrics.prometheus())
+
+    def test_one_name_lookup_per_connection(self):
+        lookups = []
+        getaddrinfo = socket.getaddrinfo
+
+        def counting_getaddrinfo(host, *args, **kwargs):
+            lookups.append(host)
+            return getaddrinfo(host, *args, **kwargs)
+
+        metrics = FroniusMetrics()
+        with FakeFroniusServer() as server:
+            host = "localhost:" + server.host.split(":")[1]
+            with FroniusInverter(host, metrics=metrics) as fi, \
+                    unittest.mock.patch("socket.getaddrinfo", counting_getaddrinfo):
+                fi.get_inverter_realtime_data()
+        self.assertEqual(lookups.count("localhost"), 1)
+        df = metrics.frame()
+        self.assertEqual(df[df["name"] == "dns_seconds"]["count"].sum(), 1)
+
+    def test_cached_requests_are_observed(self):
+        metrics = FroniusMetrics()
+        with FakeFroniusServer() as server, tempfile.TemporaryDirectory() as directory:
+            with FroniusInverter(server.host, metrics=metrics, cache=FroniusArchiveCache(directory)) as fi:
+                data = fi.get_historical_data(from_date, from_date + datetime.timedelta(days=3), channels)
+        df = metrics.frame()
+        self.assertGreaterEqual(df[df["name"] == "data_rows"]["sum"].sum(), len(data["inverter/1"]))
+        self.assertEqual(list(df[df["name"] == "data_seconds"]["host"]), [server.host])
+
+    @unittest.skipIf(aiohttp is None, "requires aiohttp")
+    def test_async_requests_are_observed(self):
+        metrics = FroniusMetrics()
+
+        async def fetch(host):
+            async with AsyncFroniusInverter(host, metrics=metrics) as fi:
+                await fi.get_inverter_realtime_data()
+                await fi.get_historical_data(from_date, from_date + datetime.timedelta(days=20), channels)
+
+        with FakeFroniusServer() as server:
+            asyncio.run(fetch(server.host))
+        df = metrics.frame().set_index('name')
+        self.assertEqual(df.loc['request_seconds', 'count'].sum(), 3)
+        self.assertGreaterEqual(df.loc['connect_seconds', 'count'].sum(), 1)
+        self.assertEqual(df.loc['data_rows', 'count'], 2)
+
+
+@unittest.skipIf(pa is None, "requires pyarrow")
+class FroniusParquetExport_tests(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeFroniusServer(inverters=2, utc_offset=datetime.timedelta(hours=1)).start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.to_date = from_date + datetime.timedelta(days=40)
+
+    def tearDown(self):
+        self.server.stop()
+        self.directory.cleanup()
+
+    def read(self, device):
+        import pyarrow.dataset
+        path = os.path.join(self.directory.name, "host=" + urllib.parse.quote(self.server.host, safe=""),
+                            "device=" + urllib.parse.quote(device, safe=""))
+        df = pyarrow.dataset.dataset(path, partitioning="hive").to_table().to_pandas()
+        return df.sort_values('ts').reset_index(drop=True)
+
+    def expected(self):
+        with FroniusInverter(self.server.host) as fi:
+            data = fi.get_historical_data(from_date, self.to_date, channels, dtypes=True)
+        return {key: df.drop_duplicates().reset_index(drop=True) for key, df in data.items()}
+
+    def assert_exported(self):
+        for device, df in self.expected().items():
+            actual = self.read(device)
+            self.assertEqual(sorted(actual['day'].unique())[0], '2017-11-01')
+            pandas.testing.assert_frame_equal(actual[list(df)], df, check_dtype=False)
+            self.assertEqual(str(actual['ts'].dt.tz), 'UTC')
+
+    def test_export_partitions_by_device_and_day(self):
+        export = FroniusParquetExport(self.directory.name, channels)
+        rows = export.export([self.server.host], from_date, self.to_date)
+        self.assertEqual(rows, {self.server.host: 3 * 40 * 288})
+        self.assertEqual(export.files, 3 * 40)
+        self.assert_exported()
+        self.assertEqual(export.progress(self.server.host), self.to_date)
+
+    def test_export_resumes_after_failure(self):
+        export = FroniusParquetExport(self.directory.name, channels)
+        self.server.fail_from = from_date + datetime.timedelta(days=20)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            export.export([self.server.host], from_date, self.to_date)
+        self.assertEqual(len(caught), 1)
+        resumed_from = export.progress(self.server.host)
+        self.assertLess(resumed_from, self.to_date)
+
+        self.server.fail_from = None
+        requests = self.server.request_count
+        export.export([self.server.host], from_date, self.to_date)
+        self.assertEqual(self.server.request_count - requests,
+                         len(FroniusInverter(self.server.host)._query_windows(resumed_from, self.to_date)))
+        self.assert_exported()
+
+
+class FroniusEventLog_tests(unittest.TestCase):
+    def test_incremental_update_and_reload(self):
+        with FakeFroniusServer(inverters=2, utc_offset=datetime.timedelta(hours=1)) as server:
+            with FroniusInverter(server.host) as fi, tempfile.TemporaryDirectory() as directory:
+                log = FroniusEventLog(directory)
+                # 4 errors and 3 events a day per inverter
+                self.assertEqual(log.update(fi, from_date + datetime.timedelta(days=20), from_date), 2 * 20 * 7)
+                requests = server.request_count
+                self.assertEqual(log.update(fi, from_date + datetime.timedelta(days=25)), 2 * 5 * 7)
+                self.assertEqual(server.request_count - requests, 1)
+
+                errors = log.query(code=102)
+                # errors cycle through 5 codes, one every 6 hours
+                self.assertEqual(len(errors), 2 * 25 * 4 // 5)
+                self.assertTrue((errors['category'] == 'error').all())
+                self.assertEqual(sorted(errors['device'].unique()), ['inverter/1', 'inverter/2'])
+
+                reloaded = FroniusEventLog(directory)
+                pandas.testing.assert_frame_equal(reloaded.query(), log.query())
+                self.assertEqual(reloaded.fetched_to, log.fetched_to)
+
+    def test_update_uses_events_request(self):
+        windows = []
+
+        class RecordingInverter(FroniusInverter):
+            def get_historical_events_json(self, fdate, tdate):
+                windows.append((fdate, tdate))
+                return super().get_historical_events_json(fdate, tdate)
+
+        with FakeFroniusServer() as server, RecordingInverter(server.host) as fi:
+            log = FroniusEventLog()
+            self.assertEqual(log.update(fi, from_date + datetime.timedelta(days=20), from_date), 20 * 7)
+            self.assertEqual(windows, fi._query_windows(from_date, from_date + datetime.timedelta(days=20)))
+
+    def test_update_fleet(self):
+        with FakeFroniusServer() as first, FakeFroniusServer() as second:
+            log = FroniusEventLog()
+            added = log.update_fleet([first.host, second.host], from_date + datetime.timedelta(days=3), from_date)
+            self.assertEqual(added, {first.host: 3 * 7, second.host: 3 * 7})
+            self.assertEqual(list(log.query(code=500)['host'].value_counts().sort_index()), [3, 3])
+
+
+class FroniusEnergyRollup_tests(unittest.TestCase):
+    def test_incremental_update_and_reload(self):
+        with FakeFroniusServer(inverters=2, utc_offset=datetime.timedelta(hours=1)) as server:
+            with FroniusInverter(server.host) as fi, tempfile.TemporaryDirectory() as directory:
+                rollup = FroniusEnergyRollup("Europe/Vienna", directory)
+                self.assertEqual(rollup.update(fi, from_date + datetime.timedelta(days=20), from_date), 2 * 20 * 288)
+                # the overlap is fetched again, but not counted
+                self.assertEqual(rollup.update(fi, from_date + datetime.timedelta(days=25, hours=6)),
+                                 2 * (5 * 288 + 72))
+
+                expected = FroniusEnergyRollup("Europe/Vienna")
+                data = fi.get_historical_data(from_date, from_date + datetime.timedelta(days=25, hours=6),
+                                              FroniusEnergyRollup.channels)
+                expected.add(server.host, data)
+                reloaded = FroniusEnergyRollup("Europe/Vienna", directory)
+                for period in FroniusEnergyRollup.periods:
+                    pandas.testing.assert_frame_equal(rollup.rollup(period), expected.rollup(period))
+                    pandas.testing.assert_frame_equal(reloaded.rollup(period), expected.rollup(period))
+                self.assertEqual(reloaded.fetched_to, rollup.fetched_to)
+
+                months = rollup.rollup("month", hosts=[server.host])
+                self.assertEqual(list(months["device"]), ["inverter/1", "inverter/2"])
+                self.assertEqual(list(months["samples"]), [25 * 288 + 72] * 2)
+
+
+class FroniusBackfill_tests(unittest.TestCase):
+    def test_matches_get_historical_data(self):
+        to_date = from_date + datetime.timedelta(days=20, hours=5)
+        with FakeFroniusServer(inverters=2, utc_offset=datetime.timedelta(hours=1)) as first, \
+                FakeFroniusServer() as second:
+            data = FroniusBackfill(max_workers=2, channels=channels, dtypes=True).fetch([first.host, second.host],
+                                                                                        from_date, to_date)
+            self.assertEqual(list(data), [first.host, second.host])
+            for server in (first, second):
+                with FroniusInverter(server.host) as fi:
+                    expected = fi.get_historical_data(from_date, to_date, channels, dtypes=True, index=True)
+                for key, df in expected.items():
+                    # overlapping windows repeat the day they share, the backfill keeps every window's own range
+                    expected_df = df[~df.index.duplicated()].reset_index()
+                    pandas.testing.assert_frame_equal(data[server.host][key], expected_df)
+
+    def test_time_index_and_error(self):
+        with FakeFroniusServer(fail_from=from_date + datetime.timedelta(days=20)) as server:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always")
+                data = FroniusBackfill(max_workers=1, channels=channels, index=True).fetch(
+                    [server.host], from_date, from_date + datetime.timedelta(days=60))
+                with FroniusInverter(server.host) as fi:
+                    expected = fi.get_historical_data(from_date, from_date + datetime.timedelta(days=60), channels,
+                                                      index=True)["inverter/1"]
+            self.assertEqual(len(caught), 2)
+            df = data[server.host]["inverter/1"]
+            self.assertEqual(str(df.index.dtype), "datetime64[ns, UTC]")
+            self.assertEqual(df.index[0], from_date)
+            pandas.testing.assert_frame_equal(df, expected[~expected.index.duplicated()])
+
+    def test_error_stops_fetching(self):
+        with FakeFroniusServer(fail_from=from_date + datetime.timedelta(days=20)) as server:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                FroniusBackfill(max_workers=1, channels=channels).fetch([server.host], from_date,
+                                                                        from_date + datetime.timedelta(days=365))
+            # the error is noticed while the next windows are fetched, not after a year of windows
+            self.assertLess(server.request_count, 10)
+
+    def test_requests_are_observed(self):
+        metrics = FroniusMetrics()
+        with FakeFroniusServer() as server:
+            FroniusBackfill(max_workers=1, channels=channels).fetch([server.host], from_date,
+                                                                    from_date + datetime.timedelta(days=20),
+                                                                    metrics=metrics)
+        df = metrics.frame()
+        responses = df[df["name"] == "responses"]
+        self.assertEqual(list(responses["code"]), ["undecoded"])
+        self.assertEqual(responses["count"].sum(), 2)
+        self.assertEqual(df[df["name"] == "request_seconds"]["count"].sum(), 2)
+
+
+class FroniusArchiveCache_tests(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeFroniusServer().start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = FroniusArchiveCache(self.directory.name)
+        self.fi = FroniusInverter(self.server.host, cache=self.cache)
+
+    def tearDown(self):
+        self.fi.close()
+        self.server.stop()
+        self.directory.cleanup()
+
+    def test_matches_uncached(self):
+        f = from_date + datetime.timedelta(hours=5)
+        t = from_date + datetime.timedelta(days=20, hours=3)
+        with FroniusInverter(self.server.host) as fi:
+            expected = fi.get_historical_data(f, t, channels)
+        actual = self.fi.get_historical_data(f, t, channels)
+        self.assertEqual(sorted(expected.keys()), sorted(actual.keys()))
+        for key in expected:
+            # overlapping windows repeat the samples of the day they share, the cache stores every day once
+            expected[key] = expected[key].drop_duplicates('ts')
+            self.assertEqual(list(expected[key]), list(actual[key]))
+            self.assertTrue((expected[key]['ts'].values == actual[key]['ts'].values).all())
+            for channel in list(expected[key])[1:]:
+                self.assertTrue((expected[key][channel].values == actual[key][channel].values).all())
+
+    def test_time_index(self):
+        f = from_date + datetime.timedelta(hours=5)
+        t = from_date + datetime.timedelta(days=3)
+        data = self.fi.get_historical_data(f, t, channels)
+        indexed = self.fi.get_historical_data(f, t, channels, index=True)
+        for key, df in indexed.items():
+            self.assertEqual(str(df.index.dtype), "datetime64[ns, UTC]")
+            pandas.testing.assert_frame_equal(df.reset_index(), data[key], check_dtype=False)
+
+    def test_repeat_query_served_from_disk(self):
+        t = from_date + datetime.timedelta(days=20)
+        first = self.fi.get_historical_data(from_date, t, channels)
+        requests = self.server.request_count
+        second = self.fi.get_historical_data(from_date + datetime.timedelta(days=2), t, channels[1:])
+        self.assertEqual(self.server.request_count, requests)
+        pandas.testing.assert_frame_equal(first['inverter/1'].iloc[2 * 288:].reset_index(drop=True),
+                                          second['inverter/1'])
+
+    def test_only_missing_days_are_fetched(self):
+        self.fi.get_historical_data(from_date, from_date + datetime.timedelta(days=5), channels)
+        requests = self.server.request_count
+        data = self.fi.get_historical_data(from_date, from_date + datetime.timedelta(days=10), channels)
+        self.assertEqual(self.server.request_count, requests + 1)
+        self.assertEqual(len(data['inverter/1']), 10 * 288)
+
+    def test_new_channel_is_fetched(self):
+        t = from_date + datetime.timedelta(days=2)
+        self.fi.get_historical_data(from_date, t, channels)
+        requests = self.server.request_count
+        data = self.fi.get_historical_data(from_date, t, ["Current_AC_Phase_1", "Voltage_AC_Phase_1"])
+        self.assertEqual(self.server.request_count, requests + 1)
+        self.assertEqual(list(data['inverter/1']), ['ts', 'Current_AC_Phase_1', 'Voltage_AC_Phase_1'])
+        self.fi.get_historical_data(from_date, t, channels + ["Voltage_AC_Phase_1"])
+        self.assertEqual(self.server.request_count, requests + 1)
+
+    def test_open_day_is_not_cached(self):
+        now = datetime.datetime.now(pytz.utc)
+        self.fi.get_historical_data(now - datetime.timedelta(days=1), now, channels)
+        requests = self.server.request_count
+        self.fi.get_historical_data(now - datetime.timedelta(days=1), now, channels)
+        self.assertEqual(self.server.request_count, requests + 1)
+
+    def test_eviction(self):
+        self.fi.get_historical_data(from_date, from_date + datetime.timedelta(days=1), channels)
+        day_size = self.cache.size()
+        self.cache.max_bytes = 3 * day_size
+        self.fi.get_historical_data(from_date, from_date + datetime.timedelta(days=10), channels)
+        self.assertLessEqual(self.cache.size(), 3 * day_size)
+        self.assertEqual(len(list(self.cache._files())), 3)
+
+    def test_eviction_walks_the_cache_once(self):
+        self.cache.max_bytes = 10 ** 9
+        with unittest.mock.patch("fronius.os.walk", wraps=os.walk) as walk:
+            self.fi.get_historical_data(from_date, from_date + datetime.timedelta(days=10), channels)
+            self.fi.get_historical_data(from_date + datetime.timedelta(days=10),
+                                        from_date + datetime.timedelta(days=20), channels)
+        self.assertEqual(walk.call_count, 1)
+        self.assertEqual(self.cache._lru_bytes, self.cache.size())
+
+
+@unittest.skipIf(aiohttp is None, "aiohttp is not installed")
+class AsyncFroniusInverter_tests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.server = FakeFroniusServer(latency=0.05, first_data=from_date + datetime.timedelta(days=3, hours=5)).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    async def test_realtime_data(self):
+        async with AsyncFroniusInverter(self.server.host) as afi:
+            json = await afi.get_inverter_realtime_data()
+        rtd = FroniusRealTimeJson(json).data()
+        self.assertEqual(len(rtd), 1)
+        self.assertIn('PAC', list(rtd))
+
+    async def test_server_compatibility(self):
+        async with AsyncFroniusInverter(self.server.host) as afi:
+            compatible, response = await afi.check_server_compatibility()
+        self.assertTrue(compatible)
+
+    async def test_historical_data_matches_blocking_client(self):
+        to_date = from_date + datetime.timedelta(days=40)
+        with FroniusInverter(self.server.host) as fi:
+            expected = fi.get_historical_data(from_date, to_date, channels)
+        async with AsyncFroniusInverter(self.server.host) as afi:
+            actual = await afi.get_historical_data(from_date, to_date, channels)
+        self.assertEqual(list(expected.keys()), list(actual.keys()))
+        for key in expected:
+            pandas.testing.assert_frame_equal(expected[key], actual[key])
+
+    async def test_iter_and_planned_historical_data_match_blocking_client(self):
+        to_date = from_date + datetime.timedelta(days=40)
+        plan = FroniusInverter.plan_historical_data(channels, split=True)
+        with FroniusInverter(self.server.host) as fi:
+            expected = list(fi.iter_historical_data(from_date, to_date, channels))
+            expected_planned = fi.get_planned_historical_data(plan, from_date, to_date)
+            expected_bytes = fi.get_historical_data_bytes(from_date, to_date - datetime.timedelta(days=30), channels)
+        async_plan = FroniusInverter.plan_historical_data(channels, split=True)
+        async with AsyncFroniusInverter(self.server.host) as afi:
+            actual = [frame async for frame in afi.iter_historical_data(from_date, to_date, channels)]
+            planned = await afi.get_planned_historical_data(async_plan, from_date, to_date)
+            content = await afi.get_historical_data_bytes(from_date, to_date - datetime.timedelta(days=30), channels)
+        self.assertEqual([key for key, df in actual], [key for key, df in expected])
+        for (key, df), (expected_key, expected_df) in zip(actual, expected):
+            pandas.testing.assert_frame_equal(df, expected_df)
+        for key, df in expected_planned.items():
+            pandas.testing.assert_frame_equal(planned[key], df)
+        self.assertEqual(async_plan.requests, plan.requests)
+        self.assertEqual(json.loads(content)["Body"], json.loads(expected_bytes)["Body"])
+
+    async def test_at_most_max_workers_windows_are_fetched_ahead(self):
+        to_date = from_date + datetime.timedelta(days=300)
+        async with AsyncFroniusInverter(self.server.host) as afi:
+            frames = afi.iter_historical_data(from_date, to_date, channels, max_workers=2)
+            await frames.__anext__()
+            await asyncio.sleep(5 * self.server.latency)
+            self.assertEqual(self.server.request_count, 1 + 2)
+            await frames.aclose()
+
+    async def test_iter_realtime_data(self):
+        async with AsyncFroniusInverter(self.server.host) as afi:
+            samples = [rtj async for rtj in afi.iter_realtime_data(interval=0.2, samples=2)]
+        self.assertEqual(len(samples), 2)
+        self.assertLess(samples[0].timestamp(), samples[1].timestamp())
+
+    async def test_blocking_only_options_raise(self):
+        with self.assertRaises(TypeError):
+            AsyncFroniusInverter(self.server.host, window_sizer=FroniusWindowSizer())
+        async with AsyncFroniusInverter(self.server.host) as afi:
+            with self.assertRaises(TypeError):
+                FroniusEventLog().update(afi, from_date + datetime.timedelta(days=1), from_date)
+            with self.assertRaises(TypeError):
+                FroniusEnergyRollup(tz="UTC").update(afi, from_date + datetime.timedelta(days=1), from_date)
+            self.assertEqual(self.server.request_count, 0)
+
+    async def test_historical_data_positional_arguments_match_blocking_client(self):
+        to_date = from_date + datetime.timedelta(days=20)
+        with FroniusInverter(self.server.host) as fi:
+            expected = fi.get_historical_data(from_date, to_date, channels, True, 2, True, True)
+        async with AsyncFroniusInverter(self.server.host) as afi:
+            actual = await afi.get_historical_data(from_date, to_date, channels, True, 2, True, True)
+        for key in expected:
+            pandas.testing.assert_frame_equal(expected[key], actual[key])
+
+    async def test_find_earliest_data_matches_blocking_client(self):
+        search_from = from_date - datetime.timedelta(days=100)
+        with FroniusInverter(self.server.host) as fi:
+            expected = fi.find_earliest_data(search_from)
+        async with AsyncFroniusInverter(self.server.host) as afi:
+            actual = await afi.find_earliest_data(search_from)
+            linear = await afi.find_earliest_data_linear(search_from)
+        self.assertEqual(expected, self.server.first_data)
+        self.assertEqual(expected, actual)
+        self.assertEqual(expected, linear)
+
+    async def test_many_inverters_share_one_session(self):
+        async with aiohttp.ClientSession() as session:
+            inverters = [AsyncFroniusInverter(self.server.host, session=session) for i in range(50)]
+            start = time.perf_counter()
+            results = await asyncio.gather(*[afi.get_inverter_realtime_data() for afi in inverters])
+            elapsed = time.perf_counter() - start
+        self.assertEqual(len(results), 50)
+        self.assertLess(elapsed, 50 * self.server.latency / 2)
+
+    async def test_concurrency_limit(self):
+        self.server.latency = 0.2
+        async with AsyncFroniusInverter(self.server.host, max_concurrency=1) as afi:
+            start = time.perf_counter()
+            await asyncio.gather(*[afi.get_inverter_realtime_data() for i in range(3)])
+            elapsed = time.perf_counter() - start
+        self.assertGreaterEqual(elapsed, 3 * 0.2)
+
+
+class _MalformedRealtimeServer(FakeFroniusServer):
+    def realtime_data(self, query):
+        return {"Head": {"Status": {"Code": 0}}}
+
+
+@unittest.skipIf(aiohttp is None, "aiohttp is not installed")
+class FroniusFleetPoller_tests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.server = FakeFroniusServer().start()
+        self.slow_server = FakeFroniusServer(latency=1).start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.slow_server.stop()
+
+    async def test_ticks_are_aligned_and_batched(self):
+        batches = []
+        hosts = [self.server.host, "localhost:" + self.server.host.split(":")[1]]
+        metrics = FroniusMetrics()
+        poller = FroniusFleetPoller(hosts, interval=0.2, callback=lambda tick, batch: batches.append((tick, batch)),
+                                    request_metrics=metrics)
+        await poller.run(ticks=3)
+        requests = metrics.frame().set_index(['name', 'host']).loc['request_seconds', 'count']
+        self.assertEqual(list(requests), [3, 3])
+
+        self.assertEqual(len(batches), 3)
+        for tick, batch in batches:
+            self.assertEqual(sorted(batch.keys()), sorted(hosts))
+            self.assertIsInstance(batch[hosts[0]], FroniusRealTimeJson)
+            self.assertAlmostEqual(tick.timestamp() / 0.2, round(tick.timestamp() / 0.2), places=3)
+        ticks = [tick for tick, batch in batches]
+        self.assertAlmostEqual((ticks[2] - ticks[0]).total_seconds(), 0.2 * (2 + poller.missed_ticks), places=3)
+        self.assertEqual(poller.metrics().loc[hosts[0], 'samples'], 3)
+
+    async def test_slow_and_dead_hosts_are_isolated(self):
+        queue = asyncio.Queue()
+        hosts = [self.server.host, self.slow_server.host, "127.0.0.1:9"]
+        poller = FroniusFleetPoller(hosts, interval=0.5, deadline=0.2, queue=queue)
+        start = time.perf_counter()
+        await poller.run(ticks=2)
+        self.assertLess(time.perf_counter() - start, 2)
+
+        self.assertEqual(queue.qsize(), 2)
+        tick, batch = queue.get_nowait()
+        self.assertEqual(list(batch.keys()), [self.server.host])
+
+        metrics = poller.metrics()
+        self.assertEqual(metrics.loc[self.server.host, 'samples'], 2)
+        self.assertEqual(metrics.loc[self.slow_server.host, 'timeouts'], 2)
+        self.assertEqual(metrics.loc["127.0.0.1:9", 'errors'], 2)
+        self.assertLess(metrics.loc[self.server.host, 'latency_max'], 0.2)
+        self.assertEqual(poller.missed_ticks, 0)
+
+    async def test_deduplicated_hosts_are_polled_after_refresh(self):
+        batches = []
+        dedup = FroniusRealTimeDeduplicator()
+        with FakeFroniusServer(refresh=1) as server:
+            poller = FroniusFleetPoller([server.host], interval=0.2, deduplicator=dedup,
+                                        callback=lambda tick, batch: batches.append(batch))
+            await poller.run(ticks=15)
+
+        samples = [batch[server.host] for batch in batches if batch]
+        self.assertEqual(len(set(sample.timestamp() for sample in samples)), len(samples))
+        self.assertGreaterEqual(len(samples), 2)
+        metrics = poller.metrics().loc[server.host]
+        self.assertGreater(metrics['skipped'], 0)
+        self.assertEqual(metrics['samples'] + metrics['skipped'], 15)
+        self.assertEqual(dedup.metrics().loc[server.host, 'accepted'], len(samples))
+
+    async def test_malformed_host_is_isolated(self):
+        batches = []
+        with _MalformedRealtimeServer() as malformed:
+            hosts = [self.server.host, malformed.host]
+            poller = FroniusFleetPoller(hosts, interval=0.2, deduplicator=FroniusRealTimeDeduplicator(),
+                                        callback=lambda tick, batch: batches.append(batch))
+            await poller.run(ticks=2)
+
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(list(batches[0].keys()), [self.server.host])
+        metrics = poller.metrics()
+        self.assertEqual(metrics.loc[malformed.host, 'errors'], 2)
+        self.assertEqual(metrics.loc[malformed.host, 'samples'], 0)
+        self.assertEqual(metrics.loc[self.server.host, 'errors'], 0)
+
+    async def test_overrun_counts_missed_ticks(self):
+        poller = FroniusFleetPoller([self.server.host], interval=0.1, callback=lambda tick, batch: time.sleep(0.25))
+        await poller.run(ticks=2)
+        self.assertGreaterEqual(poller.missed_ticks, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,33 @@
 import unittest
 from fronius import FroniusInverter
 from fronius import FroniusArchiveJson
+from fronius import FroniusArchiveBatch
+from fronius import FroniusEventsJson
+from fronius import FroniusEventLog
+from fronius import FroniusEnergyRollup
+from fronius import FroniusBackfill
+from fronius import FroniusJsonDecoder
+from fronius import FroniusWindowSizer
+from fronius import FroniusMetrics
 from fronius import FroniusJson
 from fronius import FroniusRealTimeJson
+from fronius import FroniusRealTimeBuffer
+from fronius import FroniusRealTimeDeduplicator
 import fronius
-
+from sampleData import make_archive_json
+from sampleData import legacy_archive_data
+from sampleData import realtime_samples
+from sampleData import legacy_merge_windows
+
+import copy
+import warnings
+import json
+import os
+import tempfile
+import datetime
 import dateutil
+import numpy
+import pandas
 
 #
 # fast unit tests that don't need to connect to the network
@@ -151,6 +173,86 @@ class FroniusRealTimeJsonTests(unittest.TestCase):
         faj = FroniusRealTimeJson(realtime_error_json)
         self.assertEqual(faj.error_code(), 255)
 
+class FroniusRealTimeBufferTests(unittest.TestCase):
+    def test_append_and_frame(self):
+        store = FroniusRealTimeBuffer(10)
+        for frt in realtime_samples(3):
+            store.append(frt)
+        df = store.to_frame()
+        self.assertEqual(len(store), 3)
+        self.assertEqual(list(df), ['ts', 'DAY_ENERGY', 'PAC', 'TOTAL_ENERGY', 'YEAR_ENERGY'])
+        self.assertEqual(list(df['PAC']), [0, 1, 2])
+        self.assertEqual(df['ts'][0], dateutil.parser.parse('2017-10-28T12:00:00+00:00'))
+
+    def test_keeps_latest_samples_in_order(self):
+        store = FroniusRealTimeBuffer(4)
+        for frt in realtime_samples(10):
+            store.append(frt)
+        df = store.to_frame()
+        self.assertEqual(len(df), 4)
+        self.assertEqual(list(df['PAC']), [6, 7, 8, 9])
+        self.assertTrue(df['ts'].is_monotonic_increasing)
+
+    def test_frame_is_a_view(self):
+        store = FroniusRealTimeBuffer(4)
+        for frt in realtime_samples(6):
+            store.append(frt)
+        self.assertTrue(numpy.shares_memory(store.to_frame()['PAC'].to_numpy(), store._values))
+
+    def test_ignores_errors_and_unknown_channels(self):
+        store = FroniusRealTimeBuffer(4, channels=['PAC', 'IAC'])
+        store.append(FroniusRealTimeJson(realtime_error_json))
+        store.append(FroniusRealTimeJson(realtime_json))
+        df = store.to_frame()
+        self.assertEqual(list(df), ['ts', 'PAC', 'IAC'])
+        self.assertEqual(df['PAC'][0], 548)
+        self.assertTrue(numpy.isnan(df['IAC'][0]))
+
+    def test_data_appends_to_buffer(self):
+        store = FroniusRealTimeBuffer(4)
+        FroniusRealTimeJson(realtime_json).data(append=store)
+        df = list(realtime_samples(1))[0].data(append=store).to_frame()
+        self.assertEqual(len(df), 2)
+        self.assertEqual(list(df['PAC']), [548, 0])
+
+    def test_data_reassigned_to_buffer_keeps_appending(self):
+        d = store = FroniusRealTimeBuffer(10)
+        for frt in [FroniusRealTimeJson(realtime_json)] + list(realtime_samples(3)):
+            d = frt.data("ts", append=d)
+            self.assertIs(d, store)
+        self.assertEqual(len(d.to_frame()), 4)
+
+
+class FroniusRealTimeDeduplicatorTests(unittest.TestCase):
+    def sample(self, seconds):
+        json = copy.deepcopy(realtime_json)
+        date = datetime.datetime(2017, 10, 28, 12, tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=seconds)
+        json['Head']['Timestamp'] = date.isoformat()
+        return json, date.timestamp()
+
+    def test_drops_unchanged_timestamps(self):
+        dedup = FroniusRealTimeDeduplicator()
+        accepted = [dedup.accept('a', self.sample(s)[0]) for s in (0, 0, 0, 3, 3, 6)]
+        self.assertEqual(accepted, [True, False, False, True, False, True])
+        self.assertTrue(dedup.accept('b', self.sample(0)[0]))
+        self.assertTrue(dedup.accept('a', realtime_error_json))
+        self.assertTrue(dedup.accept('a', realtime_error_json))
+        metrics = dedup.metrics()
+        self.assertEqual((metrics.loc['a', 'accepted'], metrics.loc['a', 'dropped']), (3, 3))
+        self.assertEqual(metrics.loc['b', 'accepted'], 1)
+
+    def test_refresh_interval(self):
+        dedup = FroniusRealTimeDeduplicator()
+        self.assertIsNone(dedup.refresh_interval('a'))
+        self.assertIsNone(dedup.next_refresh('a'))
+        # polled slower than the refresh: steps are multiples of the refresh interval
+        for s in (0, 6, 9, 15):
+            json, refreshed = self.sample(s)
+            dedup.accept('a', json, now=refreshed + 0.5)
+        self.assertEqual(dedup.refresh_interval('a'), 3)
+        self.assertAlmostEqual(dedup.next_refresh('a', now=refreshed + 0.5), refreshed + 3.5 + dedup.margin)
+        self.assertAlmostEqual(dedup.next_refresh('a', now=refreshed + 7), refreshed + 9.5 + dedup.margin)
+
 class FroniusArchiveJsonTests(unittest.TestCase):
     def test_constructor_cannot_accept_string(self):
         with self.assertRaises(AssertionError):
@@ -196,6 +298,17 @@ class FroniusArchiveJsonTests(unittest.TestCase):
         dt = dateutil.parser.parse('2017-10-01T00:00:00+02:00')
         self.assertEqual(dt, faj.start_date())
 
+    def test_start_date_is_parsed_once(self):
+        faj = FroniusArchiveJson(archive_json)
+        self.assertIs(faj.start_date(), faj.start_date())
+
+    def test_start_date_with_other_format(self):
+        json = copy.deepcopy(archive_json)
+        json['Head']['RequestArguments']['StartDate'] = 'Wed, 25 Oct 2017 00:00:00 +0200'
+        faj = FroniusArchiveJson(json)
+        dt = dateutil.parser.parse('2017-10-25T00:00:00+02:00')
+        self.assertEqual(dt, faj.start_date())
+
     def test_end_date_with_regular(self):
         faj = FroniusArchiveJson(archive_json)
         dt = dateutil.parser.parse('2017-10-25T23:59:59+02:00')
@@ -244,10 +357,492 @@ class FroniusArchiveJsonTests(unittest.TestCase):
         faj = FroniusArchiveJson(error_json)
         self.assertEqual(faj.data(), {})
 
+    def test_data_with_multiple_channels(self):
+        json = copy.deepcopy(archive_json)
+        json['Body']['Data']['inverter/1']['Data']['Current_AC_Phase_1'] = {'Unit': '1A',
+                                                                            'Values': {'1800': 1.5, '99': 2.5}}
+        df = FroniusArchiveJson(json).data()['inverter/1']
+        self.assertEqual(list(df), ['ts', 'TimeSpanInSec', 'Current_AC_Phase_1'])
+        self.assertEqual(len(df), 21)
+        self.assertTrue(df['ts'].is_monotonic_increasing)
+        self.assertEqual(df['ts'][0], dateutil.parser.parse('2017-10-25T00:01:39+02:00'))
+        self.assertTrue(pandas.isna(df['TimeSpanInSec'][0]))
+        self.assertEqual(df['TimeSpanInSec'][1], 53)
+        self.assertEqual(df['Current_AC_Phase_1'][1], 1.5)
+
+    def test_data_matches_legacy_merge(self):
+        faj = FroniusArchiveJson(make_archive_json(days=1, channels=['TimeSpanInSec', 'Current_AC_Phase_1']))
+        expected = legacy_archive_data(faj)
+        for key, value in faj.data().items():
+            pandas.testing.assert_frame_equal(value, expected[key])
+
+    def test_data_with_compact_dtypes(self):
+        json = copy.deepcopy(archive_json)
+        json['Body']['Data']['inverter/1']['Data']['Current_AC_Phase_1'] = {'Unit': '1A',
+                                                                            'Values': {'1800': 1.5, '99': 2.5}}
+        df = FroniusArchiveJson(json).data(dtypes=True)['inverter/1']
+        self.assertEqual(str(df['TimeSpanInSec'].dtype), 'Int32')
+        self.assertEqual(df['Current_AC_Phase_1'].dtype, numpy.float32)
+        self.assertTrue(df['TimeSpanInSec'][0] is pandas.NA)
+        self.assertEqual(df['TimeSpanInSec'][1], 53)
+        self.assertEqual(df['Current_AC_Phase_1'][1], 1.5)
+
+    def test_data_with_explicit_dtypes(self):
+        df = FroniusArchiveJson(archive_json).data(dtypes={'TimeSpanInSec': 'int16', 'Radiation': 'float32'})
+        self.assertEqual(df['inverter/1']['TimeSpanInSec'].dtype, numpy.int16)
+        self.assertEqual(df['datamanager:/dc/f0056cc6/']['Digital_PowerManagementRelay_Out_1'].dtype, numpy.int64)
+
+    def test_values_decoded_once(self):
+        faj = FroniusArchiveJson(archive_json)
+        offsets, values = faj.values('inverter/1', 'TimeSpanInSec')
+        self.assertEqual(offsets.dtype, numpy.int64)
+        self.assertEqual(offsets[1], 1800)
+        self.assertEqual(values[1], 53)
+        self.assertFalse(values.flags.writeable)
+        self.assertEqual(list(faj._values), [('inverter/1', 'TimeSpanInSec')])
+        self.assertIs(faj.values('inverter/1', 'TimeSpanInSec')[1], values)
+        with self.assertRaises(KeyError):
+            faj.values('inverter/1', 'Current_AC_Phase_1')
+
+    def test_data_uses_values(self):
+        faj = FroniusArchiveJson(archive_json)
+        offsets, values = faj.values('inverter/1', 'TimeSpanInSec')
+        df = faj.data()['inverter/1']
+        self.assertEqual(list(df['TimeSpanInSec']), list(values))
+        self.assertEqual(len(faj._values), 2)
+
+    def test_start_of_events(self):
+        json = dict(archive_json, Body={'Data': {'inverter/1': archive_json['Body']['Data']['inverter/1']}})
+        self.assertEqual(FroniusInverter._get_start_of_events(json), dateutil.parser.parse('2017-10-25T00:30:00+02:00'))
+
+    def test_data_indexed_by_time(self):
+        faj = FroniusArchiveJson(archive_json)
+        for key, df in faj.data().items():
+            indexed = faj.data(index=True)[key]
+            self.assertEqual(str(indexed.index.dtype), 'datetime64[ns, UTC]')
+            self.assertEqual(indexed.index.name, 'ts')
+            self.assertTrue(indexed.index.is_monotonic_increasing)
+            expected = df.assign(ts=df['ts'].dt.tz_convert('UTC').dt.as_unit('ns')).set_index('ts')
+            pandas.testing.assert_frame_equal(indexed, expected.sort_index(kind='stable'))
+
+    def test_local_time_view(self):
+        indexed = FroniusArchiveJson(archive_json).data(index=True)['inverter/1']
+        local = FroniusInverter.local_time(indexed, 'Europe/Vienna')
+        self.assertEqual(str(local.index.tz), 'Europe/Vienna')
+        self.assertEqual(local.index[0], indexed.index[0])
+        self.assertEqual(local.index[0].hour, 0)
+        self.assertTrue(numpy.shares_memory(local['TimeSpanInSec'].to_numpy(), indexed['TimeSpanInSec'].to_numpy()))
+
+    def test_tidy_data(self):
+        df = FroniusArchiveJson(archive_json).tidy_data(dtypes=True)
+        self.assertEqual(list(df), ['ts', 'device', 'Digital_PowerManagementRelay_Out_1', 'TimeSpanInSec'])
+        self.assertEqual(str(df['device'].dtype), 'category')
+        self.assertEqual(list(df['device'].cat.categories), ['datamanager:/dc/f0056cc6/', 'inverter/1'])
+        self.assertEqual((df['device'] == 'inverter/1').sum(), 20)
+        self.assertEqual(str(df['Digital_PowerManagementRelay_Out_1'].dtype), 'Int8')
+        self.assertTrue(df['TimeSpanInSec'].isna().any())
+
+    def test_tidy_data_with_error(self):
+        df = FroniusArchiveJson(error_json).tidy_data()
+        self.assertEqual(list(df), ['ts', 'device'])
+        self.assertEqual(len(df), 0)
+
+    def test_compact_dtypes_use_less_memory(self):
+        faj = FroniusArchiveJson(make_archive_json(days=1))
+        default = faj.data()['inverter/1'].memory_usage(deep=True).sum()
+        compact = faj.data(dtypes=True)['inverter/1'].memory_usage(deep=True).sum()
+        self.assertLess(compact, default * 0.7)
+
+events_json = {'Body': {'Data': {'inverter/1': {'Data': {
+    'InverterErrors': {'Unit': '1', 'Values': {'3600': {'#': 567, 'attr': {}}, '60': [{'#': 102}, {'#': 103}]},
+                       '_comment': 'channelId=0'},
+    'InverterEvents': {'Unit': '1', 'Values': {'120': 7}, '_comment': 'channelId=1'}},
+    'Start': '2017-10-25T00:00:00+02:00', 'End': '2017-10-25T23:59:59+02:00'}}},
+    'Head': {'RequestArguments': {'Channel': ['InverterEvents', 'InverterErrors'],
+                                  'EndDate': '2017-10-25T23:59:59+02:00', 'HumanReadable': 'True', 'Scope': 'System',
+                                  'SeriesType': 'Detail', 'StartDate': '2017-10-25T00:00:00+02:00'},
+             'Status': {'Code': 0, 'Reason': '', 'UserMessage': ''},
+             'Timestamp': '2017-10-26T16:22:29+02:00'}}
+
+
+class FroniusEventsJsonTests(unittest.TestCase):
+    def test_events(self):
+        df = FroniusEventsJson(events_json).events()
+        self.assertEqual(list(df), ['ts', 'device', 'code', 'category'])
+        self.assertEqual(list(df['code']), [102, 103, 7, 567])
+        self.assertEqual(list(df['category']), ['error', 'error', 'event', 'error'])
+        self.assertEqual(df['ts'][0], dateutil.parser.parse('2017-10-25T00:01:00+02:00'))
+        self.assertEqual(str(df['device'].dtype), 'category')
+        self.assertEqual(df['code'].dtype, numpy.int32)
+
+    def test_events_without_events(self):
+        df = FroniusEventsJson(archive_json).events()
+        self.assertEqual(len(df), 0)
+        self.assertEqual(list(df), ['ts', 'device', 'code', 'category'])
+
+
+class FroniusEventLogTests(unittest.TestCase):
+    def log(self):
+        log = FroniusEventLog()
+        events = FroniusEventsJson(events_json).events()
+        start = datetime.datetime(2017, 10, 24, tzinfo=datetime.timezone.utc)
+        for host in ('a', 'b'):
+            log._append(host, events, start, start + datetime.timedelta(days=2))
+        return log
+
+    def test_query_by_code(self):
+        df = self.log().query(code=102)
+        self.assertEqual(list(df['host']), ['a', 'b'])
+        self.assertEqual(list(df['code']), [102, 102])
+        self.assertEqual(df['ts'][0], dateutil.parser.parse('2017-10-25T00:01:00+02:00'))
+
+    def test_query_by_time_category_and_host(self):
+        log = self.log()
+        self.assertEqual(len(log.query()), 8)
+        start = dateutil.parser.parse('2017-10-25T00:02:00+02:00')
+        self.assertEqual(list(log.query(from_date=start, hosts=['a'])['code']), [7, 567])
+        self.assertEqual(list(log.query(to_date=start, hosts=['a'])['code']), [102, 103])
+        self.assertEqual(list(log.query(category='event')['code']), [7, 7])
+        self.assertEqual(len(log.query(code=567, to_date=start)), 0)
+
+    def test_append_keeps_the_window(self):
+        log = FroniusEventLog()
+        events = FroniusEventsJson(events_json).events()
+        start = dateutil.parser.parse('2017-10-25T00:02:00+02:00')
+        self.assertEqual(log._append('a', events, start, start + datetime.timedelta(minutes=59)), 2)
+        self.assertEqual(list(log.query()['code']), [7, 567])
+
+class FroniusEnergyRollupTests(unittest.TestCase):
+    def samples(self, start='2017-10-27', days=5, energy=10.0):
+        ts = pandas.date_range(start, periods=days * 288, freq='300s', tz='UTC')
+        return pandas.DataFrame({'ts': ts, 'EnergyReal_WAC_Sum_Produced': energy, 'TimeSpanInSec': 300})
+
+    def assert_same_totals(self, actual, expected):
+        for period in FroniusEnergyRollup.periods:
+            pandas.testing.assert_frame_equal(actual.rollup(period), expected.rollup(period))
+
+    def test_local_days_and_months(self):
+        rollup = FroniusEnergyRollup('Europe/Vienna')
+        self.assertEqual(rollup.add('a', {'inverter/1': self.samples()}), 5 * 288)
+        days = rollup.rollup('day')
+        # the last sunday of october has 25 hours
+        self.assertEqual(list(days['samples']), [264, 288, 300, 288, 288, 12])
+        self.assertAlmostEqual(days['kWh'][2], 3.0)
+        self.assertEqual(days['start'][0], pandas.Timestamp('2017-10-27'))
+        months = rollup.rollup('month')
+        self.assertEqual(list(months['start']), [pandas.Timestamp('2017-10-01'), pandas.Timestamp('2017-11-01')])
+        self.assertEqual(list(months['seconds']), [1428 * 300, 12 * 300])
+        self.assertEqual(rollup.rollup('hour')['samples'].sum(), 5 * 288)
+
+    def test_matches_groupby(self):
+        df = self.samples(days=40)
+        df['EnergyReal_WAC_Sum_Produced'] = numpy.arange(len(df)) % 97
+        rollup = FroniusEnergyRollup('America/New_York')
+        rollup.add('a', {'inverter/1': df})
+        local = df['ts'].dt.tz_convert('America/New_York').dt.tz_localize(None)
+        expected = df.groupby(local.dt.floor('D'))['EnergyReal_WAC_Sum_Produced'].sum() / 1000
+        numpy.testing.assert_allclose(rollup.rollup('day')['kWh'], expected.to_numpy())
+        self.assertEqual(list(rollup.rollup('day')['start']), list(expected.index))
+
+    def test_incremental_updates_match_one_update(self):
+        df = self.samples(days=40)
+        replaced = df.iloc[5000:].assign(EnergyReal_WAC_Sum_Produced=20.0)
+        incremental = FroniusEnergyRollup('Europe/Vienna')
+        self.assertEqual(incremental.add('a', {'inverter/1': df.iloc[:5500]}), 5500)
+        self.assertEqual(incremental.add('a', {'inverter/1': replaced}), len(df) - 5500)
+        self.assertEqual(incremental.add('a', {'inverter/1': df.iloc[:10]}), 0)
+        expected = FroniusEnergyRollup('Europe/Vienna')
+        expected.add('a', {'inverter/1': pandas.concat([df.iloc[:5000], replaced])})
+        self.assert_same_totals(incremental, expected)
+
+    def test_range_hosts_and_missing_values(self):
+        rollup = FroniusEnergyRollup('UTC')
+        df = self.samples(days=2)
+        df.loc[:9, 'EnergyReal_WAC_Sum_Produced'] = numpy.nan
+        rollup.add('a', {'inverter/1': df, 'datamanager:/dc/f0056cc6/': df[['ts']]})
+        rollup.add('b', {'inverter/1': self.samples(days=2)})
+        days = rollup.rollup('day', from_date=datetime.datetime(2017, 10, 28), hosts=['a'])
+        self.assertEqual(list(days['host']), ['a'])
+        self.assertEqual(list(days['samples']), [288])
+        self.assertEqual(list(rollup.rollup('day', to_date=datetime.datetime(2017, 10, 28))['samples']), [278, 288])
+        self.assertRaises(ValueError, rollup.rollup, 'week')
+
+    def test_store_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            rollup = FroniusEnergyRollup('Europe/Vienna', directory)
+            rollup.add('192.168.0.2:80', {'inverter/1': self.samples()})
+            rollup.save()
+            self.assert_same_totals(FroniusEnergyRollup('Europe/Vienna', directory), rollup)
+
+            # totals of another timezone are recomputed from the raw samples
+            expected = FroniusEnergyRollup('UTC')
+            expected.add('192.168.0.2:80', {'inverter/1': self.samples()})
+            self.assert_same_totals(FroniusEnergyRollup('UTC', directory), expected)
+
+
+class FroniusArchiveBatchTests(unittest.TestCase):
+    def concat(self, responses):
+        fi = FroniusInverter("localhost")
+        return fi._concat_frames(fi._iter_archive_frames(responses, None, None, False))
+
+    def assert_matches_concat(self, responses):
+        expected = self.concat(responses)
+        actual = FroniusArchiveBatch(responses).data()
+        self.assertEqual(list(actual), list(expected))
+        for key, value in expected.items():
+            pandas.testing.assert_frame_equal(value.reset_index(drop=True), actual[key])
+
+    def test_consecutive_windows(self):
+        start = datetime.datetime(2017, 10, 1, tzinfo=datetime.timezone.utc)
+        self.assert_matches_concat([make_archive_json(days=1, start=start + datetime.timedelta(days=i))
+                                    for i in range(5)])
+
+    def test_overlapping_windows_keep_duplicates(self):
+        start = datetime.datetime(2017, 10, 1, tzinfo=datetime.timezone.utc)
+        responses = [make_archive_json(days=2, channels=['TimeSpanInSec'], start=start + datetime.timedelta(days=i))
+                     for i in range(4)]
+        self.assert_matches_concat(responses)
+        df = FroniusArchiveBatch(responses).data()['inverter/1']
+        self.assertEqual(len(df), 4 * 2 * 288)
+        self.assertTrue(df['ts'].is_monotonic_increasing)
+
+    def test_devices_and_missing_channels(self):
+        json_with_channel = copy.deepcopy(archive_json)
+        json_with_channel['Body']['Data']['inverter/1']['Data']['Current_AC_Phase_1'] = {
+            'Unit': '1A', 'Values': {'1800': 1.5, '99': 2.5}}
+        self.assert_matches_concat([archive_json, json_with_channel])
+        self.assert_matches_concat([json_with_channel, archive_json])
+
+    def test_reads_files_and_skips_errors(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'archive.json')
+            with open(path, 'w') as f:
+                json.dump(archive_json, f)
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always")
+                batch = FroniusArchiveBatch([path, error_json])
+        self.assertEqual((batch.responses, batch.errors), (1, 1))
+        self.assertEqual(len(caught), 1)
+        self.assertEqual(len(batch.data()['inverter/1']), 20)
+
+    def test_dtypes(self):
+        df = FroniusArchiveBatch([make_archive_json(days=1)]).data(dtypes=True)['inverter/1']
+        self.assertEqual(str(df['TimeSpanInSec'].dtype), 'Int32')
+
+class FroniusBackfillDecodeTests(unittest.TestCase):
+    def test_buffers_round_trip(self):
+        json_with_na = copy.deepcopy(archive_json)
+        json_with_na['Body']['Data']['inverter/1']['Data']['Current_AC_Phase_1'] = {'Unit': '1A',
+                                                                                    'Values': {'1800': 1.5, '99': 2.5}}
+        content = json.dumps(json_with_na).encode()
+        from_date = dateutil.parser.parse('2017-10-25T00:00:00+02:00')
+        to_date = from_date + datetime.timedelta(days=1)
+        error_status, devices = fronius._decode_archive_window(content, from_date, to_date, True)
+        self.assertIsNone(error_status)
+        timestamps, columns = devices['inverter/1']
+        self.assertEqual(timestamps.dtype, numpy.int64)
+        self.assertIsNotNone(columns['TimeSpanInSec'][1])
+        self.assertIsNone(columns['Current_AC_Phase_1'][1])
+
+        backfill = FroniusBackfill(dtypes=True, index=True)
+        expected = FroniusArchiveJson(json_with_na).data(dtypes=True, index=True)
+        for key, df in backfill._frames([(error_status, devices)]).items():
+            pandas.testing.assert_frame_equal(df, expected[key])
+
+    def test_error_stops(self):
+        content = json.dumps(archive_json).encode()
+        from_date = dateutil.parser.parse('2017-10-25T00:00:00+02:00')
+        window = fronius._decode_archive_window(content, from_date, from_date + datetime.timedelta(days=1))
+        error = fronius._decode_archive_window(json.dumps(error_json).encode(), from_date, from_date)
+        self.assertEqual(error, (error_json['Head']['Status'], {}))
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            frames = FroniusBackfill()._frames([window, error, window])
+            self.assertIsNone(FroniusBackfill()._frames([error]))
+        self.assertEqual(len(caught), 2)
+        self.assertEqual(len(frames['inverter/1']), len(FroniusArchiveJson(archive_json).data()['inverter/1']))
+
+
+class FroniusJsonDecoderTests(unittest.TestCase):
+    def test_decodes_bytes(self):
+        content = json.dumps(archive_json).encode()
+        self.assertEqual(FroniusJsonDecoder()(content), archive_json)
+        self.assertEqual(FroniusJsonDecoder(loads=json.loads)(content), archive_json)
+
+    def test_default_loads(self):
+        expected = fronius.orjson.loads if fronius.orjson is not None else json.loads
+        self.assertIs(FroniusJsonDecoder().loads, expected)
+
+    def test_skip_keys(self):
+        decoder = FroniusJsonDecoder(skip_keys=("_comment", "Unit"))
+        self.assertEqual(decoder(b'{"Unit": "W", "Values": {"0": 1}, "_comment": "channelId=0"}'), {'Values': {'0': 1}})
+        self.assertEqual(decoder(b'{"a": {"_comment": "x", "Unit": "y"}, "Unit" : "z\\"" }'), {'a': {}})
+        self.assertEqual(decoder(b'{"Unit": 3}'), {'Unit': 3})
+
+    def test_skip_adjacent_keys(self):
+        decoder = FroniusJsonDecoder(skip_keys=("_comment", "Unit"))
+        self.assertEqual(decoder(b'{"a":1,"_comment":"x","Unit":"y"}'), {'a': 1})
+        self.assertEqual(decoder(b'{"Values":{"1":2},"Unit":"W","_comment":"c"}'), {'Values': {'1': 2}})
+        self.assertEqual(decoder(b'{"_comment":"c" , "Unit":"W" ,"a":1}'), {'a': 1})
+        self.assertEqual(decoder(b'{"a":[{"Unit":"W"},{"_comment":"c"}],"Unit":"W"}'), {'a': [{}, {}]})
+
+    def test_skip_keys_keeps_archive_data(self):
+        content = json.dumps(make_archive_json(days=1), indent=2).encode()
+        decoded = FroniusJsonDecoder(skip_keys=("_comment", "Unit"))(content)
+        self.assertEqual(set(decoded['Body']['Data']['inverter/1']['Data']['TimeSpanInSec']), {'Values'})
+        expected = FroniusArchiveJson(json.loads(content)).data()
+        for key, value in FroniusArchiveJson(decoded).data().items():
+            pandas.testing.assert_frame_equal(value, expected[key])
+
+
+class FroniusWindowSizerTests(unittest.TestCase):
+    key = ('localhost', ('TimeSpanInSec',))
+
+    def test_split_and_bisect(self):
+        days = datetime.timedelta(days=1)
+        sizer = FroniusWindowSizer()
+        self.assertEqual(sizer.size(self.key, 15 * days), 15 * days)
+        sizer.failure(self.key, 15 * days)
+        self.assertEqual(sizer.size(self.key, 15 * days), 7.5 * days)
+        sizer.success(self.key, 7.5 * days)
+        self.assertEqual(sizer.size(self.key, 15 * days), 11.25 * days)
+        sizer.success(self.key, 11.25 * days)
+        sizer.success(self.key, 13.125 * days)
+        self.assertEqual(sizer.size(self.key, 15 * days), 13.125 * days)
+        counters = sizer.stats().iloc[0]
+        self.assertEqual((counters['requests'], counters['errors'], counters['splits'], counters['grows']),
+                         (4, 1, 1, 2))
+
+    def test_min_size(self):
+        sizer = FroniusWindowSizer(min_size=datetime.timedelta(days=2))
+        sizer.size(self.key, datetime.timedelta(days=3))
+        sizer.failure(self.key, datetime.timedelta(days=3))
+        self.assertEqual(sizer.size(self.key, None), datetime.timedelta(days=2))
+
+    def test_size_that_failed_is_not_tried_again(self):
+        days = datetime.timedelta(days=1)
+        sizer = FroniusWindowSizer()
+        sizer.size(self.key, 4 * days)
+        sizer.success(self.key, 4 * days)
+        sizer.failure(self.key, 4 * days)
+        sizer.success(self.key, 2 * days)
+        self.assertEqual(sizer.size(self.key, None), 3 * days)
+
+class FroniusMetricsTests(unittest.TestCase):
+    def test_observe_and_frame(self):
+        observed = []
+        metrics = FroniusMetrics(callback=lambda name, value, labels: observed.append((name, value, labels)))
+        metrics.observe('request_seconds', 0.5, host='a', endpoint='x')
+        metrics.observe('request_seconds', 1.5, host='a', endpoint='x')
+        metrics.observe('request_seconds', 1.0, host='b', endpoint='x')
+        self.assertEqual(len(observed), 3)
+        self.assertEqual(observed[0], ('request_seconds', 0.5, {'host': 'a', 'endpoint': 'x'}))
+        df = metrics.frame().set_index('host')
+        self.assertEqual(df.loc['a', 'count'], 2)
+        self.assertEqual(df.loc['a', 'max'], 1.5)
+        self.assertEqual(df.loc['a', 'mean'], 1.0)
+
+    def test_prometheus(self):
+        metrics = FroniusMetrics()
+        metrics.observe('request_seconds', 0.5, host='a"b', endpoint='x')
+        metrics.observe('data_rows', 3)
+        self.assertEqual(metrics.prometheus().splitlines(), [
+            '# TYPE fronius_data_rows summary',
+            'fronius_data_rows_count 1',
+            'fronius_data_rows_sum 3.0',
+            '# TYPE fronius_data_rows_max gauge',
+            'fronius_data_rows_max 3.0',
+            '# TYPE fronius_request_seconds summary',
+            'fronius_request_seconds_count{endpoint="x",host="a\\"b"} 1',
+            'fronius_request_seconds_sum{endpoint="x",host="a\\"b"} 0.5',
+            '# TYPE fronius_request_seconds_max gauge',
+            'fronius_request_seconds_max{endpoint="x",host="a\\"b"} 0.5'])
+
+    def test_write(self):
+        metrics = FroniusMetrics()
+        metrics.observe('data_rows', 3)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'fronius.prom')
+            metrics.write(path)
+            with open(path) as f:
+                self.assertEqual(f.read(), metrics.prometheus())
+            self.assertEqual(os.listdir(directory), ['fronius.prom'])
+
+    def test_archive_data_is_observed(self):
+        metrics = FroniusMetrics()
+        data = FroniusArchiveJson(archive_json, metrics, 'inverter').data()
+        df = metrics.frame().set_index('name')
+        self.assertEqual(df.loc['data_rows', 'sum'], sum(len(df) for df in data.values()))
+        self.assertEqual(df.loc['data_seconds', 'host'], 'inverter')
+
 class FroniusInverternUnitTests(unittest.TestCase):
     def test_class_get_channels(self):
         self.assertEqual(len(FroniusInverter.get_all_channels()), 24)
 
+    def test_class_channel_devices_cover_all_channels(self):
+        channels = [channel for names in FroniusInverter.channel_devices.values() for channel in names]
+        self.assertEqual(sorted(channels), sorted(FroniusInverter.get_all_channels()))
+
+    def test_plan_historical_data(self):
+        self.assertEqual(FroniusInverter.plan_historical_data().channels(), FroniusInverter.get_all_channels())
+        plan = FroniusInverter.plan_historical_data(['Radiation'], metrics=['realtime', 'energy'])
+        self.assertEqual(list(plan.groups.values()),
+                         [['Radiation', 'PowerReal_PAC_Sum', 'EnergyReal_WAC_Sum_Produced']])
+        plan = FroniusInverter.plan_historical_data(['Radiation', 'Unknown_Channel'], metrics=['realtime'], split=True)
+        self.assertEqual(plan.groups, {'sensorcard': ['Radiation'],
+                                       'inverter': ['Unknown_Channel', 'PowerReal_PAC_Sum',
+                                                    'EnergyReal_WAC_Sum_Produced']})
+        with self.assertRaises(ValueError):
+            FroniusInverter.plan_historical_data(metrics=['unknown'])
+
+    def test_class_get_channel_dtypes(self):
+        dtypes = FroniusInverter.get_channel_dtypes()
+        self.assertEqual(set(dtypes), set(FroniusInverter.get_all_channels()))
+        self.assertEqual(dtypes['TimeSpanInSec'], 'Int32')
+        self.assertEqual(dtypes['Digital_Channel_1'], 'Int8')
+        self.assertEqual(dtypes['EnergyReal_WAC_Plus_Absolute'], 'float64')
+        self.assertEqual(dtypes['PowerReal_PAC_Sum'], 'float32')
+
+    def merge_windows(self, starts, days=1):
+        fi = FroniusInverter("localhost")
+        responses = [make_archive_json(days=days, channels=['TimeSpanInSec', 'Current_AC_Phase_1'], start=start)
+                     for start in starts]
+        from_date = starts[0] + datetime.timedelta(hours=1)
+        to_date = starts[-1] + datetime.timedelta(days=days, hours=-1)
+        expected = legacy_merge_windows(fi, responses, from_date, to_date)
+        actual = fi._concat_frames(fi._iter_archive_frames(responses, from_date, to_date, False),
+                                   from_date, to_date, True)
+        for key, value in expected.items():
+            pandas.testing.assert_frame_equal(value.reset_index(drop=True), actual[key].reset_index(drop=True))
+        return actual
+
+    def test_merge_consecutive_windows(self):
+        start = datetime.datetime(2017, 10, 1, tzinfo=datetime.timezone.utc)
+        data = self.merge_windows([start + datetime.timedelta(days=i) for i in range(5)])
+        self.assertEqual(len(data['inverter/1']), 5 * 288 - 24)
+        self.assertTrue(data['inverter/1']['ts'].is_monotonic_increasing)
+
+    def test_merge_overlapping_windows(self):
+        start = datetime.datetime(2017, 10, 1, tzinfo=datetime.timezone.utc)
+        data = self.merge_windows([start + datetime.timedelta(days=i) for i in range(4)], days=2)
+        self.assertTrue(data['inverter/1']['ts'].is_monotonic_increasing)
+
+    def test_merge_time_indexed_windows(self):
+        fi = FroniusInverter("localhost")
+        start = datetime.datetime(2017, 10, 1, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+        starts = [start + datetime.timedelta(days=i) for i in range(4)]
+        responses = [make_archive_json(days=2, channels=['TimeSpanInSec'], start=s) for s in starts]
+        from_date, to_date = starts[0] + datetime.timedelta(hours=1), starts[-1] + datetime.timedelta(days=1)
+        expected = fi._concat_frames(fi._iter_archive_frames(responses, from_date, to_date, False),
+                                     from_date, to_date, True)['inverter/1']
+        actual = fi._concat_frames(fi._iter_archive_frames(responses, from_date, to_date, False, index=True),
+                                   from_date, to_date, True)['inverter/1']
+        self.assertTrue(actual.index.is_monotonic_increasing)
+        self.assertEqual(actual.index[0], from_date)
+        self.assertLess(actual.index[-1], to_date)
+        self.assertEqual(list(actual.index), list(expected['ts']))
+        self.assertEqual(list(actual['TimeSpanInSec']), list(expected['TimeSpanInSec']))
+
 
 if __name__ == '__main__':
     unittest.main()